@@ -0,0 +1,128 @@
+#!/bin/bash
+# First-boot LUKS re-key
+#
+# Purpose: Replace the build-time keyslot parameters of LUKS2 volumes with
+# ones calibrated on this device. The lvmrootfs WIC plugin formats images
+# with luks-pbkdf=build (pbkdf2, 1000 iterations, no benchmark on the build
+# host) and marks them with the LUKS2 subsystem "luks-rekey". For each
+# marked volume this script:
+#   1. converts keyslot 0 with `cryptsetup luksConvertKey`, which benchmarks
+#      LUKS_REKEY_PBKDF for LUKS_REKEY_ITER_TIME ms on this device
+#   2. with LUKS_REKEY_MODE=tpm2, enrolls a TPM2 key bound to
+#      LUKS_REKEY_TPM2_PCRS and, with LUKS_REKEY_WIPE_PASSWORD=1, wipes the
+#      passphrase keyslot instead of converting it
+#   3. clears the mark, so later boots skip the volume
+# A volume that fails keeps its mark and is retried on the next boot. A
+# volume whose keyslot does not open with the empty passphrase needs
+# LUKS_REKEY_KEY_FILE: without one it is reported once and then skipped
+# (stamp in /var/lib/luks-rekey) until a key file is configured.
+#
+# Usage: luks-rekey [DEVICE...]   (default: every LUKS volume; settings
+#                                  from /etc/default/luks-rekey)
+
+set -o pipefail
+
+MARK="luks-rekey"
+MODE="${LUKS_REKEY_MODE:-pbkdf}"
+PBKDF="${LUKS_REKEY_PBKDF:-argon2id}"
+ITER_TIME="${LUKS_REKEY_ITER_TIME:-2000}"
+MEMORY="${LUKS_REKEY_MEMORY:-}"
+PARALLEL="${LUKS_REKEY_PARALLEL:-}"
+KEY_FILE="${LUKS_REKEY_KEY_FILE:-}"
+TPM2_PCRS="${LUKS_REKEY_TPM2_PCRS:-7}"
+WIPE_PASSWORD="${LUKS_REKEY_WIPE_PASSWORD:-0}"
+BUILD_SLOT=0
+STATE_DIR="${STATE_DIRECTORY:-/var/lib/luks-rekey}"
+
+log() {
+    echo "luks-rekey: $*"
+}
+
+# Run a cryptsetup command that needs the build passphrase
+with_passphrase() {
+    if [ -n "$KEY_FILE" ]; then
+        "$@" --key-file "$KEY_FILE"
+    else
+        echo "" | "$@"
+    fi
+}
+
+# The build keyslot opens with the empty passphrase (luks-passphrase=NULL)
+empty_passphrase() {
+    echo "" | cryptsetup open --test-passphrase --key-slot "$BUILD_SLOT" "$1" 2>/dev/null
+}
+
+marked() {
+    [ "$(cryptsetup luksDump "$1" 2>/dev/null | sed -n 's/^Subsystem:[[:space:]]*//p')" = "$MARK" ]
+}
+
+convert_keyslot() {
+    local dev="$1"
+    local args=(--key-slot "$BUILD_SLOT" --pbkdf "$PBKDF" --iter-time "$ITER_TIME")
+    [ -n "$MEMORY" ] && args+=(--pbkdf-memory "$MEMORY")
+    [ -n "$PARALLEL" ] && args+=(--pbkdf-parallel "$PARALLEL")
+    with_passphrase cryptsetup luksConvertKey "${args[@]}" "$dev"
+}
+
+enroll_tpm2() {
+    local dev="$1" unlock="$KEY_FILE" status
+    if [ -z "$unlock" ]; then
+        # The build passphrase is empty; systemd-cryptenroll reads it from a file
+        unlock="$(mktemp /run/luks-rekey.XXXXXX)" || return 1
+    fi
+    systemd-cryptenroll --unlock-key-file="$unlock" --tpm2-device=auto \
+        --tpm2-pcrs="$TPM2_PCRS" "$dev"
+    status=$?
+    [ -z "$KEY_FILE" ] && rm -f "$unlock"
+    return $status
+}
+
+rekey() {
+    local dev="$1"
+    local start=$SECONDS
+    case "$MODE" in
+        pbkdf)
+            convert_keyslot "$dev" || return 1
+            ;;
+        tpm2)
+            enroll_tpm2 "$dev" || return 1
+            if [ "$WIPE_PASSWORD" = "1" ]; then
+                cryptsetup -q luksKillSlot "$dev" "$BUILD_SLOT" || return 1
+            else
+                convert_keyslot "$dev" || return 1
+            fi
+            ;;
+        *)
+            log "unknown LUKS_REKEY_MODE '$MODE' (expected pbkdf or tpm2)"
+            return 1
+            ;;
+    esac
+    cryptsetup config --subsystem "" "$dev" || return 1
+    log "$dev re-keyed ($MODE, $PBKDF, $ITER_TIME ms) in $((SECONDS - start))s"
+}
+
+if [ $# -gt 0 ]; then
+    devices=("$@")
+else
+    mapfile -t devices < <(blkid -c /dev/null -t TYPE=crypto_LUKS -o device)
+fi
+
+status=0
+for dev in "${devices[@]}"; do
+    marked "$dev" || continue
+    if [ -z "$KEY_FILE" ] && ! empty_passphrase "$dev"; then
+        stamp="$STATE_DIR/$(cryptsetup luksUUID "$dev").no-key"
+        if [ ! -e "$stamp" ]; then
+            log "error: $dev: keyslot $BUILD_SLOT does not open with the empty passphrase;" \
+                "set LUKS_REKEY_KEY_FILE in /etc/default/luks-rekey to re-key it"
+            mkdir -p "$STATE_DIR" && touch "$stamp"
+        fi
+        continue
+    fi
+    log "$dev was formatted with the build-time PBKDF profile"
+    if ! rekey "$dev"; then
+        log "$dev: re-key failed, keeping the mark for the next boot"
+        status=1
+    fi
+done
+exit $status
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Smoke test of the OSTree update agent against a local HTTP-served repo
+
+Builds an archive repository with one commit, serves it with
+`python3 -m http.server` and runs the agent on a separate client repo whose
+remote points at it, one run per test, in order:
+
+  1. the first run pulls the commit and reports bytes, requests and objects
+  2. a second run only revalidates the summary (304) and pulls nothing
+  3. a new commit is detected and pulled
+  4. with the server gone the run fails and schedules a backed-off retry;
+     the next run inside the backoff window is deferred without traffic
+  5. a 503 with Retry-After pushes the next attempt past the backoff
+
+Every run is checked through the agent's state file and its Prometheus
+textfile. Needs ostree; the agent is OSTREE_UPDATE_AGENT, else the
+ostree-update-agent.py next to this file, else ostree-update-agent in PATH.
+Runs as the ostree-update-agent ptest (run-ptest).
+
+Usage: python3 ostree-update-agent-test.py [-v]
+"""
+
+import http.server
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+from typing import Dict, List
+
+REF = 'distro/smoketest'
+REMOTE = 'origin'
+BACKOFF_MIN = 60
+BACKOFF_MAX = 120
+
+
+def _agent() -> List[str]:
+    path = os.environ.get('OSTREE_UPDATE_AGENT')
+    if not path:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ostree-update-agent.py')
+    if not os.path.exists(path):
+        path = shutil.which('ostree-update-agent') or path
+    return [sys.executable, path]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _env() -> Dict[str, str]:
+    """Environment without proxy settings of the host"""
+    return {k: v for k, v in os.environ.items()
+            if k.lower() not in ('http_proxy', 'https_proxy', 'all_proxy', 'no_proxy')}
+
+
+def ostree(repo: str, *args: str) -> str:
+    return subprocess.run(['ostree', f'--repo={repo}'] + list(args), check=True, env=_env(),
+                          stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+
+
+def read_metrics(path: str) -> Dict[str, float]:
+    """'name{labels}' -> value of a Prometheus textfile"""
+    metrics = {}
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                metrics[name] = float(value)
+    return metrics
+
+
+class _RetryAfterHandler(http.server.BaseHTTPRequestHandler):
+    """Every request: 503 Service Unavailable, Retry-After one hour"""
+
+    def do_GET(self):
+        self.send_response(503)
+        self.send_header('Retry-After', '3600')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@unittest.skipUnless(shutil.which('ostree'), "ostree not installed")
+class UpdateAgentSmokeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp(prefix='ostree-update-agent-test.')
+        cls.server_repo = os.path.join(cls.tmp, 'server')
+        cls.client_repo = os.path.join(cls.tmp, 'client')
+        cls.state_dir = os.path.join(cls.tmp, 'state')
+        cls.metrics = os.path.join(cls.state_dir, 'metrics.prom')
+        ostree(cls.server_repo, 'init', '--mode=archive')
+        cls.commits = [cls.commit('first')]
+        cls.port = _free_port()
+        cls.server = subprocess.Popen([sys.executable, '-m', 'http.server', '--bind', '127.0.0.1',
+                                       '--directory', cls.server_repo, str(cls.port)],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        cls.url = f'http://127.0.0.1:{cls.port}'
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                urllib.request.urlopen(cls.url + '/config', timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        ostree(cls.client_repo, 'init', '--mode=bare-user')
+        ostree(cls.client_repo, 'remote', 'add', '--no-gpg-verify', REMOTE, cls.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait()
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    @classmethod
+    def commit(cls, content: str) -> str:
+        """Commit a tree with one incompressible file and publish the summary"""
+        tree = os.path.join(cls.tmp, 'tree')
+        os.makedirs(tree, exist_ok=True)
+        with open(os.path.join(tree, 'version'), 'wb') as f:
+            f.write(content.encode() + b'\n' + os.urandom(65536))
+        checksum = ostree(cls.server_repo, 'commit', f'--branch={REF}', f'--subject={content}',
+                          f'--tree=dir={tree}')
+        ostree(cls.server_repo, 'summary', '-u')
+        # http.server answers If-Modified-Since with a resolution of one
+        # second; make every new summary visibly newer than the last one
+        summary = os.path.join(cls.server_repo, 'summary')
+        stamp = time.time() + 2 * len(getattr(cls, 'commits', ()))
+        os.utime(summary, (stamp, stamp))
+        return checksum
+
+    def run_agent(self, *args: str) -> subprocess.CompletedProcess:
+        """One agent run; its log is in stdout, for assertion messages"""
+        return subprocess.run(_agent() + [
+            f'--repo={self.client_repo}', f'--refspec={REMOTE}:{REF}', f'--state-dir={self.state_dir}',
+            f'--backoff-min={BACKOFF_MIN}', f'--backoff-max={BACKOFF_MAX}'] + list(args),
+            env=_env(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+    def state(self) -> Dict:
+        with open(os.path.join(self.state_dir, 'state.json'), 'r') as f:
+            return json.load(f)
+
+    def assertResult(self, metrics: Dict[str, float], result: str):
+        for name in ('unchanged', 'updated', 'deferred', 'failed'):
+            self.assertEqual(metrics[f'ostree_update_last_result{{result="{name}"}}'],
+                             1 if name == result else 0, name)
+
+    def test_1_first_pull(self):
+        result = self.run_agent()
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertEqual(self.state()['pulled'], self.commits[0])
+        self.assertEqual(ostree(self.client_repo, 'rev-parse', f'{REMOTE}:{REF}'), self.commits[0])
+        metrics = read_metrics(self.metrics)
+        self.assertResult(metrics, 'updated')
+        self.assertGreater(metrics['ostree_update_last_bytes'], 65536)
+        self.assertGreater(metrics['ostree_update_last_requests'], 1)
+        self.assertGreater(metrics['ostree_update_last_objects{type="metadata"}']
+                           + metrics['ostree_update_last_objects{type="content"}']
+                           + metrics['ostree_update_last_objects{type="delta-part"}'], 0)
+        self.assertEqual(metrics['ostree_update_runs_total{result="updated"}'], 1)
+        self.assertEqual(metrics['ostree_update_bytes_total'], metrics['ostree_update_last_bytes'])
+
+    def test_2_unchanged(self):
+        total = read_metrics(self.metrics)['ostree_update_bytes_total']
+        result = self.run_agent()
+        self.assertEqual(result.returncode, 0, result.stdout)
+        metrics = read_metrics(self.metrics)
+        self.assertResult(metrics, 'unchanged')
+        # Only the conditional GET of the summary, answered 304
+        self.assertEqual(metrics['ostree_update_last_requests'], 1)
+        self.assertEqual(metrics['ostree_update_last_bytes'], 0)
+        self.assertEqual(metrics['ostree_update_bytes_total'], total)
+        self.assertEqual(metrics['ostree_update_runs_total{result="unchanged"}'], 1)
+
+    def test_3_new_commit(self):
+        self.commits.append(self.commit('second'))
+        result = self.run_agent()
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertEqual(self.state()['pulled'], self.commits[1])
+        self.assertEqual(ostree(self.client_repo, 'rev-parse', f'{REMOTE}:{REF}'), self.commits[1])
+        metrics = read_metrics(self.metrics)
+        self.assertResult(metrics, 'updated')
+        self.assertGreater(metrics['ostree_update_last_bytes'], 0)
+        self.assertEqual(metrics['ostree_update_runs_total{result="updated"}'], 2)
+        self.assertEqual(metrics['ostree_update_consecutive_failures'], 0)
+
+    def test_4_backoff(self):
+        self.server.terminate()
+        self.server.wait()
+        self.commits.append(self.commit('third'))
+        before = time.time()
+        result = self.run_agent()
+        self.assertEqual(result.returncode, 1, result.stdout)
+        metrics = read_metrics(self.metrics)
+        self.assertResult(metrics, 'failed')
+        self.assertEqual(metrics['ostree_update_consecutive_failures'], 1)
+        # backoff-min with +-50% jitter
+        next_attempt = metrics['ostree_update_next_attempt_timestamp_seconds']
+        self.assertGreaterEqual(next_attempt, before + BACKOFF_MIN * 0.5)
+        self.assertLessEqual(next_attempt, time.time() + BACKOFF_MIN * 1.5)
+
+        result = self.run_agent()
+        self.assertEqual(result.returncode, 0, result.stdout)
+        metrics = read_metrics(self.metrics)
+        self.assertResult(metrics, 'deferred')
+        self.assertEqual(metrics['ostree_update_last_requests'], 0)
+        self.assertEqual(metrics['ostree_update_next_attempt_timestamp_seconds'], next_attempt)
+        self.assertEqual(metrics['ostree_update_runs_total{result="deferred"}'], 1)
+        self.assertEqual(self.state()['pulled'], self.commits[1])
+
+    def test_5_retry_after(self):
+        server = http.server.HTTPServer(('127.0.0.1', self.port), _RetryAfterHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            before = time.time()
+            result = self.run_agent('--force')
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(result.returncode, 1, result.stdout)
+        metrics = read_metrics(self.metrics)
+        self.assertResult(metrics, 'failed')
+        self.assertEqual(metrics['ostree_update_consecutive_failures'], 2)
+        # Retry-After: 3600 outweighs backoff-max
+        self.assertGreaterEqual(metrics['ostree_update_next_attempt_timestamp_seconds'], before + 3600)
+        self.assertEqual(metrics['ostree_update_runs_total{result="failed"}'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+OSTree update agent
+
+Replaces the bare `ostree pull` that ran on a fixed 4 h timer. Each run:
+
+  1. backs off: after failed runs, and when the server answered 429/503
+     with Retry-After, runs before the next allowed attempt do nothing;
+     the delay doubles per consecutive failure, with random jitter, so a
+     fleet that failed together does not retry together
+  2. checks for a change: a conditional GET of the remote's summary
+     (If-None-Match / If-Modified-Since, then its sha256) and, when that
+     changed, a commit-metadata-only pull; nothing is pulled when the new
+     head is the booted, a deployed or the last pulled commit
+  3. pulls the new commit pinned by checksum, from the first reachable
+     LAN mirror (UPDATE_MIRRORS, `ostree pull --url`) and else from the
+     remote itself; static deltas are used when the summary lists them
+  4. writes metrics: bytes, requests, objects, duration and result of the
+     run and running totals, as a Prometheus textfile (node_exporter's
+     textfile collector reads it) next to a JSON state file
+
+All HTTP traffic of a run, its own and that of the ostree subprocesses
+(through http_proxy/https_proxy), goes through a local proxy that counts
+it and caps it to UPDATE_RATE_LIMIT KiB/s. A remote with its own `proxy`
+option bypasses the proxy: its bytes are then taken from ostree's output
+and it is not rate limited.
+
+The timer spreads runs over the fleet (RandomizedDelaySec with
+FixedRandomDelay), so devices booted together do not check together.
+Pulling does not deploy; `ostree admin deploy` stays a separate step.
+
+Settings come from /etc/default/ostree-update-agent (UPDATE_* variables)
+or the command line; --repo, --refspec and --state-dir make it runnable
+against any repository, e.g. a local one whose remote is served by
+`python3 -m http.server`.
+
+Usage: ostree-update-agent [--repo PATH] [--refspec REMOTE:REF]
+           [--rate-limit KIB] [--mirror URL ...] [--state-dir DIR]
+           [--metrics FILE] [--backoff-min S] [--backoff-max S] [--force]
+"""
+
+import configparser
+import hashlib
+import http.client
+import http.server
+import json
+import os
+import random
+import re
+import select
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+COPY_SIZE = 64 * 1024
+PROBE_TIMEOUT = 5
+HTTP_TIMEOUT = 60
+CHECKSUM = re.compile(r'^[0-9a-f]{64}$')
+PULL_OBJECTS = re.compile(r'(\d+) metadata, (\d+) content objects fetched')
+PULL_DELTAS = re.compile(r'(\d+) delta parts?, (\d+) loose fetched')
+PULL_BYTES = re.compile(r'([\d.]+) (bytes|B|kB|KiB|MB|MiB|GB|GiB) transferred')
+UNITS = {'bytes': 1, 'B': 1, 'kB': 1000, 'KiB': 1024, 'MB': 1000 ** 2, 'MiB': 1024 ** 2,
+         'GB': 1000 ** 3, 'GiB': 1024 ** 3}
+RESULTS = ('unchanged', 'updated', 'deferred', 'failed')
+
+
+def log(message: str):
+    print(f"ostree-update-agent: {message}", flush=True)
+
+
+class RateLimiter:
+    """Byte budget shared by every connection of the proxy (0: unlimited)"""
+
+    def __init__(self, bytes_per_second: int):
+        self.rate = bytes_per_second
+        self.lock = threading.Lock()
+        self.next = time.monotonic()
+
+    def consume(self, size: int):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            # Allow up to a second of burst after an idle period
+            self.next = max(self.next, now - 1.0) + size / self.rate
+            delay = self.next - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class TrafficStats:
+    """What went over the proxy"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.requests = 0
+        self.retry_after: Optional[float] = None
+
+    def add(self, size: int = 0, requests: int = 0):
+        with self.lock:
+            self.bytes += size
+            self.requests += requests
+
+    def note_retry_after(self, value: Optional[str]):
+        seconds = _retry_after_seconds(value)
+        if seconds is not None:
+            with self.lock:
+                self.retry_after = max(self.retry_after or 0, seconds)
+
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value.strip())
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _ProxyHandler(http.server.BaseHTTPRequestHandler):
+    """Forwarding proxy: absolute-URI GET/HEAD and CONNECT tunnels"""
+
+    protocol_version = 'HTTP/1.1'
+    hop_headers = ('connection', 'keep-alive', 'proxy-connection', 'proxy-authorization',
+                   'te', 'trailer', 'transfer-encoding', 'upgrade')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _relay(self, data: bytes):
+        self.server.limiter.consume(len(data))
+        self.server.stats.add(len(data))
+        self.wfile.write(data)
+
+    def _forward(self, body: bool):
+        url = urllib.parse.urlsplit(self.path)
+        if url.scheme != 'http' or not url.hostname:
+            self.send_error(400, "absolute http:// URL expected")
+            return
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in self.hop_headers}
+        upstream = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=HTTP_TIMEOUT)
+        try:
+            upstream.request(self.command, path, headers=headers)
+            response = upstream.getresponse()
+            self.server.stats.add(requests=1)
+            if response.status in (429, 503):
+                self.server.stats.note_retry_after(response.getheader('Retry-After'))
+            self.send_response(response.status, response.reason)
+            for key, value in response.getheaders():
+                if key.lower() not in self.hop_headers:
+                    self.send_header(key, value)
+            chunked = body and response.getheader('Content-Length') is None and response.status != 304
+            if chunked:
+                self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            while body:
+                data = response.read(COPY_SIZE)
+                if not data:
+                    break
+                if chunked:
+                    self.wfile.write(b'%x\r\n' % len(data))
+                self._relay(data)
+                if chunked:
+                    self.wfile.write(b'\r\n')
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except (OSError, http.client.HTTPException) as e:
+            self.send_error(502, str(e))
+            self.close_connection = True
+        finally:
+            upstream.close()
+
+    def do_GET(self):
+        self._forward(body=True)
+
+    def do_HEAD(self):
+        self._forward(body=False)
+
+    def do_CONNECT(self):
+        host, _, port = self.path.rpartition(':')
+        try:
+            upstream = socket.create_connection((host, int(port)), timeout=HTTP_TIMEOUT)
+        except (OSError, ValueError) as e:
+            self.send_error(502, str(e))
+            return
+        self.send_response(200, 'Connection established')
+        self.end_headers()
+        self.server.stats.add(requests=1)
+        self.close_connection = True
+        client = self.connection
+        with upstream:
+            sockets = [client, upstream]
+            while True:
+                readable, _, _ = select.select(sockets, [], [], HTTP_TIMEOUT)
+                if not readable:
+                    break
+                for sock in readable:
+                    data = sock.recv(COPY_SIZE)
+                    if not data:
+                        return
+                    if sock is upstream:
+                        # TLS: only the download direction is counted and capped
+                        self.server.limiter.consume(len(data))
+                        self.server.stats.add(len(data))
+                        client.sendall(data)
+                    else:
+                        upstream.sendall(data)
+
+
+class TrafficProxy(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Local proxy on 127.0.0.1 for the duration of a run"""
+
+    daemon_threads = True
+
+    def __init__(self, limiter: RateLimiter, stats: TrafficStats):
+        super().__init__(('127.0.0.1', 0), _ProxyHandler)
+        self.limiter = limiter
+        self.stats = stats
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def __enter__(self) -> 'TrafficProxy':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class Ostree:
+    """ostree command line on one repository, through the proxy"""
+
+    def __init__(self, repo: str, proxy: Optional[str] = None):
+        self.repo = repo
+        self.env = dict(os.environ)
+        if proxy:
+            for name in ('http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY'):
+                self.env[name] = proxy
+            self.env.pop('no_proxy', None)
+            self.env.pop('NO_PROXY', None)
+
+    def run(self, *args: str) -> str:
+        command = ['ostree', f'--repo={self.repo}'] + list(args)
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True, env=self.env)
+        if result.returncode != 0:
+            raise Exception(f"{' '.join(command)} failed: {result.stdout.strip()}")
+        return result.stdout
+
+    def rev_parse(self, rev: str) -> Optional[str]:
+        try:
+            checksum = self.run('rev-parse', rev).strip()
+        except Exception:
+            return None
+        return checksum if CHECKSUM.match(checksum) else None
+
+    def remote_url(self, remote: str) -> str:
+        return self.run('remote', 'show-url', remote).strip()
+
+
+def booted_refspec() -> Optional[str]:
+    """refspec of the booted deployment's origin file"""
+    try:
+        with open('/proc/cmdline', 'r') as f:
+            args = f.read().split()
+    except OSError:
+        return None
+    target = next((a.split('=', 1)[1] for a in args if a.startswith('ostree=')), None)
+    if not target:
+        return None
+    origin = configparser.ConfigParser()
+    if not origin.read(os.path.realpath(target).rstrip('/') + '.origin'):
+        return None
+    return origin.get('origin', 'refspec', fallback=None)
+
+
+def deployed_checksums() -> Set[str]:
+    """Commits of the deployments on this system (booted, pending, rollback)"""
+    if not os.path.exists('/run/ostree-booted'):
+        return set()
+    try:
+        output = subprocess.run(['ostree', 'admin', 'status'], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+    except OSError:
+        return set()
+    return set(re.findall(r'^[* ] \S+ ([0-9a-f]{64})\.\d+', output, re.M))
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f'{value:.3f}'
+
+
+def parse_pull_output(output: str) -> Dict:
+    """Objects, delta parts and bytes from `ostree pull` output"""
+    result = {'metadata_objects': 0, 'content_objects': 0, 'delta_parts': 0, 'bytes': 0}
+    match = PULL_OBJECTS.search(output)
+    if match:
+        result['metadata_objects'], result['content_objects'] = int(match.group(1)), int(match.group(2))
+    match = PULL_DELTAS.search(output)
+    if match:
+        result['delta_parts'] = int(match.group(1))
+        result['content_objects'] += int(match.group(2))
+    match = PULL_BYTES.search(output)
+    if match:
+        result['bytes'] = int(float(match.group(1)) * UNITS[match.group(2)])
+    return result
+
+
+class Agent:
+    """One update run"""
+
+    def __init__(self, args):
+        self.args = args
+        self.state_path = os.path.join(args.state_dir, 'state.json')
+        self.state = self._load_state()
+        self.stats = TrafficStats()
+        self.summary: Dict = {}
+
+    def _load_state(self) -> Dict:
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        os.makedirs(self.args.state_dir, exist_ok=True)
+        tmp = f'{self.state_path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.rename(tmp, self.state_path)
+
+    def _backoff(self) -> float:
+        """Delay before the next attempt after this failure"""
+        failures = self.state.get('failures', 0)
+        delay = min(self.args.backoff_max, self.args.backoff_min * 2 ** max(0, failures - 1))
+        delay *= random.uniform(0.5, 1.5)
+        if self.stats.retry_after:
+            delay = max(delay, self.stats.retry_after)
+        return delay
+
+    def _summary_changed(self, opener, url: str) -> bool:
+        """Conditional GET of the summary; False only when it did not change"""
+        request = urllib.request.Request(url.rstrip('/') + '/summary')
+        if self.state.get('summary_etag'):
+            request.add_header('If-None-Match', self.state['summary_etag'])
+        if self.state.get('summary_modified'):
+            request.add_header('If-Modified-Since', self.state['summary_modified'])
+        try:
+            with opener.open(request, timeout=HTTP_TIMEOUT) as response:
+                digest = hashlib.sha256(response.read()).hexdigest()
+                etag, modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return False
+            if e.code == 404:
+                # No summary published: only the commit can tell
+                return True
+            if e.code in (429, 503):
+                self.stats.note_retry_after(e.headers.get('Retry-After'))
+            raise Exception(f"GET {request.full_url}: HTTP {e.code}")
+        except urllib.error.URLError as e:
+            raise Exception(f"GET {request.full_url}: {e.reason}")
+        # Kept once the run succeeds, so a failed pull is retried
+        self.summary = {'summary_sha256': digest, 'summary_etag': etag, 'summary_modified': modified}
+        return digest != self.state.get('summary_sha256')
+
+    def _mirror_reachable(self, opener, mirror: str) -> bool:
+        try:
+            with opener.open(mirror.rstrip('/') + '/config', timeout=PROBE_TIMEOUT) as response:
+                response.read()
+            return True
+        except (urllib.error.URLError, OSError) as e:
+            log(f"mirror {mirror} not reachable: {e}")
+            return False
+
+    def _pull(self, ostree: Ostree, opener, remote: str, ref: str, target: str) -> Tuple[Dict, str]:
+        """Pull target from the first mirror that has it, else from the remote"""
+        errors = []
+        for mirror in self.args.mirror:
+            if not self._mirror_reachable(opener, mirror):
+                continue
+            try:
+                return parse_pull_output(ostree.run('pull', f'--url={mirror}', remote, f'{ref}@{target}')), mirror
+            except Exception as e:
+                errors.append(str(e))
+                log(f"pull from mirror {mirror} failed, trying the next source")
+        try:
+            return parse_pull_output(ostree.run('pull', remote, f'{ref}@{target}')), remote
+        except Exception as e:
+            errors.append(str(e))
+            raise Exception('; '.join(errors))
+
+    def check_and_pull(self, ostree: Ostree, opener, refspec: str) -> Tuple[str, Dict]:
+        remote, _, ref = refspec.rpartition(':')
+        if not remote:
+            raise Exception(f"refspec '{refspec}' has no remote")
+        known = deployed_checksums() | {self.state.get('pulled')}
+        if not self._summary_changed(opener, ostree.remote_url(remote)) and not self.args.force:
+            return 'unchanged', {}
+        ostree.run('pull', '--commit-metadata-only', remote, ref)
+        target = ostree.rev_parse(refspec)
+        if target is None:
+            raise Exception(f"{refspec} did not resolve after fetching its commit")
+        if target in known and not self.args.force:
+            log(f"{refspec} is at {target[:12]}, already pulled")
+            return 'unchanged', {'target': target}
+        log(f"pulling {refspec} {target[:12]}")
+        pull, source = self._pull(ostree, opener, remote, ref, target)
+        self.state['pulled'] = target
+        pull.update(target=target, source=source)
+        return 'updated', pull
+
+    def run(self) -> int:
+        now = time.time()
+        if now < self.state.get('next_attempt', 0) and not self.args.force:
+            log(f"backing off until {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.state['next_attempt']))}")
+            self._finish('deferred', now, {})
+            return 0
+
+        refspec = self.args.refspec or booted_refspec()
+        if not refspec:
+            log("no refspec configured and none found for the booted deployment")
+            self._finish('failed', now, {})
+            return 1
+
+        limiter = RateLimiter(self.args.rate_limit * 1024)
+        start = time.monotonic()
+        try:
+            with TrafficProxy(limiter, self.stats) as proxy:
+                opener = urllib.request.build_opener(
+                    urllib.request.ProxyHandler({'http': proxy.url, 'https': proxy.url}))
+                result, pull = self.check_and_pull(Ostree(self.args.repo, proxy.url), opener, refspec)
+        except Exception as e:
+            log(str(e))
+            self.state['failures'] = self.state.get('failures', 0) + 1
+            delay = self._backoff()
+            self.state['next_attempt'] = time.time() + delay
+            log(f"attempt {self.state['failures']} failed, next attempt in {int(delay)}s")
+            self._finish('failed', now, {'duration': time.monotonic() - start})
+            return 1
+
+        self.state.update(self.summary, failures=0, next_attempt=0)
+        pull['duration'] = time.monotonic() - start
+        if result == 'updated':
+            log(f"pulled {pull['target'][:12]} from {pull['source']}: {self._bytes(pull)} bytes, "
+                f"{pull['metadata_objects'] + pull['content_objects']} objects, "
+                f"{pull['delta_parts']} delta parts, {pull['duration']:.1f}s")
+        self._finish(result, now, pull)
+        return 0
+
+    def _bytes(self, pull: Dict) -> int:
+        # The proxy sees every byte unless the remote has its own proxy set
+        return self.stats.bytes or pull.get('bytes', 0)
+
+    def _finish(self, result: str, started: float, pull: Dict):
+        totals = self.state.setdefault('totals', {})
+        runs = totals.setdefault('runs', {})
+        runs[result] = runs.get(result, 0) + 1
+        size = self._bytes(pull)
+        totals['bytes'] = totals.get('bytes', 0) + size
+        totals['requests'] = totals.get('requests', 0) + self.stats.requests
+        self.state['last'] = {
+            'result': result,
+            'timestamp': started,
+            'bytes': size,
+            'requests': self.stats.requests,
+            'metadata_objects': pull.get('metadata_objects', 0),
+            'content_objects': pull.get('content_objects', 0),
+            'delta_parts': pull.get('delta_parts', 0),
+            'duration': round(pull.get('duration', 0.0), 3),
+        }
+        self._save_state()
+        if self.args.metrics:
+            self._write_metrics()
+
+    def _write_metrics(self):
+        last, totals = self.state['last'], self.state['totals']
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: List[Tuple[str, float]]):
+            lines.append(f'# HELP ostree_update_{name} {help_text}')
+            lines.append(f'# TYPE ostree_update_{name} {kind}')
+            lines.extend(f'ostree_update_{name}{labels} {_number(value)}' for labels, value in samples)
+
+        metric('last_run_timestamp_seconds', 'gauge', 'Start of the last run.', [('', last['timestamp'])])
+        metric('last_result', 'gauge', 'Result of the last run.',
+               [(f'{{result="{r}"}}', 1 if last['result'] == r else 0) for r in RESULTS])
+        metric('last_bytes', 'gauge', 'Bytes downloaded by the last run.', [('', last['bytes'])])
+        metric('last_requests', 'gauge', 'HTTP requests of the last run.', [('', last['requests'])])
+        metric('last_objects', 'gauge', 'Objects fetched by the last pull.',
+               [('{type="metadata"}', last['metadata_objects']),
+                ('{type="content"}', last['content_objects']),
+                ('{type="delta-part"}', last['delta_parts'])])
+        metric('last_duration_seconds', 'gauge', 'Duration of the last check and pull.',
+               [('', last['duration'])])
+        metric('consecutive_failures', 'gauge', 'Failed runs since the last success.',
+               [('', self.state.get('failures', 0))])
+        metric('next_attempt_timestamp_seconds', 'gauge', 'Earliest next attempt (0: none pending).',
+               [('', self.state.get('next_attempt', 0))])
+        metric('runs_total', 'counter', 'Runs by result.',
+               [(f'{{result="{r}"}}', totals['runs'].get(r, 0)) for r in RESULTS])
+        metric('bytes_total', 'counter', 'Bytes downloaded.', [('', totals['bytes'])])
+        metric('requests_total', 'counter', 'HTTP requests made.', [('', totals['requests'])])
+
+        directory = os.path.dirname(self.args.metrics)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f'{self.args.metrics}.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(tmp, self.args.metrics)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description="Check for and pull OSTree updates")
+    parser.add_argument('--repo', default=env('UPDATE_REPO') or '/ostree/repo')
+    parser.add_argument('--refspec', default=env('UPDATE_REFSPEC') or None,
+                        help="REMOTE:REF to follow (default: the booted deployment's)")
+    parser.add_argument('--rate-limit', type=int, default=int(env('UPDATE_RATE_LIMIT') or 0),
+                        metavar='KIB', help="download cap in KiB/s (0: none)")
+    parser.add_argument('--mirror', action='append', default=(env('UPDATE_MIRRORS') or '').split(),
+                        help="LAN mirror URL tried before the remote; repeatable")
+    parser.add_argument('--state-dir', default=env('UPDATE_STATE_DIR') or '/var/lib/ostree-update-agent')
+    parser.add_argument('--metrics', default=env('UPDATE_METRICS'),
+                        help="Prometheus textfile (default: STATE_DIR/metrics.prom, '' for none)")
+    parser.add_argument('--backoff-min', type=float, default=float(env('UPDATE_BACKOFF_MIN') or 600))
+    parser.add_argument('--backoff-max', type=float, default=float(env('UPDATE_BACKOFF_MAX') or 86400))
+    parser.add_argument('--force', action='store_true', help="ignore backoff and pull even if unchanged")
+    args = parser.parse_args(argv)
+    if args.metrics is None:
+        args.metrics = os.path.join(args.state_dir, 'metrics.prom')
+
+    return Agent(args).run()
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
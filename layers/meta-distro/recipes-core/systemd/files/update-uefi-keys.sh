@@ -45,6 +45,8 @@ ROLLBACK_ON_FAILURE=1
 
 # Rotation parameters
 KEY_TRANSITION_TIMEOUT=30
+EFI_GLOBAL_GUID="8be4df61-93ca-11d2-aa0d-00e098032b8c"
+EFI_IMAGE_SECURITY_GUID="d719b2cb-3d3a-4596-a3bc-dad00e67656f"
 VALIDATION_RETRIES=3
 
 # ============================================================================
@@ -229,6 +231,64 @@ create_backup_checkpoint() {
 # Key Update Functions
 # ============================================================================
 
+# efivarfs file backing an authenticated variable (PK_next -> PK-<guid>)
+efivar_path() {
+    local var_name=${1%_next}
+    case "${var_name}" in
+        PK|KEK) echo "${EFIVARFS_PATH}/${var_name}-${EFI_GLOBAL_GUID}" ;;
+        *)      echo "${EFIVARFS_PATH}/${var_name}-${EFI_IMAGE_SECURITY_GUID}" ;;
+    esac
+}
+
+efivar_state() {
+    sha256sum "$1" 2>/dev/null | cut -d' ' -f1
+}
+
+# sha256 of the variable data an .auth file writes: the file without its
+# EFI_VARIABLE_AUTHENTICATION_2 header (16-byte EFI_TIME, then a
+# WIN_CERTIFICATE whose dwLength covers the whole certificate)
+auth_payload_state() {
+    local cert_len
+    cert_len=$(od -An -tu4 -j16 -N4 "$1" 2>/dev/null | tr -d ' ')
+    [[ -n "${cert_len}" ]] || return 1
+    tail -c +$(( 16 + cert_len + 1 )) "$1" | sha256sum | cut -d' ' -f1
+}
+
+# sha256 of a variable's current data (efivarfs prepends 4 bytes of
+# attributes)
+efivar_data_state() {
+    [[ -f "$1" ]] || return 1
+    tail -c +5 "$1" | sha256sum | cut -d' ' -f1
+}
+
+# Wait until the firmware reports a new value for a variable, woken by
+# inotify when available, with KEY_TRANSITION_TIMEOUT as deadline.
+# Prints the time actually spent waiting.
+wait_for_efivar_update() {
+    local var_file=$1
+    local before=$2
+    local start=$(date +%s%N)
+    local deadline=$(( start + KEY_TRANSITION_TIMEOUT * 1000000000 ))
+    local now remaining
+
+    while [[ "$(efivar_state "${var_file}")" == "${before}" ]]; do
+        now=$(date +%s%N)
+        if (( now >= deadline )); then
+            log_debug "Timed out after ${KEY_TRANSITION_TIMEOUT}s waiting for $(basename "${var_file}")"
+            return 1
+        fi
+        if command -v inotifywait &> /dev/null; then
+            remaining=$(( (deadline - now) / 1000000000 + 1 ))
+            inotifywait -qq -t "${remaining}" -e create -e close_write -e attrib \
+                "$(dirname "${var_file}")" 2>/dev/null || true
+        else
+            sleep 0.05
+        fi
+    done
+    log_debug "$(basename "${var_file}") updated after $(( ($(date +%s%N) - start) / 1000000 ))ms"
+    return 0
+}
+
 enroll_rotation_keys() {
     local keys_dir=$1
 
@@ -253,6 +313,15 @@ enroll_rotation_keys() {
         fi
 
         log_debug "Enrolling ${key_name}..."
+        local var_file=$(efivar_path "${key_name}")
+        local before=$(efivar_state "${var_file}")
+        # Writing the value the variable already holds changes nothing the
+        # firmware would report, so there is nothing to wait for
+        local payload=$(auth_payload_state "${auth_file}")
+        local unchanged=0
+        if [[ -n "${payload}" && "${payload}" == "$(efivar_data_state "${var_file}")" ]]; then
+            unchanged=1
+        fi
 
         # Use efi-updatevar for enrollment (if available)
         if command -v efi-updatevar &> /dev/null; then
@@ -269,8 +338,13 @@ enroll_rotation_keys() {
             return 1
         fi
 
-        # Add delay between enrollments for firmware processing
-        sleep 1
+        # Let the firmware apply the update before enrolling the next key
+        # (the next one is signed by this one) instead of a fixed delay
+        if (( unchanged )); then
+            log_debug "${key_name} already holds this value, not waiting for the firmware"
+        elif ! wait_for_efivar_update "${var_file}" "${before}"; then
+            log_warn "${key_name} not visible in efivarfs yet, continuing"
+        fi
     done
 
     log_info "All rotation keys enrolled successfully"
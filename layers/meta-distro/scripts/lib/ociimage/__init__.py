@@ -0,0 +1,24 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Daemonless OCI / docker-archive image writer
+
+Used by classes/image_types_docker.bbclass to turn IMAGE_ROOTFS into a
+container image without a Docker daemon. The rootfs is split into layers
+by package and streamed once: each layer tar is generated in-process,
+hashed (diff-id) and compressed on a thread pool while it is written
+straight into the output archive, whose blob headers are patched with the
+digest and size afterwards. Layers whose files are unchanged since an
+earlier build are copied from the layer cache.
+
+Modules:
+  cache       - content-addressed cache of compressed layers, by diff-id
+  compress    - parallel gzip/zstd stream compressor with diff-id hashing
+  layer       - deterministic rootfs layer tar stream with exclude patterns
+  split       - rootfs split into ordered layers by installing package
+  writer      - OCI image layout / docker-archive writer and command line
+"""
@@ -0,0 +1,138 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Content-addressed layer cache
+
+Compression is the expensive part of writing an image, and most layers of a
+rebuilt image are identical to the previous build's: ociimage.split keeps
+unchanged packages in unchanged layers, and the deterministic tar stream
+(sorted entries, numeric owners, mtimes clamped to SOURCE_DATE_EPOCH) gives
+an unchanged layer the same bytes.
+
+The cache maps a layer's diff-id (sha256 of the uncompressed tar) and the
+compression settings to the compressed blob of an earlier build. A layer
+is compressed and hashed in the same pass over its files, with the blob
+written into the archive and into a new cache entry at once; the entry is
+published under the diff-id the pass computed.
+
+A layer is looked up before it is read by its key, a digest of the lstat
+of its entries (ociimage.writer): writing, chmod, chown or setting an
+xattr all change a file's ctime, so an unchanged key means an unchanged
+layer tar. On a hit the cached blob is copied into the archive
+byte-for-byte, without reading the rootfs: the layer digest does not
+change, so a registry or device that has the blob does not transfer it
+again.
+
+Layout: DIR/<method>-<level>/<diff-id hex> for blobs and <key>.key (JSON:
+diff-id, uncompressed size, statistics) for keys. Entries are written
+under a temporary name and renamed, so builds can share DIR; a hit
+refreshes the mtime of the key and the blob, and prune() drops entries
+unused for max_age days.
+"""
+
+import json
+import os
+import time
+from typing import Callable, Dict, Optional
+
+from ociimage.compress import DEFAULT_LEVELS
+
+COPY_SIZE = 1024 * 1024
+
+
+class CacheEntry:
+    """Sink storing one blob; commit() publishes it under its diff-id"""
+
+    def __init__(self, cache: 'LayerCache'):
+        self.cache = cache
+        self.tmp = os.path.join(cache.directory, f'.tmp-{os.getpid()}-{id(self)}')
+        self.f = open(self.tmp, 'wb')
+
+    def __call__(self, data: bytes):
+        self.f.write(data)
+
+    def commit(self, diff_id: str):
+        self.f.close()
+        os.replace(self.tmp, self.cache._path(diff_id))
+
+    def discard(self):
+        self.f.close()
+        if os.path.exists(self.tmp):
+            os.unlink(self.tmp)
+
+
+class LayerCache:
+    """Compressed layer blobs of earlier builds, by diff-id"""
+
+    def __init__(self, directory: str, method: str, level: Optional[int] = None):
+        level = DEFAULT_LEVELS[method] if level is None else level
+        self.directory = os.path.join(directory, f'{method}-{level}')
+        os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, diff_id: str) -> str:
+        return os.path.join(self.directory, diff_id.split(':')[-1])
+
+    def copy(self, diff_id: str, sink: Callable[[bytes], None]) -> bool:
+        """Feed the cached blob of diff_id to sink; False when not cached"""
+        path = self._path(diff_id)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        with f:
+            os.utime(f.fileno())
+            while True:
+                data = f.read(COPY_SIZE)
+                if not data:
+                    break
+                sink(data)
+        self.hits += 1
+        return True
+
+    def store(self) -> CacheEntry:
+        """Entry to write a blob into while its diff-id is computed"""
+        return CacheEntry(self)
+
+    def lookup(self, key: str) -> Optional[Dict]:
+        """What remember() recorded for key, when its blob is still cached"""
+        path = os.path.join(self.directory, f'{key}.key')
+        try:
+            with open(path) as f:
+                layer = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if not os.path.exists(self._path(layer['diff_id'])):
+            self.misses += 1
+            return None
+        os.utime(path)
+        return layer
+
+    def remember(self, key: str, layer: Dict):
+        """Record the diff-id (and sizes, statistics) of the layer with key"""
+        path = os.path.join(self.directory, f'{key}.key')
+        tmp = f'{path}.tmp-{os.getpid()}'
+        with open(tmp, 'w') as f:
+            json.dump(layer, f, sort_keys=True)
+        os.replace(tmp, path)
+
+    def prune(self, max_age_days: int) -> int:
+        """Remove entries unused for max_age_days; returns how many"""
+        limit = time.time() - max_age_days * 86400
+        removed = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < limit:
+                        os.unlink(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
@@ -0,0 +1,130 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Parallel layer compression
+
+ParallelCompressor is a write-only file object. It cuts the uncompressed
+stream into CHUNK_SIZE blocks, hashes it in order (the layer's diff-id),
+compresses the blocks on a thread pool (zlib and zstd release the GIL) and
+hands the compressed blocks to a sink in order. Each block becomes its own
+gzip member or zstd frame, as pigz and `zstd -T` do: concatenated members
+and frames are valid streams for every decoder, and because the block
+boundaries do not depend on the number of threads the output is
+reproducible.
+
+zstd needs the python3 'zstandard' module.
+"""
+
+import hashlib
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+
+CHUNK_SIZE = 4 * 1024 * 1024
+METHODS = ('gzip', 'zstd', 'none')
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3, 'none': 0}
+MEDIA_TYPES = {
+    'gzip': 'application/vnd.oci.image.layer.v1.tar+gzip',
+    'zstd': 'application/vnd.oci.image.layer.v1.tar+zstd',
+    'none': 'application/vnd.oci.image.layer.v1.tar',
+}
+# Blocks in flight per worker: bounds memory to jobs * 2 * CHUNK_SIZE
+_WINDOW = 2
+
+
+def _zstd():
+    """Import zstandard, which is an optional dependency"""
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("zstd layer compression requires the python3 'zstandard' module")
+    return zstandard
+
+
+def block_compressor(method: str, level: Optional[int] = None) -> Callable[[bytes], bytes]:
+    """Function compressing one block into a complete gzip member or zstd frame"""
+    if method not in METHODS:
+        raise Exception(f"Unknown compression '{method}' (expected one of {', '.join(METHODS)})")
+    level = DEFAULT_LEVELS[method] if level is None else level
+    if method == 'gzip':
+        def compress(data: bytes) -> bytes:
+            # wbits 31: gzip wrapper with mtime 0, so output is reproducible
+            cobj = zlib.compressobj(level, zlib.DEFLATED, 31)
+            return cobj.compress(data) + cobj.flush()
+        return compress
+    if method == 'zstd':
+        zstandard = _zstd()
+        return lambda data: zstandard.ZstdCompressor(level=level).compress(data)
+    return lambda data: data
+
+
+class ParallelCompressor:
+    """Write-only stream: hash, compress in parallel, emit in order
+
+    sink receives the compressed blocks in stream order.
+    """
+
+    def __init__(self, sink: Callable[[bytes], None], method: str = 'gzip',
+                 level: Optional[int] = None, jobs: Optional[int] = None,
+                 chunk_size: int = CHUNK_SIZE):
+        self.sink = sink
+        self.method = method
+        self.compress = block_compressor(method, level)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.diff_id = hashlib.sha256()
+        self.size = 0
+        self._buffer = bytearray()
+        self._pending = []
+        self._pool = ThreadPoolExecutor(max_workers=self.jobs) if method != 'none' else None
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._submit(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def _submit(self, block: bytes):
+        self.diff_id.update(block)
+        self.size += len(block)
+        if self._pool is None:
+            self.sink(block)
+            return
+        self._pending.append(self._pool.submit(self.compress, block))
+        while len(self._pending) >= self.jobs * _WINDOW:
+            self.sink(self._pending.pop(0).result())
+
+    def close(self) -> Tuple[str, int]:
+        """Flush everything to the sink
+
+        Returns:
+            ('sha256:<hex>' diff-id, uncompressed size)
+        """
+        if not self.closed:
+            self.closed = True
+            try:
+                if self._buffer:
+                    self._submit(bytes(self._buffer))
+                    self._buffer.clear()
+                while self._pending:
+                    self.sink(self._pending.pop(0).result())
+            finally:
+                if self._pool is not None:
+                    self._pool.shutdown()
+        return 'sha256:' + self.diff_id.hexdigest(), self.size
+
+    def abort(self):
+        """Drop pending blocks after a failure"""
+        self.closed = True
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        if self._pool is not None:
+            self._pool.shutdown()
@@ -0,0 +1,172 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Rootfs layer tar stream
+
+Writes a directory tree as an OCI layer tar (PAX format) to any writable
+file object, in one pass and without a temporary file. What `tar
+--numeric-owner --xattrs --acls -C ROOTFS -c .` produced for `docker import`,
+but deterministic:
+
+  - entries in sorted path order, names relative to the root ("usr/bin/env")
+  - numeric uid/gid only, no user or group names
+  - hardlinked files stored once, further links as hardlink entries
+  - extended attributes (security.capability, POSIX ACLs, ...) as
+    SCHILY.xattr PAX records
+  - mtimes clamped to SOURCE_DATE_EPOCH when one is given
+  - sockets skipped, like every container image builder does
+
+Exclude patterns are shell globs (fnmatch). A pattern without a slash
+matches the name of an entry at any depth (`vmlinuz-*`); a pattern with a
+slash matches the path relative to the root (`boot/*`). Excluded
+directories are not descended into.
+"""
+
+import fnmatch
+import os
+import stat
+import tarfile
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+COPY_BUFSIZE = 1024 * 1024
+
+
+@dataclass
+class LayerStats:
+    """What went into a layer"""
+    entries: int = 0
+    files: int = 0
+    hardlinks: int = 0
+    excluded: int = 0
+    file_bytes: int = 0
+
+
+class Excludes:
+    """Compiled exclude patterns"""
+
+    def __init__(self, patterns: Iterable[str]):
+        patterns = [p.strip().strip('/') for p in patterns if p.strip().strip('/')]
+        self.names = [p for p in patterns if '/' not in p]
+        self.paths = [p for p in patterns if '/' in p]
+
+    def __bool__(self) -> bool:
+        return bool(self.names or self.paths)
+
+    def match(self, rel: str, name: str) -> bool:
+        return (any(fnmatch.fnmatchcase(name, p) for p in self.names)
+                or any(fnmatch.fnmatchcase(rel, p) for p in self.paths))
+
+
+def _sorted_entries(directory: str) -> Iterator[os.DirEntry]:
+    with os.scandir(directory) as it:
+        return iter(sorted(it, key=lambda e: e.name))
+
+
+def walk_tree(root: str, excludes: Optional[Excludes] = None,
+              stats: Optional[LayerStats] = None) -> Iterator[Tuple[str, str, os.stat_result]]:
+    """Yield (relative path, path, lstat) of every entry below root
+
+    Depth-first with the entries of each directory sorted by name, which is
+    the order `tar --sort=name` writes; root itself is not yielded.
+    """
+    excludes = excludes or Excludes(())
+    stack = [('', _sorted_entries(root))]
+    while stack:
+        rel_dir, entries = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+        rel = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+        if excludes and excludes.match(rel, entry.name):
+            if stats:
+                stats.excluded += 1
+            continue
+        st = entry.stat(follow_symlinks=False)
+        yield rel, entry.path, st
+        if stat.S_ISDIR(st.st_mode):
+            stack.append((rel, _sorted_entries(entry.path)))
+
+
+def _xattrs(path: str) -> Dict[str, str]:
+    """SCHILY.xattr PAX records of path (binary values kept byte-exact)"""
+    try:
+        names = os.listxattr(path, follow_symlinks=False)
+    except OSError:
+        return {}
+    records = {}
+    for name in sorted(names):
+        try:
+            value = os.getxattr(path, name, follow_symlinks=False)
+        except OSError:
+            continue
+        records['SCHILY.xattr.' + name] = value.decode('utf-8', 'surrogateescape')
+    return records
+
+
+def _tarinfo(rel: str, path: str, st: os.stat_result, mtime_limit: Optional[int]) -> Optional[tarfile.TarInfo]:
+    mode = st.st_mode
+    info = tarfile.TarInfo(rel)
+    info.mode = stat.S_IMODE(mode)
+    info.uid, info.gid = st.st_uid, st.st_gid
+    info.uname = info.gname = ''
+    info.mtime = int(st.st_mtime) if mtime_limit is None else min(int(st.st_mtime), mtime_limit)
+    if stat.S_ISREG(mode):
+        info.type, info.size = tarfile.REGTYPE, st.st_size
+    elif stat.S_ISDIR(mode):
+        info.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(mode):
+        info.type, info.linkname = tarfile.SYMTYPE, os.readlink(path)
+    elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+        info.type = tarfile.CHRTYPE if stat.S_ISCHR(mode) else tarfile.BLKTYPE
+        info.devmajor, info.devminor = os.major(st.st_rdev), os.minor(st.st_rdev)
+    elif stat.S_ISFIFO(mode):
+        info.type = tarfile.FIFOTYPE
+    else:
+        return None
+    info.pax_headers = _xattrs(path)
+    return info
+
+
+def write_layer(root: str, fileobj, excludes: Iterable[str] = (),
+                source_date_epoch: Optional[int] = None,
+                entries: Optional[Iterable[Tuple[str, str, os.stat_result]]] = None) -> LayerStats:
+    """Write root as a layer tar to fileobj (only write() is used)
+
+    entries, when given, replaces the walk of root (same tuples as
+    walk_tree), for writers that split a tree over several layers.
+    """
+    stats = LayerStats()
+    compiled = Excludes(excludes)
+    if entries is None:
+        entries = walk_tree(root, compiled, stats)
+    links: Dict[Tuple[int, int], str] = {}
+    with tarfile.open(fileobj=fileobj, mode='w|', format=tarfile.PAX_FORMAT,
+                      encoding='utf-8', errors='surrogateescape', copybufsize=COPY_BUFSIZE) as tar:
+        for rel, path, st in entries:
+            info = _tarinfo(rel, path, st, source_date_epoch)
+            if info is None:
+                continue
+            stats.entries += 1
+            if info.type == tarfile.REGTYPE and st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                if key in links:
+                    info.type, info.linkname, info.size = tarfile.LNKTYPE, links[key], 0
+                    stats.hardlinks += 1
+                    tar.addfile(info)
+                    continue
+                links[key] = rel
+            if info.type == tarfile.REGTYPE:
+                stats.files += 1
+                stats.file_bytes += info.size
+                with open(path, 'rb') as f:
+                    tar.addfile(info, f)
+            else:
+                tar.addfile(info)
+    return stats
+
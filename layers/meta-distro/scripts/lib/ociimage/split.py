@@ -0,0 +1,138 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Rootfs split into layers by package
+
+A single-layer image changes as a whole whenever one package changes, and
+every pull downloads the whole rootfs again. A layer plan assigns each
+file of the rootfs to one of a few ordered layers by the package that
+installed it, so a package update only changes the layer of that package:
+
+  base      - libc, systemd, busybox, ...: changes rarely
+  runtime   - every other package (the default layer)
+  app       - the image's own packages
+  config    - files no package owns: /etc written by postinsts, users and
+              groups, alternatives links, caches generated at rootfs time
+
+The plan is JSON, written by image_types_docker.bbclass from the image's
+installed packages and their pkgdata FILES_INFO:
+
+  {"layers": [{"name": "base", "packages": ["glibc", "busybox*"]}, ...],
+   "default": "runtime", "unowned": "config",
+   "packages": {"libc6": {"pn": "glibc", "files": ["/lib/libc.so.6", ...]}}}
+
+A package goes to the first layer with a glob matching its name or its
+recipe (pn), else to the default layer; a file goes to the layer of its
+package, anything else to the unowned layer. Directories are written into
+every layer that has entries below them, with the same metadata, and into
+the unowned layer when they are empty: each layer unpacks on its own, and
+the layers together give back the rootfs.
+"""
+
+import fnmatch
+import json
+import os
+import stat
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+DEFAULT_LAYER = 'runtime'
+UNOWNED_LAYER = 'config'
+
+Entry = Tuple[str, str, os.stat_result]
+
+
+@dataclass
+class LayerPlan:
+    """Ordered layer names and the layer of every package-owned path"""
+    names: List[str]
+    unowned: str = UNOWNED_LAYER
+    owners: Dict[str, str] = field(default_factory=dict)
+    packages: Dict[str, List[str]] = field(default_factory=dict)
+
+
+def make_plan(layers: Iterable[Dict], packages: Dict[str, Dict],
+              default: str = DEFAULT_LAYER, unowned: str = UNOWNED_LAYER) -> LayerPlan:
+    """LayerPlan from layer specs and the installed packages
+
+    layers are {'name': ..., 'packages': [globs]} in image order; default
+    and unowned are appended when they are not listed.
+    """
+    layers = list(layers)
+    names = [layer['name'] for layer in layers]
+    for name in (default, unowned):
+        if name not in names:
+            names.append(name)
+    if len(set(names)) != len(names):
+        raise Exception(f"Duplicate layer name in {' '.join(names)}")
+
+    plan = LayerPlan(names, unowned, packages={name: [] for name in names})
+    for pkg in sorted(packages):
+        info = packages[pkg]
+        pn = info.get('pn') or pkg
+        layer = next((spec['name'] for spec in layers
+                      if any(fnmatch.fnmatchcase(pkg, p) or fnmatch.fnmatchcase(pn, p)
+                             for p in spec.get('packages', ()))), default)
+        plan.packages[layer].append(pkg)
+        for path in info.get('files', ()):
+            # The first package (by name) wins a path shipped twice
+            plan.owners.setdefault(path.strip('/'), layer)
+    return plan
+
+
+def load_plan(path: str) -> LayerPlan:
+    """LayerPlan from a JSON plan file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return make_plan(data.get('layers', []), data.get('packages', {}),
+                     data.get('default') or DEFAULT_LAYER, data.get('unowned') or UNOWNED_LAYER)
+
+
+def split_entries(entries: Iterable[Entry], plan: Optional[LayerPlan]) -> List[Tuple[str, List[Entry]]]:
+    """Distribute walk_tree entries over the layers of plan
+
+    Returns:
+        (layer name, entries in walk order) of each non-empty layer, in
+        plan order; one 'rootfs' layer with everything when plan is None
+    """
+    entries = list(entries)
+    if plan is None:
+        return [('rootfs', entries)] if entries else []
+    index = {name: i for i, name in enumerate(plan.names)}
+    unowned = index[plan.unowned]
+
+    # Layer of each non-directory; directories collect the layers below them
+    where: List[Optional[int]] = []
+    dirs: Dict[str, Set[int]] = {}
+
+    def mark(rel: str, layer: int):
+        parent = rel.rpartition('/')[0]
+        while parent and layer not in dirs[parent]:
+            dirs[parent].add(layer)
+            parent = parent.rpartition('/')[0]
+
+    for rel, _, st in entries:
+        if stat.S_ISDIR(st.st_mode):
+            dirs[rel] = set()
+            where.append(None)
+        else:
+            layer = index[plan.owners.get(rel, plan.unowned)]
+            where.append(layer)
+            mark(rel, layer)
+    for rel, layers in dirs.items():
+        if not layers:
+            layers.add(unowned)
+            mark(rel, unowned)
+
+    split: List[List[Entry]] = [[] for _ in plan.names]
+    for entry, layer in zip(entries, where):
+        if layer is None:
+            for i in dirs[entry[0]]:
+                split[i].append(entry)
+        else:
+            split[layer].append(entry)
+    return [(name, layer) for name, layer in zip(plan.names, split) if layer]
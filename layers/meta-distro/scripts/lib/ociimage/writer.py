@@ -0,0 +1,423 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+OCI image layout / docker-archive writer
+
+Writes a rootfs as a container image into one tar file that is both an
+OCI image layout (oci-layout, index.json, blobs/sha256/...) and a
+docker-archive (manifest.json), the same dual layout `docker save` writes
+since Docker 25. `docker load -i`, `podman load -i`, `skopeo copy
+oci-archive:` / `docker-archive:` all read it; no daemon is involved in
+writing it.
+
+The image has one layer, or one layer per package group when a layer plan
+is given (ociimage.split). Each layer is generated by ociimage.layer and
+compressed by ociimage.compress while it is written directly into the
+archive: the blob's tar header is written as a placeholder and patched
+with the final sha256 name and size once the layer is complete, so the
+rootfs is read once and each compressed layer is written once. The
+config's diff-ids are the sha256 of the uncompressed streams, computed on
+the way. With a layer cache (ociimage.cache) a layer whose entries have
+the lstat of one an earlier build compressed is copied from the cache
+without reading its files; any other layer is stored in the cache under
+its diff-id while it is compressed.
+
+Image settings come from Dockerfile-style --change instructions, as taken
+by `docker import --change`: CMD, ENTRYPOINT, ENV, EXPOSE, LABEL,
+STOPSIGNAL, USER, VOLUME and WORKDIR.
+
+Usage: python3 -m ociimage.writer ROOTFS OUTPUT --ref NAME:TAG [--arch ARCH]
+           [--compression gzip|zstd|none] [--level N] [--jobs N]
+           [--exclude PATTERN ...] [--change INSTRUCTION ...]
+           [--source-date-epoch SECONDS] [--layers PLAN.json]
+           [--cache DIR] [--cache-max-age DAYS]
+"""
+
+import dataclasses
+import hashlib
+import json
+import os
+import shlex
+import tarfile
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ociimage.cache import LayerCache
+from ociimage.compress import MEDIA_TYPES, ParallelCompressor
+from ociimage.layer import Excludes, LayerStats, walk_tree, write_layer
+from ociimage.split import LayerPlan, load_plan, split_entries
+
+OCI_LAYOUT_VERSION = '1.0.0'
+MEDIA_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+MEDIA_INDEX = 'application/vnd.oci.image.index.v1+json'
+MEDIA_CONFIG = 'application/vnd.oci.image.config.v1+json'
+BLOCK = tarfile.BLOCKSIZE
+
+# TARGET_ARCH -> GOARCH (and variant) as used in image configs
+GOARCH = {
+    'x86_64': ('amd64', None),
+    'i386': ('386', None), 'i486': ('386', None), 'i586': ('386', None), 'i686': ('386', None),
+    'aarch64': ('arm64', 'v8'),
+    'arm': ('arm', 'v7'),
+    'riscv64': ('riscv64', None),
+    'powerpc64le': ('ppc64le', None),
+    'mips': ('mips', None), 'mipsel': ('mipsle', None),
+    'mips64': ('mips64', None), 'mips64el': ('mips64le', None),
+}
+
+
+def parse_changes(changes: Iterable[str]) -> Dict:
+    """Image config ("config" object) from Dockerfile-style instructions"""
+    config: Dict = {}
+    for change in changes:
+        instruction, _, value = change.strip().partition(' ')
+        instruction, value = instruction.upper(), value.strip()
+        if not value:
+            raise Exception(f"Empty --change '{change}'")
+        if instruction in ('CMD', 'ENTRYPOINT'):
+            if value.startswith('['):
+                # BitBake values often carry the JSON quotes escaped (\")
+                argv = json.loads(value.replace('\\"', '"'))
+                if not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+                    raise Exception(f"{instruction} must be a JSON list of strings: {value}")
+            else:
+                argv = ['/bin/sh', '-c', value]
+            config['Cmd' if instruction == 'CMD' else 'Entrypoint'] = argv
+        elif instruction in ('ENV', 'LABEL'):
+            key = 'Env' if instruction == 'ENV' else 'Labels'
+            words = shlex.split(value)
+            if instruction == 'ENV' and len(words) >= 2 and '=' not in words[0]:
+                pairs = [(words[0], value.split(None, 1)[1])]  # legacy "ENV key value"
+            else:
+                pairs = [tuple(w.split('=', 1)) for w in words]
+                if any(len(p) != 2 for p in pairs):
+                    raise Exception(f"{instruction} expects key=value pairs: {value}")
+            if key == 'Env':
+                env = [e for e in config.get('Env', []) if e.split('=', 1)[0] not in dict(pairs)]
+                config['Env'] = env + [f'{k}={v}' for k, v in pairs]
+            else:
+                config.setdefault('Labels', {}).update(dict(pairs))
+        elif instruction == 'EXPOSE':
+            for port in value.split():
+                config.setdefault('ExposedPorts', {})[port if '/' in port else f'{port}/tcp'] = {}
+        elif instruction == 'VOLUME':
+            paths = json.loads(value) if value.startswith('[') else value.split()
+            for path in paths:
+                config.setdefault('Volumes', {})[path] = {}
+        elif instruction in ('USER', 'WORKDIR', 'STOPSIGNAL'):
+            config[{'USER': 'User', 'WORKDIR': 'WorkingDir', 'STOPSIGNAL': 'StopSignal'}[instruction]] = value
+        else:
+            raise Exception(f"Unsupported --change instruction '{instruction}'")
+    return config
+
+
+def _json(obj) -> bytes:
+    return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()
+
+
+def _rfc3339(seconds: int) -> str:
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+class BlobArchive:
+    """Output tar with content-addressed blobs
+
+    Members are written with a fixed mtime and root ownership, so the
+    archive only depends on its content.
+    """
+
+    def __init__(self, path: str, mtime: int = 0):
+        self.path = path
+        self.mtime = mtime
+        self.f = open(path, 'wb')
+        self.blobs: Dict[str, int] = {}
+        for directory in ('blobs/', 'blobs/sha256/'):
+            info = self._info(directory, 0)
+            info.type, info.mode = tarfile.DIRTYPE, 0o755
+            self.f.write(info.tobuf(tarfile.GNU_FORMAT))
+
+    def _info(self, name: str, size: int) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.size, info.mtime, info.mode = size, self.mtime, 0o644
+        info.uname = info.gname = ''
+        return info
+
+    def add_file(self, name: str, data: bytes):
+        self.f.write(self._info(name, len(data)).tobuf(tarfile.GNU_FORMAT))
+        self.f.write(data + bytes(-len(data) % BLOCK))
+
+    def add_blob(self, data: bytes) -> Tuple[str, int]:
+        """Store a small blob; returns ('sha256:<hex>', size)"""
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self.blobs:
+            self.add_file(f'blobs/sha256/{digest}', data)
+            self.blobs[digest] = len(data)
+        return 'sha256:' + digest, len(data)
+
+    def stream_blob(self) -> 'BlobStream':
+        """Start a blob of unknown size and digest, written as it comes"""
+        return BlobStream(self)
+
+    def close(self):
+        self.f.write(bytes(2 * BLOCK))
+        self.f.close()
+
+
+class BlobStream:
+    """Sink for one streamed blob of a BlobArchive"""
+
+    def __init__(self, archive: BlobArchive):
+        self.archive = archive
+        self.header_offset = archive.f.tell()
+        self.digest = hashlib.sha256()
+        self.size = 0
+        # Placeholder header of the final name length; patched in finish()
+        archive.f.write(archive._info('blobs/sha256/' + '0' * 64, 0).tobuf(tarfile.GNU_FORMAT))
+
+    def __call__(self, data: bytes):
+        self.digest.update(data)
+        self.size += len(data)
+        self.archive.f.write(data)
+
+    def finish(self) -> Tuple[str, int]:
+        """Patch the header; returns ('sha256:<hex>', size)"""
+        f = self.archive.f
+        digest = self.digest.hexdigest()
+        f.write(bytes(-self.size % BLOCK))
+        end = f.tell()
+        header = self.archive._info(f'blobs/sha256/{digest}', self.size).tobuf(tarfile.GNU_FORMAT)
+        if len(header) != BLOCK:
+            raise Exception("Blob header does not fit one tar block")
+        f.seek(self.header_offset)
+        f.write(header)
+        f.seek(end)
+        if digest in self.archive.blobs:
+            # Same content already stored: drop the duplicate member
+            f.truncate(self.header_offset)
+            f.seek(self.header_offset)
+        self.archive.blobs[digest] = self.size
+        return 'sha256:' + digest, self.size
+
+
+def split_ref(ref: str) -> Tuple[str, str]:
+    """('repo/name', 'tag') of a reference, tag 'latest' when missing"""
+    name, _, tag = ref.rpartition(':')
+    if not name or '/' in tag:
+        return ref, 'latest'
+    return name, tag
+
+
+def _layer_key(entries: List, source_date_epoch: Optional[int]) -> str:
+    """Cache key of a layer: digest of the path and lstat of its entries"""
+    digest = hashlib.sha256(f'{source_date_epoch}\n'.encode())
+    for rel, _, st in entries:
+        digest.update(f'{rel}\0{st.st_dev}:{st.st_ino}:{st.st_mode}:{st.st_uid}:{st.st_gid}:'
+                      f'{st.st_nlink}:{st.st_rdev}:{st.st_size}:{st.st_mtime_ns}:{st.st_ctime_ns}\n'
+                      .encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()
+
+
+def _add_stats(total: LayerStats, stats: LayerStats):
+    total.entries += stats.entries
+    total.files += stats.files
+    total.hardlinks += stats.hardlinks
+    total.file_bytes += stats.file_bytes
+
+
+def _tee(first, second):
+    """Sink that writes every chunk to both sinks"""
+    def sink(data: bytes):
+        first(data)
+        second(data)
+    return sink
+
+
+def _write_layer_blob(archive: BlobArchive, rootfs: str, entries: List, compression: str,
+                      level: Optional[int], jobs: Optional[int], source_date_epoch: Optional[int],
+                      cache: Optional[LayerCache]) -> Dict:
+    """Write one layer blob, from the cache when its entries are unchanged"""
+    stream = archive.stream_blob()
+    key = None
+    if cache is not None:
+        key = _layer_key(entries, source_date_epoch)
+        cached = cache.lookup(key)
+        if cached is not None and cache.copy(cached['diff_id'], stream):
+            digest, blob_size = stream.finish()
+            return {'digest': digest, 'size': blob_size, 'diff_id': cached['diff_id'],
+                    'layer_size': cached['layer_size'], 'stats': LayerStats(**cached['stats']),
+                    'cached': True}
+
+    entry = cache.store() if cache is not None else None
+    sink = stream if entry is None else _tee(stream, entry)
+    compressor = ParallelCompressor(sink, compression, level, jobs)
+    try:
+        stats = write_layer(rootfs, compressor, source_date_epoch=source_date_epoch, entries=entries)
+        diff_id, layer_size = compressor.close()
+    except BaseException:
+        compressor.abort()
+        if entry is not None:
+            entry.discard()
+        raise
+    if entry is not None:
+        entry.commit(diff_id)
+        cache.remember(key, {'diff_id': diff_id, 'layer_size': layer_size,
+                             'stats': dataclasses.asdict(stats)})
+    digest, blob_size = stream.finish()
+    return {'digest': digest, 'size': blob_size, 'diff_id': diff_id,
+            'layer_size': layer_size, 'stats': stats, 'cached': False}
+
+
+def write_image(rootfs: str, output: str, ref: str, arch: str = 'x86_64',
+                compression: str = 'gzip', level: Optional[int] = None,
+                jobs: Optional[int] = None, excludes: Iterable[str] = (),
+                changes: Iterable[str] = (), source_date_epoch: Optional[int] = None,
+                plan: Optional[LayerPlan] = None, cache_dir: Optional[str] = None) -> Dict:
+    """Write rootfs as an image archive at output
+
+    plan splits the rootfs into one layer per package group
+    (ociimage.split), otherwise the image has a single layer. cache_dir
+    enables the layer cache (ociimage.cache).
+
+    Returns:
+        Dict with the manifest and config digests, the layers (name,
+        digest, diff-id, sizes, statistics, cache hit) and the total
+        statistics
+    """
+    if not os.path.isdir(rootfs):
+        raise Exception(f"Rootfs directory not found: {rootfs}")
+    goarch, variant = GOARCH.get(arch, (arch, None))
+    created = source_date_epoch if source_date_epoch is not None else int(time.time())
+    name, tag = split_ref(ref)
+    cache = LayerCache(cache_dir, compression, level) if cache_dir else None
+
+    total = LayerStats()
+    split = split_entries(walk_tree(rootfs, Excludes(excludes), total), plan)
+
+    partial = f"{output}.partial-{os.getpid()}"
+    archive = BlobArchive(partial, mtime=created)
+    try:
+        layers = []
+        for layer_name, entries in split:
+            layer = _write_layer_blob(archive, rootfs, entries, compression, level, jobs,
+                                      source_date_epoch, cache)
+            layer['name'] = layer_name
+            _add_stats(total, layer['stats'])
+            layers.append(layer)
+
+        history = []
+        for layer in layers:
+            history.append({'created': _rfc3339(created),
+                            'created_by': 'image_types_docker (ociimage.writer)'})
+            if plan is not None:
+                packages = len(plan.packages.get(layer['name'], ()))
+                history[-1]['comment'] = (f"{layer['name']} layer, {packages} packages" if packages
+                                          else f"{layer['name']} layer, files of no package")
+        image_config = {
+            'architecture': goarch,
+            'os': 'linux',
+            'created': _rfc3339(created),
+            'config': parse_changes(changes),
+            'rootfs': {'type': 'layers', 'diff_ids': [layer['diff_id'] for layer in layers]},
+            'history': history,
+        }
+        if variant:
+            image_config['variant'] = variant
+        config_digest, config_size = archive.add_blob(_json(image_config))
+        manifest = {
+            'schemaVersion': 2,
+            'mediaType': MEDIA_MANIFEST,
+            'config': {'mediaType': MEDIA_CONFIG, 'digest': config_digest, 'size': config_size},
+            'layers': [{'mediaType': MEDIA_TYPES[compression], 'digest': layer['digest'],
+                        'size': layer['size']} for layer in layers],
+        }
+        manifest_digest, manifest_size = archive.add_blob(_json(manifest))
+        index = {
+            'schemaVersion': 2,
+            'mediaType': MEDIA_INDEX,
+            'manifests': [{
+                'mediaType': MEDIA_MANIFEST, 'digest': manifest_digest, 'size': manifest_size,
+                'annotations': {'io.containerd.image.name': f'{name}:{tag}',
+                                'org.opencontainers.image.ref.name': tag},
+            }],
+        }
+        archive.add_file('oci-layout', _json({'imageLayoutVersion': OCI_LAYOUT_VERSION}))
+        archive.add_file('index.json', _json(index))
+        # docker-archive view of the same blobs
+        archive.add_file('manifest.json', _json([{
+            'Config': f'blobs/sha256/{config_digest[7:]}',
+            'RepoTags': [f'{name}:{tag}'],
+            'Layers': [f"blobs/sha256/{layer['digest'][7:]}" for layer in layers],
+        }]))
+        archive.close()
+        os.rename(partial, output)
+    except BaseException:
+        if not archive.f.closed:
+            archive.f.close()
+        if os.path.exists(partial):
+            os.unlink(partial)
+        raise
+
+    return {
+        'ref': f'{name}:{tag}',
+        'manifest': manifest_digest,
+        'config': config_digest,
+        'layers': layers,
+        'archive_size': os.path.getsize(output),
+        'stats': total,
+        'cache': cache,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a rootfs as an OCI / docker-archive image without a daemon")
+    parser.add_argument('rootfs')
+    parser.add_argument('output')
+    parser.add_argument('--ref', required=True, help="image reference, NAME[:TAG]")
+    parser.add_argument('--arch', default='x86_64', help="TARGET_ARCH of the rootfs")
+    parser.add_argument('--compression', choices=sorted(MEDIA_TYPES), default='gzip')
+    parser.add_argument('--level', type=int, default=None)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--exclude', action='append', default=[],
+                        help="glob of names (or paths with '/') to leave out; repeatable, "
+                             "or several separated by spaces")
+    parser.add_argument('--change', action='append', default=[],
+                        help="Dockerfile instruction, e.g. 'CMD [\"/bin/sh\"]'; repeatable")
+    parser.add_argument('--source-date-epoch', type=lambda v: int(v) if v else None,
+                        default=os.environ.get('SOURCE_DATE_EPOCH') or None,
+                        help="clamp mtimes to this time and use it as creation time")
+    parser.add_argument('--layers', metavar='PLAN', default=None,
+                        help="JSON layer plan (see ociimage.split); default: one layer")
+    parser.add_argument('--cache', metavar='DIR', default=None,
+                        help="layer cache directory (see ociimage.cache)")
+    parser.add_argument('--cache-max-age', type=int, default=30, metavar='DAYS',
+                        help="prune cache entries unused for this many days (0: never)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    excludes = [pattern for value in args.exclude for pattern in value.split()]
+    plan = load_plan(args.layers) if args.layers else None
+    result = write_image(args.rootfs, args.output, args.ref, args.arch, args.compression,
+                         args.level, args.jobs, excludes, args.change, args.source_date_epoch,
+                         plan, args.cache)
+    stats = result['stats']
+    print(f"{args.output}: {result['ref']} {result['manifest']}")
+    for layer in result['layers']:
+        print(f"  {layer['name']:<10} {layer['digest']} ({args.compression}, {layer['size'] // 1024}KiB "
+              f"from {layer['layer_size'] // 1024}KiB{', cached' if layer['cached'] else ''})")
+    print(f"  {stats.entries} entries, {stats.files} files, {stats.hardlinks} hardlinks, "
+          f"{stats.excluded} excluded, {time.perf_counter() - start:.1f}s")
+    cache = result['cache']
+    if cache is not None:
+        pruned = cache.prune(args.cache_max_age) if args.cache_max_age > 0 else 0
+        print(f"  layer cache: {cache.hits} hits, {cache.misses} misses, {pruned} pruned")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
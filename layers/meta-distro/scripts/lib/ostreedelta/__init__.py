@@ -0,0 +1,19 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+OSTree static delta pipeline
+
+Used by classes/ostree_static_deltas.bbclass after an image is committed to
+OSTREE_REPO. It generates static deltas from the last published commits of
+the branch to the new commit, several at a time, skips the pairs a previous
+build already generated, and regenerates the repository summary that
+`ostree pull` consults to find them.
+
+Modules:
+  generate    - delta planning, parallel generation, manifest and command line
+  repo        - thin wrapper around the ostree command line
+"""
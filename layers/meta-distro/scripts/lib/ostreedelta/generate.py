@@ -0,0 +1,193 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Static delta generation
+
+Without a static delta, `ostree pull` fetches each new object of a commit
+with its own HTTP request: thousands of requests per update. A static
+delta from commit A to commit B packs what B adds over A (bsdiff for
+modified files) into a few parts, and a pull from A uses it instead when
+the repository summary lists it.
+
+Plan for REF, whose commit is the target:
+  - a delta from each of the DEPTH nearest ancestors of the target that
+    are still in the repository (the commits devices are likely to run)
+  - with --empty, also a from-scratch delta, for first installs
+
+A pair is skipped when the repository already has it and the manifest
+records it with the same generate arguments, so rebuilding an unchanged
+commit generates nothing. Up to JOBS `ostree static-delta generate`
+processes run at once, one per pair. With --prune, deltas the manifest
+recorded for REF that are no longer in the plan are deleted. The summary
+is regenerated last.
+
+The manifest is a JSON file, kept next to the repository in the deploy
+directory:
+
+  {"REF": {"FROM-TO": {"from": "FROM", "to": "TO", "args": [...],
+                       "seconds": 12.3}, ...}}
+
+Usage: python3 -m ostreedelta.generate REPO --ref REF [--depth N] [--empty]
+           [--jobs N] [--manifest FILE] [--prune]
+           [--generate-arg ARG ...] [--summary-arg ARG ...]
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from ostreedelta.repo import OstreeRepo
+
+DEFAULT_DEPTH = 3
+
+
+@dataclass
+class DeltaPair:
+    """One static delta: source commit (None: from scratch) to target"""
+    to: str
+    source: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        """Name as `ostree static-delta list` prints it"""
+        return f'{self.source}-{self.to}' if self.source else self.to
+
+
+def plan_deltas(repo: OstreeRepo, ref: str, depth: int = DEFAULT_DEPTH,
+                empty: bool = False) -> List[DeltaPair]:
+    """Deltas to the commit of ref from its ancestors (and from scratch)"""
+    target = repo.rev_parse(ref)
+    if target is None:
+        raise Exception(f"Ref '{ref}' not found in {repo.path}")
+    pairs = [DeltaPair(target, parent) for parent in repo.ancestors(target, depth)]
+    if empty:
+        pairs.append(DeltaPair(target))
+    return pairs
+
+
+def load_manifest(path: Optional[str]) -> Dict:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(path: str, manifest: Dict):
+    tmp = f'{path}.tmp-{os.getpid()}'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.rename(tmp, path)
+
+
+def generate(repo: OstreeRepo, ref: str, depth: int = DEFAULT_DEPTH, empty: bool = False,
+             jobs: Optional[int] = None, manifest_path: Optional[str] = None, prune: bool = False,
+             generate_args: Iterable[str] = (), summary_args: Iterable[str] = ()) -> Dict:
+    """Bring the static deltas of ref up to date and regenerate the summary
+
+    Returns:
+        Dict with the planned, generated, skipped and pruned delta names
+    """
+    generate_args, summary_args = list(generate_args), list(summary_args)
+    pairs = plan_deltas(repo, ref, depth, empty)
+    manifest = load_manifest(manifest_path)
+    recorded = manifest.setdefault(ref, {})
+    existing = set(repo.static_deltas())
+
+    todo = [pair for pair in pairs
+            if pair.name not in existing or recorded.get(pair.name, {}).get('args') != generate_args]
+    skipped = [pair.name for pair in pairs if pair not in todo]
+
+    def run(pair: DeltaPair) -> float:
+        start = time.perf_counter()
+        repo.generate_delta(pair.to, pair.source, generate_args)
+        return time.perf_counter() - start
+
+    generated: List[str] = []
+    errors: List[Exception] = []
+    if todo:
+        workers = max(1, min(jobs or os.cpu_count() or 1, len(todo)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run, pair): pair for pair in todo}
+            for future in as_completed(futures):
+                pair = futures[future]
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    recorded.pop(pair.name, None)
+                    continue
+                recorded[pair.name] = {'from': pair.source, 'to': pair.to, 'args': generate_args,
+                                       'seconds': round(seconds, 1)}
+                generated.append(pair.name)
+
+    pruned: List[str] = []
+    if prune and not errors:
+        planned = {pair.name for pair in pairs}
+        for name in sorted(set(recorded) - planned):
+            if name in existing:
+                repo.delete_delta(name)
+            del recorded[name]
+            pruned.append(name)
+
+    if manifest_path:
+        save_manifest(manifest_path, manifest)
+    if errors:
+        raise errors[0]
+    repo.update_summary(summary_args)
+    return {
+        'planned': [pair.name for pair in pairs],
+        'generated': sorted(generated),
+        'skipped': skipped,
+        'pruned': pruned,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate OSTree static deltas for the head of a ref")
+    parser.add_argument('repo')
+    parser.add_argument('--ref', required=True, help="branch whose head the deltas lead to")
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                        help="deltas from this many ancestors of the head")
+    parser.add_argument('--empty', action='store_true', help="also generate a from-scratch delta")
+    parser.add_argument('--jobs', type=int, default=None, help="deltas generated at once")
+    parser.add_argument('--manifest', default=None, help="JSON record of generated deltas")
+    parser.add_argument('--prune', action='store_true',
+                        help="delete deltas of the ref that are no longer planned")
+    parser.add_argument('--generate-arg', action='append', default=[],
+                        help="extra `ostree static-delta generate` argument; repeatable, "
+                             "or several separated by spaces")
+    parser.add_argument('--summary-arg', action='append', default=[],
+                        help="extra `ostree summary -u` argument (e.g. --gpg-sign=KEYID)")
+    parser.add_argument('--ostree', default='ostree', help="ostree binary")
+    args = parser.parse_args(argv)
+
+    if args.depth < 0:
+        raise Exception("--depth must not be negative")
+    start = time.perf_counter()
+    repo = OstreeRepo(args.repo, args.ostree)
+    generate_args = [arg for value in args.generate_arg for arg in value.split()]
+    summary_args = [arg for value in args.summary_arg for arg in value.split()]
+    result = generate(repo, args.ref, args.depth, args.empty, args.jobs, args.manifest, args.prune,
+                      generate_args, summary_args)
+    for name in result['generated']:
+        print(f"generated {name}")
+    for name in result['pruned']:
+        print(f"pruned    {name}")
+    print(f"{args.ref}: {len(result['planned'])} deltas, {len(result['generated'])} generated, "
+          f"{len(result['skipped'])} unchanged, {len(result['pruned'])} pruned, "
+          f"{time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,83 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+ostree command line wrapper
+
+The few repository operations the delta pipeline needs, run through the
+`ostree` binary (ostree-native in a build): resolving refs and parents,
+listing, generating and deleting static deltas, and updating the summary.
+Failures raise an Exception carrying ostree's error message.
+"""
+
+import re
+import subprocess
+from typing import List, Optional
+
+CHECKSUM = re.compile(r'^[0-9a-f]{64}$')
+
+
+class OstreeRepo:
+    """An OSTree repository on disk"""
+
+    def __init__(self, path: str, ostree: str = 'ostree'):
+        self.path = path
+        self.ostree = ostree
+
+    def run(self, *args: str) -> str:
+        command = [self.ostree, f'--repo={self.path}'] + list(args)
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        if result.returncode != 0:
+            raise Exception(f"{' '.join(command)} failed: {result.stderr.strip()}")
+        return result.stdout
+
+    def rev_parse(self, rev: str) -> Optional[str]:
+        """Commit checksum of rev, None when it does not resolve"""
+        try:
+            checksum = self.run('rev-parse', rev).strip()
+        except Exception:
+            return None
+        return checksum if CHECKSUM.match(checksum) else None
+
+    def ancestors(self, commit: str, depth: int) -> List[str]:
+        """Up to depth parents of commit, nearest first
+
+        Stops at the first parent that is not in the repository (history
+        pruned, or the branch started there).
+        """
+        found = []
+        current = commit
+        for _ in range(depth):
+            parent = self.rev_parse(current + '^')
+            if parent is None or not self.has_commit(parent):
+                break
+            found.append(parent)
+            current = parent
+        return found
+
+    def has_commit(self, checksum: str) -> bool:
+        try:
+            self.run('show', checksum)
+        except Exception:
+            return False
+        return True
+
+    def static_deltas(self) -> List[str]:
+        """Names of the static deltas in the repository ('FROM-TO' or 'TO')"""
+        return [line.strip() for line in self.run('static-delta', 'list').splitlines()
+                if line.strip() and not line.startswith('No static deltas')]
+
+    def generate_delta(self, to: str, source: Optional[str], args: List[str] = ()):
+        """Generate the static delta source -> to (source None: from scratch)"""
+        self.run('static-delta', 'generate', f'--to={to}',
+                 *([f'--from={source}'] if source else ['--empty']), *args)
+
+    def delete_delta(self, name: str):
+        self.run('static-delta', 'delete', name)
+
+    def update_summary(self, args: List[str] = ()):
+        self.run('summary', '--update', *args)
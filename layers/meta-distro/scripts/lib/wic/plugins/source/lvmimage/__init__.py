@@ -0,0 +1,37 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Helper package for the lvmrootfs WIC plugin
+
+WIC loads every *.py file in plugins/source as a plugin, so the building
+blocks of the rootless image engine live in this package instead and are
+imported by lvmrootfs.py. Nothing in here depends on the wic package, which
+keeps the modules usable from standalone tools.
+
+Modules:
+  assemble    - offset-based disk image assembly (no loop devices, no mounts)
+  bench       - offline benchmark and regression suite with a fake storage backend
+  bmap        - bmaptool-compatible block map writer
+  buildqueue  - concurrent runner for generated scripts with namespaced resources
+  dedup       - rootfs deduplication: identical files hardlinked by content hash
+  devwait     - inotify-driven wait for loop, dm-crypt and LV device nodes
+  gpt         - native GPT writer (protective MBR, primary and backup tables)
+  incremental - content manifest and in-place rootfs update of a previous image
+  journal     - crash-safe phase journal: resume interrupted builds, reclaim their devices
+  looplease   - loop device leases via /dev/loop-control, sysfs and a locked state file
+  luks2       - userspace LUKS2 header writer and parallel AES-XTS payload encryption
+  lvm2        - LVM2 physical volume label and VG metadata writer
+  lvmshell    - one `lvm` shell session for a batch of commands, JSON reports
+  mounts      - LVs populated from rootfs subtrees (lvm-mounts) via hardlink views
+  pbkdf       - LUKS2 keyslot key-derivation profiles and the first-boot re-key mark
+  plan        - dependency-graph step executor with rollback and timing report
+  scan        - parallel rootfs scanner with a cached column-array manifest
+  sizing      - rootfs measurement and ext4 overhead model for content-driven image sizing
+  sparse      - hole-preserving file copy helpers
+  trace       - per-phase spans, Chrome trace JSON and summary table
+  zstdseek    - seekable multi-frame zstd image writer and parallel extractor
+"""
@@ -0,0 +1,336 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Rootless offset-based disk image assembly
+
+Builds the complete lvmrootfs disk image as a regular file, without loop
+devices, device-mapper, mounts or sudo:
+
+  1. Create the sparse image file and write the GPT natively (lvmimage.gpt)
+  2. Build the ESP as a standalone FAT image (mkfs.vfat + mcopy) and splice
+     it at the partition 1 offset
+  3. Create the XBOOTLDR ext4 filesystem in place (mkfs.ext4 -E offset=)
+  4. Write the LVM2 PV label and VG metadata at the start of partition 3, or
+     at the LUKS2 data offset when encryption is enabled
+  5. Create each LV filesystem in place at its extent offset, populating the
+     rootfs LV with mkfs.ext4 -d, and every LV with a mountpoint
+     (lvm-mounts) from that subtree, which the rootfs LV then leaves out
+     (lvmimage.mounts)
+  6. With LUKS enabled, write the LUKS2 header and keyslot and encrypt the
+     plaintext payload in place in parallel (lvmimage.luks2)
+
+Every offset is computed from the fixed 1 MiB / ESP / XBOOTLDR / rest layout,
+so nothing has to be read back from the kernel, and steps 2-5 write disjoint
+byte ranges and run concurrently through lvmimage.plan.ExecutionPlan.
+
+With a journal key every step is checkpointed in <image>.journal
+(lvmimage.journal). A failed or killed assembly keeps its partial image, and
+the next one with the same layout skips the steps that finished, as long as
+the source tree they were built from is unchanged. An interrupted LUKS2
+encryption cannot be continued and starts the image over.
+"""
+
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from lvmimage import gpt, journal, luks2, lvm2, mounts, pbkdf
+from lvmimage.plan import ExecutionPlan
+from lvmimage.sparse import punch_hole, splice_file
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+BOOT_UUID = "5d7e1b2c-3f4a-4c8d-9e22-1a6b7c8d9e33"
+
+
+@dataclass
+class ByteRange:
+    """A byte range inside the disk image"""
+    offset: int
+    size: int
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+@dataclass
+class PartitionLayout:
+    """Byte ranges of the three lvmrootfs partitions"""
+    total_size: int
+    efi: ByteRange
+    boot: ByteRange
+    crypt: ByteRange
+    partitions: List[gpt.GptPartition] = field(default_factory=list)
+
+
+def compute_partition_layout(total_size_mb: int, efi_size_mb: int, boot_size_mb: int,
+                             part_types: Optional[Dict[str, str]] = None) -> PartitionLayout:
+    """Compute partition byte ranges for the fixed ESP/XBOOTLDR/rest layout
+
+    Same placement as `sgdisk --new=1:1MiB:+<efi> --new=2:0:+<boot> --new=3:0:0`:
+    partition 3 runs up to the last usable LBA before the backup GPT.
+
+    Args:
+        part_types: Optional overrides for the 'esp', 'xbootldr' and 'root'
+            partition type GUIDs (PARTTYPE_* BitBake variables)
+    """
+    types = part_types or {}
+    total_size = total_size_mb * MiB
+    partitions = gpt.layout_partitions(total_size, [
+        ('efi', types.get('esp') or gpt.PARTTYPE_ESP, efi_size_mb * MiB),
+        ('xbootldr', types.get('xbootldr') or gpt.PARTTYPE_XBOOTLDR, boot_size_mb * MiB),
+        ('crypt_lvm', types.get('root') or gpt.PARTTYPE_ROOT, None),
+    ])
+    efi, boot, crypt = [ByteRange(p.offset, p.size) for p in partitions]
+    return PartitionLayout(total_size, efi, boot, crypt, partitions)
+
+
+def _create_sparse_image(image_path: str, total_size: int):
+    """Create (or truncate) the image file as a sparse file"""
+    with open(image_path, 'wb') as f:
+        f.truncate(total_size)
+
+
+def _build_efi_image(run_cmd: Callable, image_path: str, efi: ByteRange, efi_dir: str, workdir: str) -> int:
+    """Build the ESP as a standalone FAT image and splice it into place"""
+    efi_image = os.path.join(workdir, 'efi.img')
+    if os.path.exists(efi_image):
+        os.unlink(efi_image)
+    run_cmd(['mkfs.vfat', '-F', '32', '-n', 'efi', '-C', efi_image, str(efi.size // 1024)])
+    if efi_dir and os.path.isdir(efi_dir):
+        entries = [os.path.join(efi_dir, e) for e in sorted(os.listdir(efi_dir))]
+        if entries:
+            run_cmd(['mcopy', '-s', '-p', '-i', efi_image] + entries + ['::/'])
+    copied = splice_file(efi_image, image_path, efi.offset)
+    os.unlink(efi_image)
+    return copied
+
+
+def rebuild_efi_partition(run_cmd: Callable, image_path: str, efi: ByteRange, rootfs_dir: str,
+                          workdir: str) -> int:
+    """Rebuild the ESP of an existing image from rootfs/boot/efi
+
+    The old partition contents are punched out first, since splicing only
+    writes the allocated ranges of the new FAT image.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    punch_hole(image_path, efi.offset, efi.size)
+    efi_dir = os.path.join(rootfs_dir, 'boot', 'efi') if rootfs_dir else None
+    return _build_efi_image(run_cmd, image_path, efi, efi_dir, workdir)
+
+
+def _mkfs_ext4_at(run_cmd: Callable, image_path: str, extent: ByteRange, uuid: str, label: str,
+                  source_dir: str = None, block_size: int = None, explicit_zeroes: bool = False):
+    """Create an ext4 filesystem in place at a byte offset of the image
+
+    explicit_zeroes makes mke2fs write the blocks it zeroes (journal, inode
+    tables) instead of punching holes for them, for payloads that are
+    encrypted afterwards: holes are skipped there and would not read back
+    as zeroes through dm-crypt.
+    """
+    cmd = ['env', 'UNIX_IO_NOZEROOUT=1'] if explicit_zeroes else []
+    cmd += ['mkfs.ext4', '-F', '-q',
+            '-E', f'offset={extent.offset},nodiscard,root_owner=0:0',
+            '-U', uuid, '-L', label]
+    if block_size:
+        cmd += ['-b', str(block_size)]
+    if source_dir:
+        cmd += ['-d', source_dir]
+    cmd += [image_path, f'{extent.size // 1024}k']
+    run_cmd(cmd)
+
+
+def _encrypt_crypt_partition(image_path: str, crypt: ByteRange, passphrase: str,
+                             jobs: Optional[int], profile=None) -> luks2.Luks2Volume:
+    """Format crypt_lvm as LUKS2 and encrypt the plaintext PV behind it
+
+    profile is the lvmimage.pbkdf.PbkdfProfile of the keyslot (pbkdf2
+    calibrated for luks2.KEYSLOT_ITER_TIME_MS when None).
+    """
+    options = {}
+    if profile is not None:
+        profile.check_userspace()
+        options = {'iterations': profile.iterations,
+                   'subsystem': pbkdf.REKEY_SUBSYSTEM if profile.rekey else ''}
+        if profile.iter_time_ms:
+            options['iter_time_ms'] = profile.iter_time_ms
+    volume = luks2.format_volume(image_path, crypt.offset, crypt.size, passphrase, **options)
+    start = time.perf_counter()
+    encrypted = luks2.encrypt_payload(image_path, volume, jobs)
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    logger.info(f"✓ LUKS2 payload encrypted: {encrypted // MiB}MB in {elapsed:.1f}s "
+                f"({encrypted / MiB / elapsed:.0f} MiB/s, holes skipped)")
+
+    # Same check as `cryptsetup open --test-passphrase` plus a look at the
+    # decrypted PV label
+    unlocked = luks2.open_volume(image_path, crypt.offset, crypt.size, passphrase)
+    label = luks2.read_payload(image_path, unlocked, lvm2.LABEL_SECTOR * lvm2.SECTOR_SIZE,
+                               len(lvm2.LABEL_ID))
+    if unlocked.volume_key != volume.volume_key or label != lvm2.LABEL_ID:
+        raise Exception("LUKS2 volume does not unlock to the LVM physical volume")
+    logger.info(f"✓ LUKS2 volume {volume.uuid} verified")
+    return volume
+
+
+def assemble_disk_image(config, image_path: str, rootfs_dir: str, total_size_mb: int,
+                        efi_size_mb: int, boot_size_mb: int, workdir: str,
+                        run_cmd: Callable, part_types: Optional[Dict[str, str]] = None,
+                        jobs: Optional[int] = None, journal_key: Optional[str] = None) -> Dict:
+    """Assemble the full disk image at image_path without privileges
+
+    Args:
+        config: DiskConfig describing the VG and its logical volumes
+        image_path: Output disk image path
+        rootfs_dir: Root filesystem tree used to populate the rootfs LV and
+            the LVs in config.mount_points
+        total_size_mb: Size of the whole disk image in MB
+        efi_size_mb: ESP size in MB
+        boot_size_mb: XBOOTLDR size in MB
+        workdir: Scratch directory for standalone filesystem images
+        run_cmd: Command runner with the signature of _run_cmd
+        part_types: Optional partition type GUID overrides
+        jobs: Concurrent assembly steps and LUKS2 encryption worker
+            processes (default: all CPUs)
+        journal_key: Layout fingerprint; when given the assembly is
+            journaled and resumes an interrupted one with the same key
+
+    Returns:
+        Dict with the partition layout, LV byte ranges inside the image, the
+        LUKS2 volume (None when encryption is disabled or was resumed), the
+        executed plan and the names of the resumed steps
+    """
+    layout = compute_partition_layout(total_size_mb, efi_size_mb, boot_size_mb, part_types)
+    os.makedirs(workdir, exist_ok=True)
+
+    # The PV is built in plaintext where the LUKS2 data segment will be and
+    # encrypted in place once all filesystems are written
+    pv = ByteRange(layout.crypt.offset, layout.crypt.size)
+    if config.luks_enabled:
+        pv = ByteRange(layout.crypt.offset + luks2.DATA_OFFSET, luks2.payload_size(layout.crypt.size))
+    vg_layout = lvm2.plan_volume_group(config, pv.size)
+
+    lvs = [config.rootfs_lv] + list(config.additional_lvs)
+    lv_ranges: Dict[str, ByteRange] = {}
+    for lv in lvs:
+        lv_ranges[lv.name] = ByteRange(pv.offset + vg_layout.volume_offset(lv.name),
+                                       vg_layout.volume_size(lv.name))
+
+    def create_image():
+        _create_sparse_image(image_path, layout.total_size)
+        gpt.write_gpt(image_path, layout.total_size, layout.partitions)
+        logger.info(f"✓ Sparse disk image with GPT created: {image_path} ({total_size_mb}MB)")
+
+    def remove_image(_):
+        if os.path.exists(image_path):
+            os.unlink(image_path)
+
+    efi_dir = os.path.join(rootfs_dir, 'boot', 'efi') if rootfs_dir else None
+
+    def build_efi():
+        copied = _build_efi_image(run_cmd, image_path, layout.efi, efi_dir, workdir)
+        logger.info(f"✓ EFI partition built and spliced at {layout.efi.offset} ({copied} bytes of data)")
+
+    def format_boot():
+        _mkfs_ext4_at(run_cmd, image_path, layout.boot, BOOT_UUID, 'xbootldr')
+        logger.info(f"✓ XBOOTLDR partition formatted at {layout.boot.offset}")
+
+    def write_pv():
+        lvm2.write_physical_volume(image_path, pv.offset, vg_layout)
+        lvm2.read_physical_volume(image_path, pv.offset)
+        logger.info(f"✓ LVM PV and VG '{config.vg_name}' metadata written "
+                    f"({vg_layout.pe_count} extents, {vg_layout.free_extents} free)")
+
+    def format_lv(lv, source_dir):
+        extent = lv_ranges[lv.name]
+        if config.luks_enabled:
+            # dm-crypt with 4 KiB sectors cannot back a 1 KiB block filesystem
+            _mkfs_ext4_at(run_cmd, image_path, extent, lv.uuid, lv.name, source_dir,
+                          block_size=luks2.DATA_SECTOR_SIZE, explicit_zeroes=True)
+        else:
+            _mkfs_ext4_at(run_cmd, image_path, extent, lv.uuid, lv.name, source_dir)
+        logger.info(f"✓ LV {lv.name} formatted at {extent.offset} ({extent.size // MiB}MB)")
+
+    # Every format step writes a disjoint byte range of the image (the PV
+    # metadata lives in the 1 MiB before the first extent), so they only
+    # depend on the image existing; encryption needs all of them
+    plan = ExecutionPlan(max_workers=jobs or os.cpu_count() or 1)
+    # A journaled assembly keeps its partial image to resume from
+    plan.add_step('image', create_image, outputs=['image'],
+                  rollback=None if journal_key else remove_image)
+    plan.add_step('efi', build_efi, inputs=['image'], outputs=['efi'])
+    plan.add_step('xbootldr', format_boot, inputs=['image'], outputs=['xbootldr'])
+    plan.add_step('pv', write_pv, inputs=['image'], outputs=['pv'])
+    # Trees with a mountpoint below them are staged as hardlink views
+    # first; the others are read in place
+    trees = mounts.source_trees(rootfs_dir, config.rootfs_lv.name,
+                                config.mount_points) if rootfs_dir else []
+    sources = {}
+    for tree in trees:
+        if not os.path.isdir(tree.path):
+            continue
+        sources[tree.lv_name] = tree.path
+        if tree.excluded:
+            sources[tree.lv_name] = mounts.view_path(workdir, tree.lv_name)
+            plan.add_step(f'view:{tree.lv_name}', mounts.stage_view,
+                          [tree.path, tree.excluded, sources[tree.lv_name]],
+                          outputs=[f'view:{tree.lv_name}'])
+    for lv in lvs:
+        plan.add_step(f'lv:{lv.name}', format_lv, [lv, sources.get(lv.name)],
+                      inputs=['image', f'view:{lv.name}'], outputs=[f'lv:{lv.name}'])
+    if config.luks_enabled:
+        plan.add_step('luks', _encrypt_crypt_partition,
+                      [image_path, layout.crypt, config.luks_passphrase or '', jobs,
+                       config.luks_pbkdf],
+                      inputs=['pv'] + [f'lv:{name}' for name in lv_ranges], outputs=['luks'])
+
+    progress = None
+    if journal_key:
+        # Steps are resumed only when their source tree is unchanged
+        inputs = {'efi': journal.tree_signature(efi_dir) if efi_dir else ''}
+        inputs.update({f'lv:{tree.lv_name}': journal.tree_signature(tree.path) for tree in trees})
+        info = {'lv_uuids': {lv.name: lv.uuid for lv in lvs}}
+        progress, resumed = journal.resume(journal.journal_path(image_path), journal_key,
+                                           image_path, inputs, barriers=['luks'], info=info)
+        # A view is only needed by its LV step
+        plan.resumed = resumed | {'view:' + name[3:] for name in resumed if name.startswith('lv:')}
+        if 'luks' in resumed and 'luks' not in plan.skipped():
+            # The payload is already encrypted; an LV that changed since
+            # cannot be rewritten in plaintext and encrypted again
+            logger.info("Encrypted image has changed inputs, assembling it from scratch")
+            progress = journal.Journal.create(progress.path, journal_key, info)
+            progress.set_owner()
+            plan.resumed = set()
+
+        def step_started(step):
+            if not step.name.startswith('view:'):
+                progress.begin(step.name)
+
+        def step_done(step):
+            if not step.name.startswith('view:'):
+                progress.done(step.name, image_path, inputs.get(step.name, ''))
+
+        plan.on_start, plan.on_done = step_started, step_done
+    try:
+        plan.execute()
+    finally:
+        mounts.remove_views(workdir, trees)
+    logger.info("Assembly steps (* = critical path):\n" + plan.report())
+    if progress:
+        progress.finish()
+
+    return {
+        'layout': layout,
+        'vg_layout': vg_layout,
+        'lv_ranges': lv_ranges,
+        'luks_volume': plan.state.get('luks'),
+        'plan': plan,
+        'resumed': sorted(plan.skipped()),
+    }
@@ -0,0 +1,412 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Offline benchmark and regression suite for the lvmrootfs plugin
+
+Runs the plugin outside BitBake, without sudo, loop devices or
+device-mapper, on synthetic rootfs trees:
+
+  parse            - _parse_source_params on a representative sourceparams
+  script           - _generate_shell_script for the same configuration
+  prepare-script   - do_prepare_partition in lvm-assembly=script mode
+  prepare-offset   - do_prepare_partition in lvm-assembly=offset mode with the
+                     recording fake backend (no mkfs, every command recorded),
+                     including the incremental content manifest of the tree
+  scan-cold        - lvmimage.scan of the tree with content hashes, no cache
+  scan-cached      - the same scan answered from a valid cached manifest
+  assemble         - end-to-end rootless offset assembly with the real tools
+                     (mkfs.ext4, mkfs.vfat, mcopy); skipped when they are
+                     missing
+
+The fake backend is installed through lvmrootfs.COMMAND_BACKEND and answers
+every _run_cmd call. When the wic package is not importable
+(outside a Poky checkout) a minimal stand-in for the three names the plugin
+imports is registered, so the suite runs on any host.
+
+Results are written as JSON with a fixed layout (format "lvmrootfs-bench",
+version 1), one entry per benchmark and tree size keyed by "id". Pass a
+previous result with --baseline to fail (exit status 1) when a median wall
+time regressed by more than --threshold and by at least --min-delta seconds.
+
+Usage: python3 -m lvmimage.bench [--files 1000,100000,1000000] [-o bench.json]
+                                 [--baseline old.json] [--threshold 0.25]
+                                 [--min-delta 0.005]
+"""
+
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+BENCH_FORMAT = 'lvmrootfs-bench'
+BENCH_VERSION = 1
+DEFAULT_FILES = (1000, 100000, 1000000)
+# Smallest median change (seconds) compare() reports as a regression
+MIN_DELTA_S = 0.005
+# Files per directory of the synthetic tree
+FANOUT = 1000
+# Size of the synthetic image: large enough for the 1M file tree
+TOTAL_SIZE_MB = 8192
+SOURCE_PARAMS = {
+    'lvm-vg-name': 'vg0',
+    'lvm-rootfs-name': 'rootlv',
+    'lvm-rootfs-uuid': '8e8c2c0a-4f0e-4b8a-9e1a-2b6d9f3e7c11',
+    'lvm-volumes': 'datafs:256M,logfs:128M,varfs:100%FREE',
+    'lvm-volumes-uuids': 'varfs:d3b4a1f2-6c9e-4f8b-9c22-0f7b8e1a4d55',
+    'luks-passphrase': 'NULL',
+    'luks-name': 'cryptroot',
+}
+REAL_TOOLS = ('mkfs.ext4', 'mkfs.vfat', 'mcopy')
+
+
+@dataclass
+class RecordingBackend:
+    """Fake storage backend recording every command instead of running it
+
+    Commands that create files the plugin reads back afterwards (the
+    standalone ESP image of mkfs.vfat -C) create a sparse file of the
+    requested size; everything else only succeeds.
+    """
+    calls: List[Dict] = field(default_factory=list)
+    replies: Dict[str, str] = field(default_factory=lambda: {
+        'losetup': '/dev/loop0',
+    })
+
+    def __call__(self, cmd: List[str], check: bool = True, capture: bool = False,
+                 sudo: bool = False, input: Optional[str] = None) -> Optional[str]:
+        self.calls.append({'argv': list(cmd), 'sudo': sudo})
+        argv = cmd[2:] if cmd[:1] == ['env'] else cmd
+        if argv and os.path.basename(argv[0]) == 'mkfs.vfat' and '-C' in argv:
+            path = argv[argv.index('-C') + 1]
+            with open(path, 'wb') as f:
+                f.truncate(int(argv[-1]) * 1024)
+        if capture:
+            return self.replies.get(os.path.basename(argv[0]) if argv else '', '')
+        return None
+
+    def counts(self) -> Dict[str, int]:
+        """Number of recorded commands per tool"""
+        counts: Dict[str, int] = {}
+        for call in self.calls:
+            argv = call['argv'][2:] if call['argv'][:1] == ['env'] else call['argv']
+            tool = os.path.basename(argv[0]) if argv else '?'
+            counts[tool] = counts.get(tool, 0) + 1
+        return counts
+
+
+@dataclass
+class _Partition:
+    """The part of a WIC Partition that do_prepare_partition reads"""
+    size: int = TOTAL_SIZE_MB
+    extra_space: int = 0
+
+
+def _ensure_wic():
+    """Make `import wic` work, with a minimal stand-in outside Poky"""
+    try:
+        importlib.import_module('wic.pluginbase')
+        importlib.import_module('wic.misc')
+        return
+    except ImportError:
+        pass
+    wic = types.ModuleType('wic')
+
+    class WicError(Exception):
+        pass
+
+    wic.WicError = WicError
+    pluginbase = types.ModuleType('wic.pluginbase')
+    pluginbase.SourcePlugin = type('SourcePlugin', (), {})
+    misc = types.ModuleType('wic.misc')
+    misc.get_bitbake_var = lambda name, image=None: None
+    wic.pluginbase = pluginbase
+    wic.misc = misc
+    sys.modules.update({'wic': wic, 'wic.pluginbase': pluginbase, 'wic.misc': misc})
+
+
+def load_plugin():
+    """Import lvmrootfs.py by file path, the way WIC loads source plugins"""
+    if 'lvmrootfs' in sys.modules:
+        return sys.modules['lvmrootfs']
+    _ensure_wic()
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lvmrootfs.py')
+    spec = importlib.util.spec_from_file_location('lvmrootfs', path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['lvmrootfs'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_tree(root: str, files: int) -> str:
+    """Create (or reuse) a synthetic rootfs tree with the given number of files
+
+    Files are spread FANOUT per directory under usr/share/bench, with sizes
+    cycling from empty to 16 KiB, plus an ESP under boot/efi and an
+    /etc/fstab, so every step of the assembly has something to do.
+    """
+    tree = os.path.join(root, f'rootfs-{files}')
+    stamp = os.path.join(tree, '.bench-complete')
+    if os.path.exists(stamp):
+        return tree
+    if os.path.exists(tree):
+        shutil.rmtree(tree)
+    for directory in ('etc', 'boot/efi/EFI/BOOT', 'var/log', 'usr/share/bench'):
+        os.makedirs(os.path.join(tree, directory))
+    with open(os.path.join(tree, 'etc', 'fstab'), 'w') as f:
+        f.write('# synthetic rootfs\n')
+    with open(os.path.join(tree, 'boot', 'efi', 'EFI', 'BOOT', 'BOOTX64.EFI'), 'wb') as f:
+        f.write(b'\0' * 65536)
+    payload = bytes(range(256)) * 64
+    for index in range(files):
+        directory = os.path.join(tree, 'usr', 'share', 'bench', f'd{index // FANOUT:04d}')
+        if index % FANOUT == 0:
+            os.mkdir(directory)
+        size = (index * 977) % (len(payload) + 1)
+        with open(os.path.join(directory, f'f{index % FANOUT:04d}'), 'wb') as f:
+            f.write(payload[:size])
+    open(stamp, 'w').close()
+    return tree
+
+
+def _timed(func: Callable, repeat: int) -> Dict:
+    """Run func repeat times, returning wall and CPU seconds per run"""
+    wall, cpu = [], []
+    for _ in range(repeat):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        func()
+        wall.append(time.perf_counter() - start)
+        cpu.append(time.process_time() - start_cpu)
+    return {'wall': wall, 'cpu': cpu}
+
+
+def _stats(values: List[float]) -> Dict:
+    return {'min': round(min(values), 6), 'median': round(statistics.median(values), 6),
+            'max': round(max(values), 6)}
+
+
+def _result(name: str, backend: str, files: Optional[int], repeat: int,
+            status: str = 'ok', timings: Optional[Dict] = None, **extra) -> Dict:
+    entry = {
+        'id': name if files is None else f'{name}@{files}',
+        'name': name,
+        'backend': backend,
+        'files': files,
+        'repeat': repeat,
+        'status': status,
+        'wall_s': _stats(timings['wall']) if timings else None,
+        'cpu_s': _stats(timings['cpu']) if timings else None,
+    }
+    entry.update(extra)
+    return entry
+
+
+def _with_backend(plugin, backend: Optional[RecordingBackend], func: Callable):
+    previous = plugin.COMMAND_BACKEND
+    plugin.COMMAND_BACKEND = backend
+    try:
+        return func()
+    finally:
+        plugin.COMMAND_BACKEND = previous
+
+
+def _prepare(plugin, params: Dict, workdir: str, rootfs_dir: str):
+    plugin.LvmRootfsPlugin.do_prepare_partition(
+        _Partition(), params, None, workdir, None, None, None, rootfs_dir, None)
+
+
+def bench_parse(plugin, repeat: int) -> Dict:
+    def run():
+        for _ in range(1000):
+            plugin._parse_source_params(SOURCE_PARAMS)
+    return _result('parse', 'none', None, repeat, timings=_timed(run, repeat), iterations=1000)
+
+
+def bench_script(plugin, repeat: int) -> Dict:
+    config, _, generated = plugin._parse_source_params(SOURCE_PARAMS)
+    config.rootfs_lv.size_mb = 2048
+    config.rootfs_lv.size_str = '2048M'
+
+    def run():
+        for _ in range(100):
+            plugin._generate_shell_script(
+                config, TOTAL_SIZE_MB, 512, 1024, TOTAL_SIZE_MB - 1546, config.vg_name,
+                config.luks_name, config.luks_passphrase, config.luks_enabled,
+                config.rootfs_lv.name, config.rootfs_lv.uuid, config.additional_lvs,
+                'gpt-head.bin', 'gpt-tail.bin', TOTAL_SIZE_MB * 2048 - 33, generated)
+    return _result('script', 'none', None, repeat, timings=_timed(run, repeat), iterations=100)
+
+
+def bench_prepare_script(plugin, repeat: int, workdir: str) -> Dict:
+    backend = RecordingBackend()
+    timings = _with_backend(plugin, backend, lambda: _timed(
+        lambda: _prepare(plugin, SOURCE_PARAMS, workdir, os.path.join(workdir, 'empty')), repeat))
+    shutil.rmtree(os.path.join('/tmp', f'wic-lvm-{os.getpid()}'), ignore_errors=True)
+    return _result('prepare-script', 'fake', None, repeat, timings=timings,
+                   commands=len(backend.calls) // repeat)
+
+
+def bench_prepare_offset(plugin, repeat: int, workdir: str, tree: str, files: int) -> Dict:
+    backend = RecordingBackend()
+    image = os.path.join(workdir, 'fake.wic')
+    params = dict(SOURCE_PARAMS, **{'lvm-assembly': 'offset', 'lvm-image': image,
+                                    'lvm-incremental': '1'})
+
+    def run():
+        # Always a full assembly: the manifest of the previous run is dropped
+        for suffix in ('', '.manifest.json'):
+            if os.path.exists(image + suffix):
+                os.unlink(image + suffix)
+        _prepare(plugin, params, workdir, tree)
+
+    timings = _with_backend(plugin, backend, lambda: _timed(run, repeat))
+    return _result('prepare-offset', 'fake', files, repeat, timings=timings,
+                   commands=len(backend.calls) // repeat,
+                   command_counts={k: v // repeat for k, v in sorted(backend.counts().items())})
+
+
+def bench_scan(repeat: int, workdir: str, tree: str, files: int) -> List[Dict]:
+    from lvmimage import scan
+
+    cache_dir = os.path.join(workdir, 'scan-cache')
+    cold = _timed(lambda: scan.scan(tree, content_hash=True, cache=False), repeat)
+    scan.scan(tree, content_hash=True, cache_dir=cache_dir)
+    cached = _timed(lambda: scan.scan(tree, content_hash=True, cache_dir=cache_dir), repeat)
+    entries = len(scan.scan(tree, cache_dir=cache_dir))
+    return [_result('scan-cold', 'none', files, repeat, timings=cold, entries=entries),
+            _result('scan-cached', 'none', files, repeat, timings=cached, entries=entries)]
+
+
+def bench_assemble(plugin, repeat: int, workdir: str, tree: str, files: int) -> Dict:
+    missing = [tool for tool in REAL_TOOLS if not shutil.which(tool)]
+    if missing:
+        return _result('assemble', 'real', files, repeat, status='skipped',
+                       reason=f"missing {', '.join(missing)}")
+    image = os.path.join(workdir, 'real.wic')
+    params = dict(SOURCE_PARAMS, **{'lvm-assembly': 'offset', 'lvm-image': image})
+    timings = _with_backend(plugin, None, lambda: _timed(
+        lambda: _prepare(plugin, params, workdir, tree), repeat))
+    allocated = os.stat(image).st_blocks * 512
+    return _result('assemble', 'real', files, repeat, timings=timings,
+                   image_allocated_bytes=allocated)
+
+
+def run_suite(files: List[int], repeat: int = 3, workdir: Optional[str] = None,
+              tree_dir: Optional[str] = None, real: bool = True) -> Dict:
+    """Run every benchmark and return the result document"""
+    import logging
+
+    plugin = load_plugin()
+    # The plugin logs every step at DEBUG; that would dominate the timings
+    logging.disable(logging.INFO)
+    results = []
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        os.makedirs(os.path.join(tmp, 'empty'))
+        # Keep the plugin's scan cache out of the user's home directory
+        scan_cache = os.environ.get('LVMROOTFS_SCAN_CACHE')
+        os.environ['LVMROOTFS_SCAN_CACHE'] = os.path.join(tmp, 'plugin-scan-cache')
+        trees = tree_dir or tmp
+        os.makedirs(trees, exist_ok=True)
+        try:
+            results.append(bench_parse(plugin, repeat))
+            results.append(bench_script(plugin, repeat))
+            results.append(bench_prepare_script(plugin, repeat, tmp))
+            for count in files:
+                start = time.perf_counter()
+                tree = make_tree(trees, count)
+                print(f"tree of {count} files ready in {time.perf_counter() - start:.1f}s",
+                      file=sys.stderr)
+                results.append(bench_prepare_offset(plugin, repeat, tmp, tree, count))
+                results.extend(bench_scan(repeat, tmp, tree, count))
+                if real:
+                    results.append(bench_assemble(plugin, repeat, tmp, tree, count))
+        finally:
+            logging.disable(logging.NOTSET)
+            if scan_cache is None:
+                os.environ.pop('LVMROOTFS_SCAN_CACHE', None)
+            else:
+                os.environ['LVMROOTFS_SCAN_CACHE'] = scan_cache
+    return {
+        'format': BENCH_FORMAT,
+        'version': BENCH_VERSION,
+        'host': {'python': platform.python_version(), 'machine': platform.machine(),
+                 'cpus': os.cpu_count()},
+        'results': results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, threshold: float,
+            min_delta: float = MIN_DELTA_S) -> List[str]:
+    """Describe every benchmark whose median wall time regressed beyond threshold
+
+    Changes below min_delta seconds are timer noise on sub-millisecond
+    benchmarks and never count as regressions.
+    """
+    if baseline.get('format') != BENCH_FORMAT or baseline.get('version') != BENCH_VERSION:
+        raise Exception("Baseline is not a lvmrootfs-bench version "
+                        f"{BENCH_VERSION} result")
+    previous = {r['id']: r for r in baseline['results'] if r['status'] == 'ok'}
+    regressions = []
+    for result in current['results']:
+        old = previous.get(result['id'])
+        if result['status'] != 'ok' or not old:
+            continue
+        before, after = old['wall_s']['median'], result['wall_s']['median']
+        if before > 0 and after > before * (1 + threshold) and after - before >= min_delta:
+            regressions.append(f"{result['id']}: {before:.3f}s -> {after:.3f}s "
+                               f"(+{100 * (after / before - 1):.0f}%)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline lvmrootfs benchmark suite")
+    parser.add_argument('--files', default=','.join(str(n) for n in DEFAULT_FILES),
+                        help="comma-separated synthetic rootfs sizes in files")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--tree-dir', default=None,
+                        help="keep the synthetic trees here and reuse them across runs")
+    parser.add_argument('--no-real', action='store_true',
+                        help="only use the fake backend")
+    parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--min-delta', type=float, default=MIN_DELTA_S,
+                        help="ignore median changes below this many seconds")
+    args = parser.parse_args(argv)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+
+    files = [int(n) for n in args.files.split(',') if n]
+    document = run_suite(files, args.repeat, args.workdir, args.tree_dir, not args.no_real)
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(document, json.load(f), args.threshold, args.min_delta)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
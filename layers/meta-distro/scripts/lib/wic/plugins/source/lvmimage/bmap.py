@@ -0,0 +1,119 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+bmaptool-compatible block map writer
+
+Describes which blocks of a sparse disk image hold data, with a sha256 per
+mapped range, in the bmap 2.0 XML format read by `bmaptool copy`. Flashing
+with the map writes only the mapped blocks instead of the whole image.
+
+Usage: python3 -m lvmimage.bmap IMAGE [-o IMAGE.bmap]
+"""
+
+import hashlib
+import os
+from typing import Iterator, List, Optional, Tuple
+
+from lvmimage.sparse import iter_data_ranges
+
+BLOCK_SIZE = 4096
+BMAP_VERSION = "2.0"
+READ_CHUNK = 8 * 1024 * 1024
+
+
+def mapped_blocks(fd: int, size: int, block_size: int = BLOCK_SIZE) -> Iterator[Tuple[int, int]]:
+    """Yield merged (first_block, last_block) ranges covering the allocated data"""
+    current = None
+    for offset, length in iter_data_ranges(fd, size):
+        first = offset // block_size
+        last = (offset + length - 1) // block_size
+        if current and first <= current[1] + 1:
+            current = (current[0], max(current[1], last))
+            continue
+        if current:
+            yield current
+        current = (first, last)
+    if current:
+        yield current
+
+
+def _range_checksum(fd: int, first: int, last: int, size: int, block_size: int) -> str:
+    """sha256 over the bytes of an inclusive block range"""
+    digest = hashlib.sha256()
+    pos = first * block_size
+    end = min((last + 1) * block_size, size)
+    while pos < end:
+        data = os.pread(fd, min(READ_CHUNK, end - pos), pos)
+        if not data:
+            raise Exception(f"Short read at offset {pos}")
+        digest.update(data)
+        pos += len(data)
+    return digest.hexdigest()
+
+
+def write_bmap(image_path: str, bmap_path: Optional[str] = None,
+               block_size: int = BLOCK_SIZE) -> Tuple[str, int]:
+    """Write a bmap file for image_path
+
+    Returns:
+        (bmap_path, mapped_bytes)
+    """
+    bmap_path = bmap_path or image_path + '.bmap'
+    fd = os.open(image_path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        ranges: List[Tuple[int, int, str]] = [
+            (first, last, _range_checksum(fd, first, last, size, block_size))
+            for first, last in mapped_blocks(fd, size, block_size)]
+    finally:
+        os.close(fd)
+
+    blocks = -(-size // block_size)
+    mapped = sum(last - first + 1 for first, last, _ in ranges)
+    placeholder = "0" * hashlib.sha256().digest_size * 2
+    lines = [
+        '<?xml version="1.0" ?>',
+        '<!-- Block map of a sparse disk image, generated by the lvmrootfs WIC',
+        f'     plugin. {mapped} of {blocks} blocks are mapped',
+        f'     ({100.0 * mapped / max(blocks, 1):.1f}%). Flash with: bmaptool copy IMAGE DEVICE -->',
+        f'<bmap version="{BMAP_VERSION}">',
+        f'    <ImageSize> {size} </ImageSize>',
+        f'    <BlockSize> {block_size} </BlockSize>',
+        f'    <BlocksCount> {blocks} </BlocksCount>',
+        f'    <MappedBlocksCount> {mapped} </MappedBlocksCount>',
+        '    <ChecksumType> sha256 </ChecksumType>',
+        f'    <BmapFileChecksum> {placeholder} </BmapFileChecksum>',
+        '    <BlockMap>',
+    ]
+    for first, last, checksum in ranges:
+        span = f"{first}-{last}" if last != first else f"{first}"
+        lines.append(f'        <Range chksum="{checksum}"> {span} </Range>')
+    lines += ['    </BlockMap>', '</bmap>', '']
+    text = '\n'.join(lines)
+
+    # bmaptool verifies the file checksum with the checksum field zeroed
+    text = text.replace(placeholder, hashlib.sha256(text.encode()).hexdigest(), 1)
+    with open(bmap_path, 'w') as f:
+        f.write(text)
+    return bmap_path, min(mapped * block_size, size)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a bmaptool block map for a sparse image")
+    parser.add_argument('image')
+    parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    args = parser.parse_args(argv)
+    path, mapped = write_bmap(args.image, args.output, args.block_size)
+    print(f"{path}: {mapped // (1024 * 1024)}MB mapped of {os.path.getsize(args.image) // (1024 * 1024)}MB")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,145 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Concurrent runner for generated create-lvm-*.sh scripts
+
+The generated scripts namespace their kernel-visible resources by
+LVM_BUILD_ID (VG <vg>_b<id>, LUKS mapping <luks>_b<id>, a private mount
+directory, their own loop device), so several of them can assemble images
+on one host at the same time, even when they share a VG name. This runner
+starts each job with a unique LVM_BUILD_ID, keeps at most --jobs of them
+running, writes each job's output to OUTPUT.log and prints a summary.
+
+Jobs come from --job SCRIPT ROOTFS OUTPUT (repeatable) or from a JSON file
+holding a list of {"script": ..., "rootfs": ..., "output": ...} objects,
+optionally with "env" (extra environment, e.g. {"INCREMENTAL": "1"}).
+
+Usage: python3 -m lvmimage.buildqueue [-j N] [--sudo] --job SCRIPT ROOTFS OUTPUT ...
+       python3 -m lvmimage.buildqueue [-j N] [--sudo] --jobs-file jobs.json
+"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+@dataclass
+class Job:
+    """One image build: a generated script with its rootfs and output path"""
+    script: str
+    rootfs: str
+    output: str
+    env: Dict[str, str] = field(default_factory=dict)
+    build_id: str = ''
+    status: Optional[int] = None
+    wall: float = 0.0
+
+    @property
+    def log(self) -> str:
+        return self.output + '.log'
+
+
+def load_jobs(path: str) -> List[Job]:
+    """Jobs from a JSON file"""
+    with open(path) as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise Exception(f"{path}: expected a list of jobs")
+    jobs = []
+    for index, entry in enumerate(entries):
+        missing = [key for key in ('script', 'rootfs', 'output') if key not in entry]
+        if missing:
+            raise Exception(f"{path}: job {index} lacks {', '.join(missing)}")
+        jobs.append(Job(entry['script'], entry['rootfs'], entry['output'],
+                        {str(k): str(v) for k, v in entry.get('env', {}).items()}))
+    return jobs
+
+
+def run_job(job: Job, sudo: bool = False) -> Job:
+    """Run one script to completion, output to job.log"""
+    env = dict(os.environ, **job.env, LVM_BUILD_ID=job.build_id)
+    cmd = ['bash', job.script, job.rootfs, job.output]
+    if sudo:
+        # sudo resets the environment; pass the namespace and job variables
+        cmd = ['sudo', '-n', 'env'] + [f"{k}={v}" for k, v in
+                                       dict(job.env, LVM_BUILD_ID=job.build_id).items()] + cmd
+    start = time.perf_counter()
+    with open(job.log, 'w') as log:
+        job.status = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=log,
+                                    stderr=subprocess.STDOUT, env=env).returncode
+    job.wall = time.perf_counter() - start
+    return job
+
+
+def run_jobs(jobs: List[Job], concurrency: int, sudo: bool = False,
+             progress=None) -> List[Job]:
+    """Run the jobs, at most `concurrency` at a time
+
+    Every job gets a build id unique on this host (runner PID plus job
+    index) unless one was given.
+    """
+    lock = threading.Lock()
+    for index, job in enumerate(jobs):
+        job.build_id = job.build_id or f"{os.getpid()}x{index}"
+
+    def run(job: Job) -> Job:
+        run_job(job, sudo)
+        if progress:
+            with lock:
+                progress(job)
+        return job
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return list(pool.map(run, jobs))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run several lvmrootfs image scripts concurrently")
+    parser.add_argument('--job', nargs=3, action='append', default=[],
+                        metavar=('SCRIPT', 'ROOTFS', 'OUTPUT'))
+    parser.add_argument('--jobs-file', default=None)
+    parser.add_argument('-j', '--concurrency', type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument('--sudo', action='store_true', help="run each script with sudo -n")
+    args = parser.parse_args(argv)
+
+    jobs = [Job(*job) for job in args.job]
+    if args.jobs_file:
+        jobs += load_jobs(args.jobs_file)
+    if not jobs:
+        parser.error("no jobs given")
+    outputs = [os.path.abspath(job.output) for job in jobs]
+    if len(set(outputs)) != len(outputs):
+        parser.error("two jobs write the same output")
+
+    def progress(job: Job):
+        mark = '✓' if job.status == 0 else '✗'
+        print(f"{mark} {job.output} ({job.wall:.1f}s)", flush=True)
+
+    start = time.perf_counter()
+    run_jobs(jobs, args.concurrency, args.sudo, progress)
+    wall = time.perf_counter() - start
+
+    print(f"\n{'output':<40} {'build id':<14} {'status':>6} {'wall':>8}")
+    for job in jobs:
+        print(f"{job.output:<40} {job.build_id:<14} {job.status:>6} {job.wall:>7.1f}s")
+    failed = [job for job in jobs if job.status != 0]
+    print(f"{len(jobs)} jobs, {len(failed)} failed, {wall:.1f}s "
+          f"(sum of job times {sum(job.wall for job in jobs):.1f}s)")
+    for job in failed:
+        print(f"  see {job.log}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,240 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Rootfs content deduplication
+
+Recipes install identical files under different names (license texts,
+firmware and locale copies, bundled libraries, test data), and every copy
+takes its own blocks in the image and is written, compressed, transferred
+and flashed again. dedup() turns identical regular files of one filesystem
+into hardlinks of a single inode, which mkfs.ext4 -d, ostree commit and the
+OCI layer writer all store once.
+
+Each path is walked with the shared lvmimage.scan manifest. Only files whose
+size, mode, owner and mtime match another file's are hashed (sha256, on a
+thread pool), and files are linked only when all of these match as well as
+their content and xattrs, so no path sees different metadata afterwards.
+Inodes with a name outside the deduplicated paths are left alone: they
+could not be freed, and sharing them would tie a mutable path to the
+deduplicated tree. Each replacement is a link() to a temporary name and a
+rename() over the old path, so a path never goes missing, and the mtimes
+of the parent directories are restored.
+
+Hardlinks are shared mutable state: a file written in place on the device
+changes under every name. Deduplicate read-only trees (/usr, /opt on a
+read-only rootfs), never /etc, /var or home directories. ext4 has no
+shared extents outside reflink-capable filesystems, so hardlinks are the
+only sharing a rootfs tree can carry into the image.
+
+Usage: python3 -m lvmimage.dedup ROOTFS [--path /usr ...] [--exclude /usr/share/factory]
+           [--min-size BYTES] [--dry-run] [--report FILE]
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from lvmimage import scan
+
+DEFAULT_PATHS = ('/usr', '/opt')
+# ext4 EXT4_LINK_MAX
+LINK_MAX = 65000
+
+
+@dataclass
+class DedupReport:
+    """What dedup() found and changed"""
+    files: int = 0
+    hashed: int = 0
+    groups: int = 0
+    linked: int = 0
+    inodes_freed: int = 0
+    bytes_saved: int = 0
+    apparent_bytes_saved: int = 0
+    skipped_external_links: int = 0
+    seconds: float = 0.0
+    # Largest savings first: [bytes saved, kept path, number of replaced paths]
+    largest: List[Tuple[int, str, int]] = field(default_factory=list)
+
+
+@dataclass
+class _Inode:
+    paths: List[str]
+    nlink: int
+    blocks: int
+    size: int
+
+
+def _xattr_digest(path: str) -> str:
+    try:
+        names = sorted(os.listxattr(path, follow_symlinks=False))
+    except OSError:
+        return ''
+    digest = hashlib.sha256()
+    for name in names:
+        digest.update(name.encode() + b'\0')
+        digest.update(hashlib.sha256(os.getxattr(path, name, follow_symlinks=False)).digest())
+    return digest.hexdigest()
+
+
+def _within(path: str, prefixes: Iterable[str]) -> bool:
+    return any(path == p or path.startswith(p + '/') for p in prefixes)
+
+
+def _replace(root: str, keep: str, path: str, directories: Dict[str, os.stat_result]):
+    """Atomically make path another name of keep"""
+    target = os.path.join(root, path.lstrip('/'))
+    parent = os.path.dirname(target)
+    if parent not in directories:
+        directories[parent] = os.lstat(parent)
+    tmp = os.path.join(parent, f'.dedup-{os.getpid()}-{os.path.basename(target)}')
+    os.link(os.path.join(root, keep.lstrip('/')), tmp)
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        os.unlink(tmp)
+        raise
+
+
+def dedup(root: str, paths: Iterable[str] = DEFAULT_PATHS, exclude: Iterable[str] = (),
+          min_size: int = 1, dry_run: bool = False, jobs: Optional[int] = None) -> DedupReport:
+    """Hardlink identical files below paths of the tree at root
+
+    Args:
+        paths: '/'-rooted directories to deduplicate, all on the same
+            filesystem of the image (one rootfs LV)
+        exclude: '/'-rooted directories below paths to leave alone
+        min_size: Smaller files are not considered (empty files free no
+            blocks)
+        dry_run: Only report what would be saved
+    """
+    start = time.perf_counter()
+    paths = sorted({os.path.normpath(p) for p in paths})
+    paths = [p for p in paths if not _within(p, [q for q in paths if q != p])]
+    exclude = [os.path.normpath(p) for p in exclude]
+    report = DedupReport()
+
+    # Inodes by metadata that hardlinked names must share; hashing is
+    # limited to the buckets with more than one inode
+    inodes: Dict[Tuple[int, int], _Inode] = {}
+    buckets: Dict[Tuple, List[Tuple[int, int]]] = {}
+    for top in paths:
+        top_dir = os.path.join(root, top.lstrip('/'))
+        if os.path.islink(top_dir) or not os.path.isdir(top_dir):
+            continue
+        for entry in scan.scan(top_dir, cache=False):
+            path = top if entry.path == '/' else top.rstrip('/') + entry.path
+            if entry.kind != 'f' or entry.size < min_size or _within(path, exclude):
+                continue
+            report.files += 1
+            key = (entry.dev, entry.ino)
+            if key in inodes:
+                inodes[key].paths.append(path)
+                continue
+            inodes[key] = _Inode([path], entry.nlink, entry.blocks, entry.size)
+            bucket = (entry.dev, entry.size, entry.mode, entry.uid, entry.gid, entry.mtime_ns)
+            buckets.setdefault(bucket, []).append(key)
+
+    candidates = [key for keys in buckets.values() if len(keys) > 1 for key in keys]
+    report.hashed = len(candidates)
+
+    def identity(key: Tuple[int, int]) -> Tuple[str, str]:
+        path = os.path.join(root, inodes[key].paths[0].lstrip('/'))
+        return scan.file_sha256(path).hex(), _xattr_digest(path)
+
+    with ThreadPoolExecutor(max_workers=jobs or min(32, (os.cpu_count() or 1) * 2)) as pool:
+        identities = dict(zip(candidates, pool.map(identity, candidates)))
+
+    groups: Dict[Tuple, List[Tuple[int, int]]] = {}
+    for bucket, keys in buckets.items():
+        for key in keys:
+            if key in identities:
+                groups.setdefault(bucket + identities[key], []).append(key)
+
+    directories: Dict[str, os.stat_result] = {}
+    try:
+        for keys in groups.values():
+            # An inode with names outside the deduplicated paths is left
+            # alone: it could neither be freed nor safely shared
+            external = [k for k in keys if len(inodes[k].paths) < inodes[k].nlink]
+            report.skipped_external_links += len(external)
+            keys = [k for k in keys if k not in external]
+            if len(keys) < 2:
+                continue
+            report.groups += 1
+            # Keep the inode with the most names; it needs no renames
+            keys.sort(key=lambda k: (-inodes[k].nlink, sorted(inodes[k].paths)[0]))
+            keeper = keys[0]
+            keep_path = sorted(inodes[keeper].paths)[0]
+            links = inodes[keeper].nlink
+            saved, replaced = 0, 0
+            for key in keys[1:]:
+                inode = inodes[key]
+                if links + len(inode.paths) > LINK_MAX:
+                    keeper, keep_path, links = key, sorted(inode.paths)[0], inode.nlink
+                    continue
+                if not dry_run:
+                    for path in inode.paths:
+                        _replace(root, keep_path, path, directories)
+                links += len(inode.paths)
+                replaced += len(inode.paths)
+                report.linked += len(inode.paths)
+                report.inodes_freed += 1
+                saved += inode.blocks * 512
+                report.apparent_bytes_saved += inode.size
+            if replaced:
+                report.bytes_saved += saved
+                report.largest.append((saved, keep_path, replaced))
+    finally:
+        # Linking and renaming changed the mtime of these directories
+        for directory, st in directories.items():
+            os.utime(directory, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=False)
+
+    report.largest = sorted(report.largest, reverse=True)[:20]
+    report.seconds = round(time.perf_counter() - start, 2)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Hardlink identical files of a rootfs tree")
+    parser.add_argument('root')
+    parser.add_argument('--path', action='append', default=[],
+                        help="directory to deduplicate, repeatable (default: /usr and /opt)")
+    parser.add_argument('--exclude', action='append', default=[],
+                        help="directory below --path to leave alone, repeatable")
+    parser.add_argument('--min-size', type=int, default=1, help="ignore smaller files (bytes)")
+    parser.add_argument('--dry-run', action='store_true', help="report without changing the tree")
+    parser.add_argument('--report', default=None, help="write the report as JSON")
+    parser.add_argument('--jobs', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    for path in args.path + args.exclude:
+        if not path.startswith('/'):
+            raise Exception(f"'{path}' is not a '/'-rooted path of the tree")
+    report = dedup(args.root, args.path or DEFAULT_PATHS, args.exclude, args.min_size,
+                   args.dry_run, args.jobs)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(asdict(report), f, indent=2)
+            f.write('\n')
+    for saved, path, count in report.largest[:5]:
+        print(f"  {saved // 1024:>8}K  {path} (+{count})")
+    print(f"{'Would link' if args.dry_run else 'Linked'} {report.linked} of {report.files} files "
+          f"in {report.groups} groups: {report.inodes_freed} inodes and "
+          f"{report.bytes_saved / (1024 * 1024):.1f}MB freed "
+          f"({report.hashed} files hashed, {report.seconds}s)")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,171 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Event-driven block device readiness
+
+Waits for device nodes such as /dev/loop0p1, /dev/mapper/cryptroot or
+/dev/vg0/rootlv to appear after losetup --partscan, cryptsetup open or
+lvcreate. Instead of sleeping a fixed time or polling, the nearest existing
+directory of every pending path is watched with inotify, so the waiter wakes
+up as soon as devtmpfs or udev creates the node (or the directory leading to
+it, e.g. /dev/vg0). Without inotify it falls back to polling with backoff.
+
+The time actually spent waiting for each device is returned and logged, which
+shows the kernel/udev settle latency of a build.
+
+Usage: python3 -m lvmimage.devwait [--timeout SECONDS] DEVICE...
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import stat
+import struct
+import time
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30.0
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_WATCH_MASK = IN_CREATE | IN_MOVED_TO | IN_ATTRIB
+_EVENT = struct.Struct('iIII')
+
+# Upper bound for one poll() so a missed event only costs this much
+MAX_POLL_INTERVAL = 0.25
+
+
+def is_ready(path: str) -> bool:
+    """True once path resolves to a block device node"""
+    try:
+        return stat.S_ISBLK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def _watch_dir(path: str) -> str:
+    """Nearest existing directory on the way to path"""
+    parent = os.path.dirname(os.path.abspath(path))
+    while not os.path.isdir(parent):
+        parent = os.path.dirname(parent)
+    return parent
+
+
+class _Inotify:
+    """Minimal inotify(7) wrapper over libc"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watched = set()
+
+    def watch(self, directory: str):
+        if directory in self.watched:
+            return
+        if self._add_watch(self.fd, directory.encode(), IN_WATCH_MASK) < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch {directory} failed")
+        self.watched.add(directory)
+
+    def wait(self, timeout: float):
+        """Block until an event arrives or timeout passes, then drain the queue"""
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        if poller.poll(max(timeout, 0) * 1000):
+            try:
+                while os.read(self.fd, 64 * (_EVENT.size + 256)):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def wait_for_devices(paths: Iterable[str], timeout: float = DEFAULT_TIMEOUT) -> Dict[str, float]:
+    """Wait until every path is a block device node
+
+    Returns:
+        Seconds from the call until each path was seen ready
+
+    Raises:
+        Exception listing the devices still missing at the deadline
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    pending: List[str] = list(dict.fromkeys(paths))
+    waited: Dict[str, float] = {}
+
+    try:
+        notifier: Optional[_Inotify] = _Inotify()
+    except (OSError, AttributeError) as e:
+        logger.debug(f"inotify unavailable ({e}), polling for devices")
+        notifier = None
+
+    backoff = 0.001
+    try:
+        while True:
+            # Watch first, then check, so a node created in between still
+            # produces an event
+            if notifier:
+                for path in pending:
+                    notifier.watch(_watch_dir(path))
+            now = time.monotonic()
+            for path in [p for p in pending if is_ready(p)]:
+                waited[path] = now - start
+                pending.remove(path)
+            if not pending:
+                return waited
+            if now >= deadline:
+                raise Exception(f"Devices not ready after {timeout:g}s: {', '.join(pending)}")
+            if notifier:
+                notifier.wait(min(deadline - now, MAX_POLL_INTERVAL))
+            else:
+                time.sleep(min(deadline - now, backoff))
+                backoff = min(backoff * 2, MAX_POLL_INTERVAL)
+    finally:
+        if notifier:
+            notifier.close()
+
+
+def wait_and_report(paths: Iterable[str], timeout: float = DEFAULT_TIMEOUT) -> Dict[str, float]:
+    """wait_for_devices() and log the settle latency of every device"""
+    waited = wait_for_devices(paths, timeout)
+    for path, seconds in waited.items():
+        logger.info(f"✓ {path} ready after {seconds * 1000:.1f} ms")
+    return waited
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Wait for block device nodes to appear")
+    parser.add_argument('devices', nargs='+')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    args = parser.parse_args(argv)
+    try:
+        waited = wait_for_devices(args.devices, args.timeout)
+    except Exception as e:
+        print(f"Error: {e}")
+        return 1
+    for path, seconds in waited.items():
+        print(f"  {path} ready after {seconds * 1000:.1f}ms")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,202 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Native GPT writer
+
+Writes the protective MBR, the primary and backup GPT headers and both copies
+of the partition entry array straight into an image file. The lvmrootfs
+layout is fully determined by the partition sizes, so partition byte ranges
+are returned directly instead of being read back from the kernel after a
+loop device partition scan.
+"""
+
+import os
+import struct
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+SECTOR_SIZE = 512
+ALIGNMENT = 1024 * 1024
+ENTRY_COUNT = 128
+ENTRY_SIZE = 128
+HEADER_SIZE = 92
+ENTRY_SECTORS = ENTRY_COUNT * ENTRY_SIZE // SECTOR_SIZE
+GPT_SIGNATURE = b"EFI PART"
+GPT_REVISION = 0x00010000
+
+# Defaults for PARTTYPE_* in conf/distro/include/defaults.inc
+PARTTYPE_ESP = "c12a7328-f81f-11d2-ba4b-00a0c93ec93b"
+PARTTYPE_XBOOTLDR = "bc13c2ff-59e6-4262-a352-b275fd6f7172"
+PARTTYPE_ROOT = "4f68bce3-e8cd-4db1-96e7-fbcaf984b709"
+
+
+@dataclass
+class GptPartition:
+    """A GPT partition entry with inclusive LBA bounds"""
+    name: str
+    type_guid: str
+    first_lba: int
+    last_lba: int
+    part_guid: str = field(default_factory=lambda: str(uuid.uuid4()))
+    attributes: int = 0
+
+    @property
+    def offset(self) -> int:
+        return self.first_lba * SECTOR_SIZE
+
+    @property
+    def size(self) -> int:
+        return (self.last_lba - self.first_lba + 1) * SECTOR_SIZE
+
+
+def last_usable_lba(total_size: int) -> int:
+    """Last LBA available to partitions, before the backup entry array"""
+    return total_size // SECTOR_SIZE - 1 - ENTRY_SECTORS - 1
+
+
+def layout_partitions(total_size: int, specs: Sequence[Tuple[str, str, Optional[int]]],
+                      alignment: int = ALIGNMENT) -> List[GptPartition]:
+    """Place partitions back to back on aligned boundaries
+
+    Args:
+        total_size: Disk image size in bytes
+        specs: (name, type_guid, size_bytes) tuples; a size of None takes
+            everything up to the last usable LBA (only valid for the last one)
+        alignment: Start alignment in bytes
+
+    Returns:
+        GptPartition list in table order
+    """
+    align = alignment // SECTOR_SIZE
+    last_usable = last_usable_lba(total_size)
+    partitions = []
+    next_lba = align
+    for index, (name, type_guid, size) in enumerate(specs):
+        first = -(-next_lba // align) * align
+        if size is None:
+            if index != len(specs) - 1:
+                raise Exception(f"Only the last partition may fill the disk ({name})")
+            last = last_usable
+        else:
+            last = first + size // SECTOR_SIZE - 1
+        if last > last_usable or last < first:
+            raise Exception(f"Partition '{name}' does not fit a {total_size // (1024 * 1024)}MB disk")
+        partitions.append(GptPartition(name, type_guid, first, last))
+        next_lba = last + 1
+    return partitions
+
+
+def _guid_bytes(value: str) -> bytes:
+    """Encode a GUID string in the GPT mixed-endian layout"""
+    return uuid.UUID(value).bytes_le
+
+
+def _protective_mbr(total_sectors: int) -> bytes:
+    """Build LBA 0: a protective MBR with a single 0xEE partition"""
+    size = min(total_sectors - 1, 0xffffffff)
+    entry = struct.pack('<B3sB3sII', 0, b'\x00\x02\x00', 0xee, b'\xff\xff\xff', 1, size)
+    mbr = bytearray(SECTOR_SIZE)
+    mbr[446:462] = entry
+    mbr[510:512] = b'\x55\xaa'
+    return bytes(mbr)
+
+
+def _entry_array(partitions: Sequence[GptPartition]) -> bytes:
+    """Build the 128-entry partition array"""
+    if len(partitions) > ENTRY_COUNT:
+        raise Exception(f"GPT supports at most {ENTRY_COUNT} partitions")
+    array = bytearray(ENTRY_COUNT * ENTRY_SIZE)
+    for index, part in enumerate(partitions):
+        name = part.name.encode('utf-16-le')[:72].ljust(72, b'\0')
+        entry = (_guid_bytes(part.type_guid) + _guid_bytes(part.part_guid) +
+                 struct.pack('<QQQ', part.first_lba, part.last_lba, part.attributes) + name)
+        array[index * ENTRY_SIZE:(index + 1) * ENTRY_SIZE] = entry
+    return bytes(array)
+
+
+def _header(current_lba: int, backup_lba: int, first_usable: int, last_usable: int,
+            disk_guid: str, entries_lba: int, entries_crc: int) -> bytes:
+    """Build a GPT header sector with its CRC32 filled in"""
+    fields = struct.pack('<8sIIIIQQQQ16sQIII',
+                         GPT_SIGNATURE, GPT_REVISION, HEADER_SIZE, 0, 0,
+                         current_lba, backup_lba, first_usable, last_usable,
+                         _guid_bytes(disk_guid), entries_lba, ENTRY_COUNT, ENTRY_SIZE,
+                         entries_crc)
+    crc = zlib.crc32(fields) & 0xffffffff
+    fields = fields[:16] + struct.pack('<I', crc) + fields[20:]
+    return fields.ljust(SECTOR_SIZE, b'\0')
+
+
+def build_gpt(total_size: int, partitions: Sequence[GptPartition],
+              disk_guid: Optional[str] = None) -> Tuple[bytes, bytes]:
+    """Build the on-disk GPT structures
+
+    Returns:
+        (head, tail): head covers LBA 0-33 (protective MBR, primary header,
+        entries) and tail covers the last 33 LBAs (entries, backup header)
+    """
+    if total_size % SECTOR_SIZE:
+        raise Exception(f"Disk size {total_size} is not a multiple of {SECTOR_SIZE}")
+    disk_guid = disk_guid or str(uuid.uuid4())
+    total_sectors = total_size // SECTOR_SIZE
+    last_lba = total_sectors - 1
+    first_usable = 2 + ENTRY_SECTORS
+    last_usable = last_usable_lba(total_size)
+
+    entries = _entry_array(partitions)
+    entries_crc = zlib.crc32(entries) & 0xffffffff
+
+    primary = _header(1, last_lba, first_usable, last_usable, disk_guid, 2, entries_crc)
+    backup = _header(last_lba, 1, first_usable, last_usable, disk_guid,
+                     last_lba - ENTRY_SECTORS, entries_crc)
+
+    head = _protective_mbr(total_sectors) + primary + entries
+    tail = entries + backup
+    return head, tail
+
+
+def write_gpt(image_path: str, total_size: int, partitions: Sequence[GptPartition],
+              disk_guid: Optional[str] = None):
+    """Write a complete GPT (MBR, primary and backup) into an image file"""
+    head, tail = build_gpt(total_size, partitions, disk_guid)
+    fd = os.open(image_path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, head, 0)
+        os.pwrite(fd, tail, total_size - len(tail))
+    finally:
+        os.close(fd)
+
+
+def read_gpt(image_path: str) -> List[GptPartition]:
+    """Read and validate the primary GPT of an image file"""
+    with open(image_path, 'rb') as f:
+        f.seek(SECTOR_SIZE)
+        header = f.read(SECTOR_SIZE)
+        if header[:8] != GPT_SIGNATURE:
+            raise Exception(f"No GPT signature in {image_path}")
+        (_, _, hdr_size, hdr_crc, _, _, _, _, _, _, entries_lba, count, size,
+         entries_crc) = struct.unpack('<8sIIIIQQQQ16sQIII', header[:HEADER_SIZE])
+        check = header[:16] + b'\0\0\0\0' + header[20:hdr_size]
+        if zlib.crc32(check) & 0xffffffff != hdr_crc:
+            raise Exception(f"GPT header CRC mismatch in {image_path}")
+        f.seek(entries_lba * SECTOR_SIZE)
+        entries = f.read(count * size)
+        if zlib.crc32(entries) & 0xffffffff != entries_crc:
+            raise Exception(f"GPT entry array CRC mismatch in {image_path}")
+
+    partitions = []
+    for index in range(count):
+        entry = entries[index * size:(index + 1) * size]
+        if entry[:16] == bytes(16):
+            continue
+        first, last, attrs = struct.unpack('<QQQ', entry[32:56])
+        name = entry[56:128].decode('utf-16-le').rstrip('\0')
+        partitions.append(GptPartition(name, str(uuid.UUID(bytes_le=entry[:16])), first, last,
+                                       str(uuid.UUID(bytes_le=entry[16:32])), attrs))
+    return partitions
@@ -0,0 +1,376 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Incremental image updates
+
+A full offset assembly leaves <image>.manifest.json next to the image: a
+fingerprint of everything that determines the layout (DiskConfig, LV and
+partition sizes, type GUIDs), the extent map (byte ranges of the ESP and of
+every LV) and a content manifest of the rootfs tree (type, mode, owner,
+mtime, xattrs and the sha256 of every file).
+
+On the next build with an unchanged fingerprint, the rootfs tree is
+diffed against the manifest and only the differences are applied to the
+existing rootfs LV filesystem with `debugfs -w` (at its offset in the
+image), followed by an `e2fsck -fn` check. LVs populated from a rootfs
+subtree (lvm-mounts) have a content manifest of their own and are patched
+the same way. The ESP is rebuilt only when
+something under /boot/efi changed. Anything that cannot be patched safely
+(encrypted payload, layout change, hardlinked files, debugfs errors) makes
+update_image() return None so the caller does a full build instead.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from lvmimage import mounts, scan
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_VERSION = 1
+# Bump when the way filesystems are created changes (mkfs options etc.)
+FORMAT_REVISION = 1
+
+_TYPES = {stat.S_IFREG: 'f', stat.S_IFDIR: 'd', stat.S_IFLNK: 'l',
+          stat.S_IFCHR: 'c', stat.S_IFBLK: 'b', stat.S_IFIFO: 'p'}
+
+
+class _Fallback(Exception):
+    """Raised internally when an update must fall back to a full build"""
+
+
+def layout_fingerprint(config, total_size_mb: int, efi_size_mb: int, boot_size_mb: int,
+                       part_types: Optional[Dict[str, str]] = None,
+                       ignore_uuids: Iterable[str] = ()) -> str:
+    """Hash of every input that determines the partition and LV layout
+
+    LVs named in ignore_uuids are hashed without their filesystem UUID, for
+    UUIDs that are generated per build rather than configured.
+    """
+    ignore = set(ignore_uuids)
+    lvs = [config.rootfs_lv] + list(config.additional_lvs)
+    description = {
+        'format': FORMAT_REVISION,
+        'sizes': [total_size_mb, efi_size_mb, boot_size_mb],
+        'part_types': sorted((part_types or {}).items(), key=lambda kv: kv[0]),
+        'vg': config.vg_name,
+        'luks': [config.luks_enabled, config.luks_name],
+        'lvs': [[lv.name, lv.size_str, lv.size_mb, None if lv.name in ignore else lv.uuid]
+                for lv in lvs],
+        'mounts': [[mp.lv_name, mp.mountpoint] for mp in config.mount_points],
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _xattrs(path: str) -> Dict[str, str]:
+    """sha256 of each extended attribute value (empty where unsupported)"""
+    try:
+        names = os.listxattr(path, follow_symlinks=False)
+    except OSError:
+        return {}
+    return {name: hashlib.sha256(os.getxattr(path, name, follow_symlinks=False)).hexdigest()
+            for name in sorted(names)}
+
+
+def scan_tree(root: str, previous: Optional[Dict[str, Dict]] = None,
+              exclude: Iterable[str] = ()) -> Dict[str, Dict]:
+    """Build the content manifest of a tree, keyed by '/'-rooted path
+
+    The walk is the shared lvmimage.scan manifest, validated file by file
+    since a file rewritten in place changes no directory. File hashes are
+    reused from `previous` (or from the scan cache) when inode, size and
+    mtime_ns are unchanged, so an unchanged tree is not read again. The
+    contents of the directories in exclude (mountpoints of other LVs) are
+    left out.
+    """
+    previous = previous or {}
+    if not os.path.isdir(root):
+        return {}
+    manifest = scan.scan(root, verify=True)
+    prefixes = tuple(path + '/' for path in exclude)
+    entries: Dict[str, Dict] = {}
+    for entry in manifest:
+        if entry.kind not in _TYPES.values():
+            continue  # sockets are not copied by mkfs.ext4 -d either
+        if prefixes and entry.path.startswith(prefixes):
+            continue
+        path = root if entry.path == '/' else os.path.join(root, entry.path[1:])
+        item = {'t': entry.kind, 'mode': entry.mode, 'uid': entry.uid, 'gid': entry.gid,
+                'mtime': int(entry.mtime_ns / 1e9),
+                'xattr': _xattrs(path) if entry.xattr_size else {}}
+        if entry.kind == 'f':
+            item.update(size=entry.size, ino=entry.ino, mtime_ns=entry.mtime_ns,
+                        nlink=entry.nlink)
+            old = previous.get(entry.path)
+            if old and all(old.get(k) == item[k] for k in ('t', 'size', 'ino', 'mtime_ns')):
+                item['sha'] = old['sha']
+            else:
+                item['sha'] = entry.sha256 or scan.file_sha256(path).hex()
+        elif entry.kind == 'l':
+            item['target'] = os.readlink(path)
+        elif entry.kind in ('c', 'b'):
+            item['rdev'] = [os.major(entry.rdev), os.minor(entry.rdev)]
+        entries[entry.path] = item
+    return entries
+
+
+_CONTENT_KEYS = ('t', 'sha', 'target', 'rdev')
+_META_KEYS = ('mode', 'uid', 'gid', 'mtime', 'xattr')
+
+
+@dataclass
+class TreeChanges:
+    """Differences between two content manifests"""
+    removed: List[str] = field(default_factory=list)
+    created: List[str] = field(default_factory=list)
+    metadata: List[str] = field(default_factory=list)
+
+    @property
+    def empty(self) -> bool:
+        return not (self.removed or self.created or self.metadata)
+
+    def touched(self) -> Set[str]:
+        return set(self.removed) | set(self.created) | set(self.metadata)
+
+
+def diff_trees(old: Dict[str, Dict], new: Dict[str, Dict]) -> TreeChanges:
+    """Compare manifests: removed paths deepest first, created ones parents first
+
+    A path whose type or content changed is both removed and created.
+    """
+    changes = TreeChanges()
+    for path in set(old) | set(new):
+        before, after = old.get(path), new.get(path)
+        if after is None:
+            changes.removed.append(path)
+        elif before is None:
+            changes.created.append(path)
+        elif any(before.get(k) != after.get(k) for k in _CONTENT_KEYS):
+            changes.removed.append(path)
+            changes.created.append(path)
+        elif any(before.get(k) != after.get(k) for k in _META_KEYS):
+            changes.metadata.append(path)
+    depth = lambda p: (p.count('/'), p)
+    changes.removed.sort(key=depth, reverse=True)
+    changes.created.sort(key=depth)
+    changes.metadata.sort(key=depth)
+    return changes
+
+
+def _quote(path: str) -> str:
+    if any(c in path for c in '"\\\n'):
+        raise _Fallback(f"path not expressible in a debugfs script: {path!r}")
+    return f'"{path}"'
+
+
+def _debugfs_commands(changes: TreeChanges, old: Dict[str, Dict], new: Dict[str, Dict],
+                      root: str, tmpdir: str) -> List[str]:
+    """Translate tree changes into a debugfs -w command script"""
+    commands = []
+    for path in changes.removed:
+        if old[path]['t'] == 'f' and old[path].get('nlink', 1) > 1:
+            raise _Fallback(f"hardlinked file removed or changed: {path}")
+        commands.append(f"{'rmdir' if old[path]['t'] == 'd' else 'rm'} {_quote(path)}")
+
+    for path in changes.created:
+        entry = new[path]
+        source = os.path.join(root, path.lstrip('/'))
+        kind = entry['t']
+        if kind == 'd':
+            commands.append(f"mkdir {_quote(path)}")
+        elif kind == 'f':
+            if entry.get('nlink', 1) > 1:
+                raise _Fallback(f"hardlinked file added or changed: {path}")
+            commands.append(f"write {_quote(source)} {_quote(path)}")
+        elif kind == 'l':
+            commands.append(f"symlink {_quote(path)} {_quote(entry['target'])}")
+        elif kind in ('c', 'b'):
+            commands.append(f"mknod {_quote(path)} {kind} {entry['rdev'][0]} {entry['rdev'][1]}")
+        elif kind == 'p':
+            commands.append(f"mknod {_quote(path)} p")
+
+    # Attributes last, deepest first, so directory mtimes are not disturbed
+    # by later changes to their entries; parents of touched paths are reset
+    # too since debugfs updates their mtime
+    attrs = set(changes.created) | set(changes.metadata)
+    attrs |= {os.path.dirname(p) for p in changes.touched() if p != '/'}
+    for path in sorted((p for p in attrs if p in new), key=lambda p: (p.count('/'), p), reverse=True):
+        entry = new[path]
+        before = old.get(path, {})
+        quoted = _quote(path)
+        commands += [f"sif {quoted} mode 0{entry['mode']:o}",
+                     f"sif {quoted} uid {entry['uid']}",
+                     f"sif {quoted} gid {entry['gid']}",
+                     f"sif {quoted} mtime @{entry['mtime']}"]
+        if entry['xattr'] != before.get('xattr', {}) or (path in changes.created and entry['xattr']):
+            source = os.path.join(root, path.lstrip('/'))
+            for name in before.get('xattr', {}):
+                if path not in changes.created and name not in entry['xattr']:
+                    commands.append(f"ea_rm {quoted} {name}")
+            for index, name in enumerate(entry['xattr']):
+                value_file = os.path.join(tmpdir, f"xattr-{len(commands)}-{index}")
+                with open(value_file, 'wb') as f:
+                    f.write(os.getxattr(source, name, follow_symlinks=False))
+                commands.append(f"ea_set -f {_quote(value_file)} {quoted} {name}")
+    return commands
+
+
+def manifest_path(image_path: str) -> str:
+    return image_path + MANIFEST_SUFFIX
+
+
+def load_manifest(image_path: str) -> Optional[Dict]:
+    try:
+        with open(manifest_path(image_path)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+
+def adopt_previous_uuids(image_path: str, lvs, names: Set[str]):
+    """Reuse the previous build's filesystem UUIDs for LVs that had none set
+
+    Unset UUIDs are randomly generated per run, which would otherwise change
+    the layout fingerprint every time.
+    """
+    manifest = load_manifest(image_path)
+    previous = (manifest or {}).get('lv_uuids', {})
+    for lv in lvs:
+        if lv.name in names and lv.name in previous:
+            lv.uuid = previous[lv.name]
+
+
+def discard_manifest(image_path: str):
+    """Forget the manifest before an image is rebuilt without recording one"""
+    if os.path.exists(manifest_path(image_path)):
+        os.unlink(manifest_path(image_path))
+
+
+def write_manifest(image_path: str, fingerprint: str, result: Dict, config, rootfs_dir: str,
+                   entries: Optional[Dict[str, Dict]] = None):
+    """Record the layout, extent map and rootfs content of a finished image
+
+    entries, when given, is the rootfs LV content manifest.
+    """
+    layout = result['layout']
+    lvs = [config.rootfs_lv] + list(config.additional_lvs)
+    rootfs_tree, *mounted = mounts.source_trees(rootfs_dir, config.rootfs_lv.name,
+                                                config.mount_points)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'fingerprint': fingerprint,
+        'image_size': os.path.getsize(image_path),
+        'extents': {
+            'efi': [layout.efi.offset, layout.efi.size],
+            'xbootldr': [layout.boot.offset, layout.boot.size],
+            'lvs': {name: [r.offset, r.size] for name, r in result['lv_ranges'].items()},
+        },
+        'rootfs_lv': config.rootfs_lv.name,
+        'lv_uuids': {lv.name: lv.uuid for lv in lvs},
+        'entries': entries if entries is not None else scan_tree(rootfs_dir,
+                                                                 exclude=rootfs_tree.excluded),
+        'lv_entries': {tree.lv_name: scan_tree(tree.path, exclude=tree.excluded)
+                       for tree in mounted},
+    }
+    _store_manifest(image_path, manifest)
+
+
+def _store_manifest(image_path: str, manifest: Dict):
+    tmp = manifest_path(image_path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(tmp, manifest_path(image_path))
+
+
+def _run_debugfs(run_cmd: Callable, device: str, commands: List[str], tmpdir: str):
+    """Run a debugfs -w script; debugfs exits 0 on errors, so check its output"""
+    script = os.path.join(tmpdir, 'update.debugfs')
+    with open(script, 'w') as f:
+        f.write('\n'.join(commands) + '\n')
+    output = run_cmd(['sh', '-c', 'exec debugfs -w -f "$1" "$2" 2>&1', 'debugfs', script, device],
+                     capture=True) or ''
+    errors = [line for line in output.splitlines()
+              if line.strip() and not line.startswith(('debugfs', 'Allocated inode'))]
+    if errors:
+        raise _Fallback(f"debugfs reported: {errors[0]}")
+
+
+def update_image(config, image_path: str, rootfs_dir: str, fingerprint: str, workdir: str,
+                 run_cmd: Callable, rebuild_efi: Callable) -> Optional[Dict]:
+    """Patch the previous image in place, or return None for a full build
+
+    Args:
+        rebuild_efi: Called with the ESP offset and size when something
+            under /boot/efi changed
+
+    Returns:
+        Dict with the change counts, or None when a full build is required
+    """
+    manifest = load_manifest(image_path)
+    try:
+        if not manifest or not os.path.exists(image_path):
+            raise _Fallback("no previous image or manifest")
+        if manifest['fingerprint'] != fingerprint:
+            raise _Fallback("disk layout changed")
+        if os.path.getsize(image_path) != manifest['image_size']:
+            raise _Fallback("image size does not match the manifest")
+        if config.luks_enabled:
+            raise _Fallback("the encrypted payload cannot be patched without the volume key")
+
+        rootfs_tree, *mounted = mounts.source_trees(rootfs_dir, config.rootfs_lv.name,
+                                                    config.mount_points)
+        lv_entries = manifest.get('lv_entries', {})
+        targets = [(rootfs_tree, manifest['entries'])]
+        targets += [(tree, lv_entries.get(tree.lv_name, {})) for tree in mounted]
+        counts = {'removed': 0, 'created': 0, 'metadata': 0}
+        touched: Set[str] = set()
+        for tree, old in targets:
+            new = scan_tree(tree.path, old, exclude=tree.excluded)
+            changes = diff_trees(old, new)
+            if tree is rootfs_tree:
+                touched = changes.touched()
+                manifest['entries'] = new
+            else:
+                lv_entries[tree.lv_name] = new
+            if changes.empty:
+                continue
+            offset, _ = manifest['extents']['lvs'][tree.lv_name]
+            device = f"{image_path}?offset={offset}"
+            # A crash half way through must not leave a manifest that claims
+            # the image matches it
+            discard_manifest(image_path)
+            os.makedirs(workdir, exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=workdir) as tmpdir:
+                commands = _debugfs_commands(changes, old, new, tree.path, tmpdir)
+                _run_debugfs(run_cmd, device, commands, tmpdir)
+            try:
+                run_cmd(['e2fsck', '-fn', device], capture=True)
+            except Exception:
+                raise _Fallback(f"e2fsck found problems in {tree.lv_name} after the update")
+            counts['removed'] += len(changes.removed)
+            counts['created'] += len(changes.created)
+            counts['metadata'] += len(changes.metadata)
+
+        efi_changed = any(p == '/boot/efi' or p.startswith('/boot/efi/') for p in touched)
+        if efi_changed:
+            rebuild_efi(*manifest['extents']['efi'])
+
+        manifest['lv_entries'] = lv_entries
+        _store_manifest(image_path, manifest)
+    except _Fallback as e:
+        logger.info(f"Incremental update not possible ({e}), doing a full build")
+        return None
+
+    return dict(counts, efi_rebuilt=efi_changed)
@@ -0,0 +1,462 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Crash-safe assembly journal
+
+Building an image takes minutes, and a failure late in the run (rsync on a
+full disk, a LUKS open racing udev) should not cost all of them. The
+assembly records its progress in <image>.journal, a JSON-lines file next
+to the partial image, appended to and fsynced one record at a time:
+
+  {"t": "header", "version": 1, "key": LAYOUT, "info": {...}}
+  {"t": "owner", "pid": PID, "start": TICKS, "boot_id": ID, "vg": ..., "luks": ..., "loop": ...}
+  {"t": "begin", "step": NAME}
+  {"t": "done", "step": NAME, "input": SIGNATURE, "image": {"dev", "ino", "size"}, "info": {...}}
+
+A step is recorded as done only after the image file has been fsynced, so
+every done record describes data that is on disk, even after a power loss.
+A torn last line (a crash while appending) is ignored.
+
+On the next run resume() validates the journal: same layout key, the partial
+image is still the same file (device and inode) with the size of the last
+checkpoint, no step listed as a barrier was left half done, and the run
+that wrote it is gone. It returns the steps whose recorded input signature
+(tree_signature() of the source they were built from) still matches; the
+caller redoes everything else. A journal that does not validate is replaced
+and the image is built from scratch.
+
+reclaim() releases what a run that died without its cleanup (SIGKILL, the
+OOM killer, a lost terminal) still holds, in the reverse order it was set
+up: mounts below its mount directory, its VG, its dm-crypt mapping, then
+the loop device lease. Reaping loop leases alone cannot do this, since a
+loop device with a mapping on top of it stays busy. Only the resources the
+owner recorded are touched, and only when that process (PID and start
+time) no longer exists and the host has not rebooted since.
+
+Usage: python3 -m lvmimage.journal resume JOURNAL --key KEY --image IMAGE [--owner-pid PID]
+           [--input STEP=SIGNATURE ...] [--barrier STEP ...]
+       python3 -m lvmimage.journal {owner|begin|done|get|finish|reclaim|signature|show} ...
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from lvmimage import looplease, scan
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = '.journal'
+VERSION = 1
+BOOT_ID = '/proc/sys/kernel/random/boot_id'
+
+
+def journal_path(image_path: str) -> str:
+    return image_path + JOURNAL_SUFFIX
+
+
+def boot_id() -> str:
+    try:
+        with open(BOOT_ID) as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+
+def tree_signature(root: str) -> str:
+    """Digest of the names and lstat of every entry below root
+
+    Uses the lvmimage.scan manifest (from its cache when the tree did not
+    change) with every file's lstat verified, so files rewritten in place
+    change the signature too. '' when root does not exist.
+    """
+    if not os.path.isdir(root):
+        return ''
+    manifest = scan.scan(root, verify=True)
+    digest = hashlib.sha256(bytes(manifest.names))
+    for name in ('parent', 'kind', 'mode', 'uid', 'gid', 'size', 'mtime_ns', 'ino', 'rdev',
+                 'xattr_size'):
+        digest.update(manifest.columns[name].tobytes())
+    return digest.hexdigest()
+
+
+def _identity(image_path: str) -> Dict[str, int]:
+    st = os.stat(image_path)
+    return {'dev': st.st_dev, 'ino': st.st_ino, 'size': st.st_size}
+
+
+def _fsync(path: str):
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def owner_alive(owner: Dict) -> bool:
+    """True while the process that wrote the owner record is still running"""
+    if not owner or owner.get('boot_id') != boot_id():
+        return False
+    return looplease.process_start(owner['pid']) == owner.get('start')
+
+
+class Journal:
+    """The records of one <image>.journal"""
+
+    def __init__(self, path: str, records: Optional[List[Dict]] = None):
+        self.path = path
+        self.records = records or []
+        # Why resume() did not continue the previous journal
+        self.discarded = ''
+
+    @classmethod
+    def load(cls, path: str) -> 'Journal':
+        """Read a journal; missing files and a torn last line are tolerated"""
+        records = []
+        try:
+            with open(path) as f:
+                lines = f.read().split('\n')
+        except OSError:
+            return cls(path)
+        for number, line in enumerate(lines):
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                if number < len(lines) - 2:
+                    raise Exception(f"{path}: corrupt record on line {number + 1}")
+                logger.debug(f"{path}: ignoring a torn last record")
+        return cls(path, records)
+
+    @classmethod
+    def create(cls, path: str, key: str, info: Optional[Dict] = None) -> 'Journal':
+        """Start a new journal, replacing any previous one atomically"""
+        header = {'t': 'header', 'version': VERSION, 'key': key, 'info': info or {},
+                  'created': time.time()}
+        partial = f"{path}.{os.getpid()}"
+        with open(partial, 'w') as f:
+            f.write(json.dumps(header, sort_keys=True) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(partial, path)
+        _fsync(os.path.dirname(os.path.abspath(path)))
+        return cls(path, [header])
+
+    @property
+    def header(self) -> Optional[Dict]:
+        if self.records and self.records[0].get('t') == 'header':
+            return self.records[0]
+        return None
+
+    def append(self, record: Dict):
+        """Append one record durably; concurrent writers are serialized by flock"""
+        record = dict(record, time=time.time())
+        with open(self.path, 'r+b') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            # Cut off a record torn by a crash, so it cannot swallow this one
+            data = f.read()
+            f.seek(data.rfind(b'\n') + 1)
+            f.truncate()
+            f.write(json.dumps(record, sort_keys=True).encode() + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.records.append(record)
+
+    def owner(self) -> Dict:
+        """Resources of the latest owner, merged over its owner records"""
+        owner: Dict = {}
+        for record in self.records:
+            if record['t'] == 'reclaimed':
+                owner = {}
+            elif record['t'] == 'owner':
+                if (record['pid'], record.get('start')) != (owner.get('pid'), owner.get('start')):
+                    owner = {}
+                owner.update({k: v for k, v in record.items() if k not in ('t', 'time')})
+        return owner
+
+    def set_owner(self, pid: Optional[int] = None, **resources):
+        """Record the running process and the kernel resources it holds
+
+        resources are any of mnt_dir, vg, luks and loop (device names), and
+        build_id.
+        """
+        pid = pid or os.getpid()
+        start = looplease.process_start(pid)
+        if start is None:
+            raise Exception(f"Journal owner process {pid} does not exist")
+        self.append(dict(resources, t='owner', pid=pid, start=start, boot_id=boot_id()))
+
+    def completed(self) -> Dict[str, Dict]:
+        """Done records by step name, of steps not begun again since"""
+        done: Dict[str, Dict] = {}
+        for record in self.records:
+            if record['t'] == 'done':
+                done[record['step']] = record
+            elif record['t'] == 'begin':
+                done.pop(record['step'], None)
+        return done
+
+    def unfinished(self) -> Set[str]:
+        """Steps whose last record is a begin"""
+        last = {r['step']: r['t'] for r in self.records if r['t'] in ('begin', 'done')}
+        return {step for step, kind in last.items() if kind == 'begin'}
+
+    def begin(self, step: str):
+        self.append({'t': 'begin', 'step': step})
+
+    def done(self, step: str, image_path: Optional[str] = None, input: str = '',
+             info: Optional[Dict] = None):
+        """Record a finished step, after flushing the image it wrote"""
+        record = {'t': 'done', 'step': step, 'input': input, 'info': info or {}}
+        if image_path:
+            _fsync(image_path)
+            record['image'] = _identity(image_path)
+        self.append(record)
+
+    def get(self, step: str, key: str, default=None):
+        """A value from the info of a done step"""
+        record = self.completed().get(step)
+        return (record or {}).get('info', {}).get(key, default)
+
+    def validate(self, key: str, image_path: str, inputs: Optional[Dict[str, str]] = None,
+                 barriers: Iterable[str] = ()) -> Tuple[Optional[Set[str]], str]:
+        """Steps of this journal a new run can skip
+
+        Returns:
+            (steps, '') or (None, why the journal cannot be used)
+        """
+        header = self.header
+        if header is None:
+            return None, "no journal"
+        if header.get('version') != VERSION or header.get('key') != key:
+            return None, "the layout changed"
+        completed = self.completed()
+        checkpoints = [r for r in self.records if r['t'] == 'done' and 'image' in r]
+        if 'image' not in completed or not checkpoints:
+            return None, "the image was never created"
+        try:
+            if _identity(image_path) != checkpoints[-1]['image']:
+                return None, f"{image_path} was replaced or resized since the last checkpoint"
+        except FileNotFoundError:
+            return None, f"{image_path} does not exist"
+        broken = sorted(self.unfinished() & set(barriers))
+        if broken:
+            return None, f"step {', '.join(broken)} was interrupted"
+        inputs = inputs or {}
+        return {step for step, record in completed.items()
+                if record.get('input', '') == inputs.get(step, '')}, ''
+
+    def finish(self):
+        """Remove the journal of a finished image"""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.records = []
+
+
+def resume(path: str, key: str, image_path: str, inputs: Optional[Dict[str, str]] = None,
+           barriers: Iterable[str] = (), info: Optional[Dict] = None, enabled: bool = True,
+           owner_pid: Optional[int] = None, **resources) -> Tuple[Journal, Set[str]]:
+    """Open the journal of image_path for a new run
+
+    The previous journal is validated (see Journal.validate) and continued,
+    or replaced by a new one with key and info in its header. The new run
+    is recorded as the owner.
+
+    Returns:
+        (journal, steps that need not run again)
+    """
+    journal = Journal.load(path)
+    previous = journal.owner()
+    if owner_alive(previous) and previous['pid'] != (owner_pid or os.getpid()):
+        raise Exception(f"{image_path} is being assembled by process {previous['pid']}")
+    steps, reason = journal.validate(key, image_path, inputs, barriers) if enabled else (None, "")
+    if steps:
+        # Steps built from a source that changed are redone, and their
+        # old done records must not count if that is interrupted
+        for step in sorted(set(journal.completed()) - steps):
+            journal.begin(step)
+        logger.info(f"Resuming {image_path} from its journal: {', '.join(sorted(steps))} done")
+    else:
+        if journal.header is not None and reason:
+            logger.info(f"Not resuming from {path}: {reason}")
+        else:
+            reason = ''
+        journal = Journal.create(path, key, info)
+        journal.discarded = reason
+        steps = set()
+    journal.set_owner(owner_pid, **resources)
+    return journal, steps
+
+
+def adopt_uuids(image_path: str, lvs, names: Set[str]):
+    """Reuse the generated filesystem UUIDs of an interrupted build
+
+    LVs named in names have no configured UUID; a resumed build must keep
+    the ones its finished steps were formatted with, and they are part of
+    the layout key.
+    """
+    header = Journal.load(journal_path(image_path)).header or {}
+    previous = header.get('info', {}).get('lv_uuids', {})
+    for lv in lvs:
+        if lv.name in names and lv.name in previous:
+            lv.uuid = previous[lv.name]
+
+
+def _mounts_below(directory: str) -> List[str]:
+    directory = directory.rstrip('/')
+    found = []
+    with open('/proc/self/mounts') as f:
+        for line in f:
+            # Spaces and tabs in mountpoints are octal escaped
+            mountpoint = line.split()[1].encode().decode('unicode_escape')
+            if mountpoint == directory or mountpoint.startswith(directory + '/'):
+                found.append(mountpoint)
+    return found
+
+
+def _release(cmd: List[str], what: str, released: List[str]):
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if result.returncode == 0:
+        released.append(what)
+    else:
+        logger.warning(f"Could not release {what}: {result.stderr.strip()}")
+
+
+def reclaim(path: str) -> List[str]:
+    """Release the resources a dead owner of the journal at path left behind
+
+    Returns:
+        The released resources (mountpoints, 'vg:NAME', 'luks:NAME', loop
+        devices)
+    """
+    journal = Journal.load(path)
+    owner = journal.owner()
+    if not owner or owner_alive(owner):
+        return []
+    released: List[str] = []
+    if owner.get('boot_id') == boot_id():
+        mnt_dir = owner.get('mnt_dir')
+        if mnt_dir:
+            for mountpoint in sorted(_mounts_below(mnt_dir), reverse=True):
+                _release(['umount', mountpoint], mountpoint, released)
+            for directory, _, _ in sorted(os.walk(mnt_dir), reverse=True):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+        vg = owner.get('vg')
+        if vg and os.path.isdir(f'/dev/{vg}'):
+            _release(['lvm', 'vgchange', '--nolocking', '-an', vg], f'vg:{vg}', released)
+        luks = owner.get('luks')
+        if luks and os.path.exists(f'/dev/mapper/{luks}'):
+            _release(['cryptsetup', 'close', luks], f'luks:{luks}', released)
+        # The lease of the owner's loop device is now reapable, the mappings
+        # that kept it busy are gone
+        released += looplease.reap()
+    if released:
+        logger.info(f"Reclaimed from dead process {owner['pid']}: {', '.join(released)}")
+    journal.append({'t': 'reclaimed', 'pid': owner['pid'], 'released': released})
+    return released
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Assembly journal of a partial disk image")
+    sub = parser.add_subparsers(dest='command', required=True)
+    res = sub.add_parser('resume', help="validate or start the journal, print the done steps")
+    res.add_argument('journal')
+    res.add_argument('--key', required=True, help="layout fingerprint of this build")
+    res.add_argument('--image', required=True, help="the partial image")
+    res.add_argument('--input', action='append', default=[], metavar='STEP=SIGNATURE')
+    res.add_argument('--barrier', action='append', default=[],
+                     help="step whose interruption invalidates the whole journal")
+    res.add_argument('--owner-pid', type=int, default=None,
+                     help="process that owns the run (default: the parent)")
+    res.add_argument('--build-id', default='')
+    res.add_argument('--fresh', action='store_true', help="start a new journal")
+    own = sub.add_parser('owner', help="record the kernel resources of the run")
+    own.add_argument('journal')
+    own.add_argument('resources', nargs='+', metavar='KEY=VALUE')
+    own.add_argument('--owner-pid', type=int, default=None)
+    beg = sub.add_parser('begin')
+    beg.add_argument('journal')
+    beg.add_argument('step')
+    don = sub.add_parser('done', help="record finished steps after an fsync of the image")
+    don.add_argument('journal')
+    don.add_argument('steps', nargs='+')
+    don.add_argument('--image', default=None)
+    don.add_argument('--input', default='', help="signature of the step's source")
+    don.add_argument('--info', action='append', default=[], metavar='KEY=VALUE')
+    get = sub.add_parser('get', help="print a value recorded by a done step")
+    get.add_argument('journal')
+    get.add_argument('step')
+    get.add_argument('key')
+    fin = sub.add_parser('finish', help="remove the journal of a finished image")
+    fin.add_argument('journal')
+    rec = sub.add_parser('reclaim', help="release what a dead owner left behind")
+    rec.add_argument('journal')
+    sig = sub.add_parser('signature', help="print the tree_signature of a directory")
+    sig.add_argument('directory')
+    show = sub.add_parser('show')
+    show.add_argument('journal')
+    args = parser.parse_args(argv)
+
+    def pairs(values: List[str]) -> Dict[str, str]:
+        return dict(value.split('=', 1) for value in values)
+
+    if args.command == 'resume':
+        journal, steps = resume(args.journal, args.key, args.image, pairs(args.input),
+                                args.barrier, enabled=not args.fresh,
+                                owner_pid=args.owner_pid or os.getppid(), build_id=args.build_id)
+        if journal.discarded:
+            print(f"Not resuming: {journal.discarded}", file=sys.stderr)
+        for step in sorted(steps):
+            print(step)
+    elif args.command == 'owner':
+        Journal.load(args.journal).set_owner(args.owner_pid or os.getppid(), **pairs(args.resources))
+    elif args.command == 'begin':
+        Journal.load(args.journal).begin(args.step)
+    elif args.command == 'done':
+        journal = Journal.load(args.journal)
+        for step in args.steps:
+            journal.done(step, args.image, args.input, pairs(args.info))
+    elif args.command == 'get':
+        value = Journal.load(args.journal).get(args.step, args.key)
+        if value is None:
+            return 1
+        print(value)
+    elif args.command == 'finish':
+        Journal.load(args.journal).finish()
+    elif args.command == 'reclaim':
+        for resource in reclaim(args.journal):
+            print(f"Released {resource}")
+    elif args.command == 'signature':
+        print(tree_signature(args.directory))
+    else:
+        journal = Journal.load(args.journal)
+        owner = journal.owner()
+        print(f"key {(journal.header or {}).get('key', '-')}")
+        if owner:
+            resources = [f"{k}={owner[k]}" for k in ('vg', 'luks', 'loop', 'mnt_dir') if owner.get(k)]
+            print(' '.join([f"owner {owner['pid']}{'' if owner_alive(owner) else ' (gone)'}"] + resources))
+        for step, record in sorted(journal.completed().items(), key=lambda kv: kv[1]['time']):
+            print(f"done {step}")
+        for step in sorted(journal.unfinished()):
+            print(f"interrupted {step}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
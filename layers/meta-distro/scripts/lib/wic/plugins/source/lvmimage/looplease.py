@@ -0,0 +1,362 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Loop device leases
+
+Attaches image files to loop devices through the kernel interfaces instead
+of `losetup --find` and `losetup -a` text: a free device is requested with
+LOOP_CTL_GET_FREE on /dev/loop-control and bound with a single
+LOOP_CONFIGURE (backing fd, block size, partscan and direct-I/O flags in one
+call, falling back to LOOP_SET_FD + LOOP_SET_STATUS64 on kernels before
+5.8). If another process binds the device first the ioctl fails with EBUSY
+and the next free device is requested, so parallel builds never share one.
+
+Direct I/O (on by default when the backing filesystem supports it) makes
+the loop driver bypass the page cache of the image file, so written blocks
+are not cached twice (once for the loop device, once for the file). The
+logical block size is set explicitly to the 512-byte sectors of the GPT.
+
+Every attachment is recorded as a lease in a per-user state file, guarded
+by flock, with the owning process (PID and start time, so a reused PID does
+not count as alive) and the device/inode of the backing file. `reap` only
+detaches devices whose lease owner is gone and which are still bound to the
+leased file; loops of other users and other tools are never touched.
+Backing files are read from /sys/block/loopN/loop/backing_file.
+
+Usage: python3 -m lvmimage.looplease attach [--owner-pid PID] [--direct-io auto|on|off] IMAGE
+       python3 -m lvmimage.looplease detach DEVICE
+       python3 -m lvmimage.looplease reap
+       python3 -m lvmimage.looplease list
+"""
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LOOP_CONTROL = '/dev/loop-control'
+LOOP_SET_FD = 0x4C00
+LOOP_CLR_FD = 0x4C01
+LOOP_SET_STATUS64 = 0x4C04
+LOOP_GET_STATUS64 = 0x4C05
+LOOP_SET_DIRECT_IO = 0x4C08
+LOOP_SET_BLOCK_SIZE = 0x4C09
+LOOP_CONFIGURE = 0x4C0A
+LOOP_CTL_GET_FREE = 0x4C82
+LO_FLAGS_PARTSCAN = 8
+LO_FLAGS_DIRECT_IO = 16
+
+# struct loop_info64 and struct loop_config of <linux/loop.h>
+_LOOP_INFO64 = struct.Struct('=5Q4I64s64s32s2Q')
+_LOOP_CONFIG = struct.Struct(f'=II{_LOOP_INFO64.size}s64x')
+
+DEFAULT_BLOCK_SIZE = 512
+STATE_NAME = 'lvmrootfs-loop-leases'
+GET_FREE_ATTEMPTS = 16
+
+
+@dataclass
+class LoopLease:
+    """One loop device attached on behalf of a build"""
+    device: str
+    backing_file: str
+    backing_dev: int
+    backing_inode: int
+    owner_pid: int
+    owner_start: int
+    build_id: str = ''
+    direct_io: bool = False
+    block_size: int = DEFAULT_BLOCK_SIZE
+    created: float = 0.0
+
+
+def state_dir() -> str:
+    """Directory of the lease state (LVMROOTFS_LEASE_DIR overrides it)"""
+    override = os.environ.get('LVMROOTFS_LEASE_DIR')
+    if override:
+        return override
+    return '/run/lock' if os.access('/run/lock', os.W_OK) else tempfile.gettempdir()
+
+
+def _state_paths() -> Tuple[str, str]:
+    base = os.path.join(state_dir(), f"{STATE_NAME}-{os.geteuid()}")
+    return base + '.json', base + '.lock'
+
+
+def process_start(pid: int) -> Optional[int]:
+    """Start time of a process in clock ticks, None if it does not exist"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Fields after the command name, which may itself contain spaces
+    return int(stat[stat.rfind(')') + 2:].split()[19])
+
+
+def _alive(lease: LoopLease) -> bool:
+    return process_start(lease.owner_pid) == lease.owner_start
+
+
+@contextmanager
+def _locked_leases() -> Iterator[Dict[str, LoopLease]]:
+    """The lease table, read and written back under an exclusive flock"""
+    path, lock_path = _state_paths()
+    lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            with open(path) as f:
+                leases = {d: LoopLease(**entry) for d, entry in json.load(f).items()}
+        except (OSError, ValueError, TypeError):
+            leases = {}
+        yield leases
+        partial = f"{path}.{os.getpid()}"
+        fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({d: asdict(lease) for d, lease in leases.items()}, f, indent=2, sort_keys=True)
+        os.rename(partial, path)
+    finally:
+        os.close(lock_fd)
+
+
+def _sysfs(device: str, attribute: str) -> Optional[str]:
+    try:
+        with open(f'/sys/block/{os.path.basename(device)}/loop/{attribute}') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def backing_file(device: str) -> Optional[str]:
+    """Backing file of a bound loop device from sysfs, None when unbound"""
+    return _sysfs(device, 'backing_file')
+
+
+def attached_loops() -> Dict[str, str]:
+    """All bound loop devices and their backing files, from sysfs"""
+    loops = {}
+    try:
+        names = os.listdir('/sys/block')
+    except OSError:
+        return loops
+    for name in sorted(names):
+        if name.startswith('loop'):
+            path = backing_file(name)
+            if path:
+                loops[f'/dev/{name}'] = path
+    return loops
+
+
+def _bound_inode(device: str) -> Optional[Tuple[int, int]]:
+    """(device, inode) of the file bound to a loop device, None when unbound"""
+    buf = bytearray(_LOOP_INFO64.size)
+    try:
+        fd = os.open(device, os.O_RDONLY | os.O_CLOEXEC)
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(fd, LOOP_GET_STATUS64, buf, True)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    info = _LOOP_INFO64.unpack(bytes(buf))
+    return info[0], info[1]
+
+
+def _configure(loop_fd: int, file_fd: int, name: str, flags: int, block_size: int):
+    """Bind file_fd to the loop device in one LOOP_CONFIGURE call"""
+    file_name = os.fsencode(name)[-63:]
+    info = _LOOP_INFO64.pack(0, 0, 0, 0, 0, 0, 0, 0, flags, file_name, b'', b'', 0, 0)
+    try:
+        fcntl.ioctl(loop_fd, LOOP_CONFIGURE, _LOOP_CONFIG.pack(file_fd, block_size, info))
+        return
+    except OSError as e:
+        if e.errno not in (errno.EINVAL, errno.ENOTTY):
+            raise
+    # Kernel without LOOP_CONFIGURE (before 5.8), or one that rejected an
+    # attribute: the step by step ioctls, which tell which one failed
+    fcntl.ioctl(loop_fd, LOOP_SET_FD, file_fd)
+    try:
+        fcntl.ioctl(loop_fd, LOOP_SET_STATUS64, _LOOP_INFO64.pack(
+            0, 0, 0, 0, 0, 0, 0, 0, flags & ~LO_FLAGS_DIRECT_IO, file_name, b'', b'', 0, 0))
+        fcntl.ioctl(loop_fd, LOOP_SET_BLOCK_SIZE, block_size)
+        if flags & LO_FLAGS_DIRECT_IO:
+            fcntl.ioctl(loop_fd, LOOP_SET_DIRECT_IO, 1)
+    except OSError:
+        fcntl.ioctl(loop_fd, LOOP_CLR_FD, 0)
+        raise
+
+
+def attach(path: str, partscan: bool = True, direct_io: str = 'auto',
+           block_size: int = DEFAULT_BLOCK_SIZE, owner_pid: Optional[int] = None,
+           build_id: str = '') -> LoopLease:
+    """Attach path to a free loop device and record the lease
+
+    direct_io is 'on' (fail if unsupported), 'off', or 'auto' (use it
+    when the backing filesystem supports it).
+    """
+    if direct_io not in ('auto', 'on', 'off'):
+        raise Exception(f"Invalid direct I/O mode: {direct_io}")
+    path = os.path.realpath(path)
+    owner_pid = owner_pid or os.getpid()
+    owner_start = process_start(owner_pid)
+    if owner_start is None:
+        raise Exception(f"Lease owner process {owner_pid} does not exist")
+    flags = LO_FLAGS_PARTSCAN if partscan else 0
+
+    file_fd = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+    try:
+        ctl_fd = os.open(LOOP_CONTROL, os.O_RDWR | os.O_CLOEXEC)
+        try:
+            with _locked_leases() as leases:
+                for _ in range(GET_FREE_ATTEMPTS):
+                    device = f'/dev/loop{fcntl.ioctl(ctl_fd, LOOP_CTL_GET_FREE)}'
+                    loop_fd = os.open(device, os.O_RDWR | os.O_CLOEXEC)
+                    try:
+                        modes = [flags | LO_FLAGS_DIRECT_IO] if direct_io != 'off' else []
+                        modes += [flags] if direct_io != 'on' else []
+                        for index, mode in enumerate(modes):
+                            try:
+                                _configure(loop_fd, file_fd, path, mode, block_size)
+                                break
+                            except OSError as e:
+                                # EINVAL: direct I/O not possible on this file
+                                if e.errno != errno.EINVAL or index == len(modes) - 1:
+                                    raise
+                        break
+                    except OSError as e:
+                        if e.errno != errno.EBUSY:
+                            raise Exception(f"Cannot attach {path} to {device}: {e}")
+                        # Taken by someone else between GET_FREE and CONFIGURE
+                        logger.debug(f"{device} was taken concurrently, retrying")
+                    finally:
+                        os.close(loop_fd)
+                else:
+                    raise Exception(f"No free loop device after {GET_FREE_ATTEMPTS} attempts")
+
+                if direct_io == 'on' and _sysfs(device, 'dio') == '0':
+                    # Some kernels accept the flag and quietly stay buffered
+                    _clear(device)
+                    raise Exception(f"Direct I/O is not available for {path}")
+                st = os.fstat(file_fd)
+                lease = LoopLease(device, path, st.st_dev, st.st_ino, owner_pid, owner_start,
+                                  build_id, _sysfs(device, 'dio') == '1', block_size, time.time())
+                leases[device] = lease
+        finally:
+            os.close(ctl_fd)
+    finally:
+        os.close(file_fd)
+
+    logger.debug(f"Leased {lease.device} for {path} (direct I/O {'on' if lease.direct_io else 'off'})")
+    return lease
+
+
+def _clear(device: str):
+    fd = os.open(device, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        fcntl.ioctl(fd, LOOP_CLR_FD, 0)
+    finally:
+        os.close(fd)
+
+
+def detach(device: str) -> bool:
+    """Detach a loop device and drop its lease
+
+    A device still held open (e.g. by udev probing) is detached by the
+    kernel on its last close. Returns False when it was not bound.
+    """
+    with _locked_leases() as leases:
+        leases.pop(device, None)
+        try:
+            _clear(device)
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENXIO):
+                return False
+            raise Exception(f"Cannot detach {device}: {e}")
+    return True
+
+
+def reap() -> List[str]:
+    """Detach the devices of leases whose owner process has exited
+
+    A lease whose device is no longer bound to the leased file (detached
+    by hand, or re-used by someone else) is only dropped.
+    """
+    detached = []
+    with _locked_leases() as leases:
+        for device, lease in list(leases.items()):
+            if _alive(lease):
+                continue
+            del leases[device]
+            if _bound_inode(device) != (lease.backing_dev, lease.backing_inode):
+                continue
+            try:
+                _clear(device)
+                detached.append(device)
+                logger.info(f"Detached stale loop device {device} ({lease.backing_file}, "
+                            f"owner {lease.owner_pid} gone)")
+            except OSError as e:
+                logger.warning(f"Could not detach stale loop device {device}: {e}")
+    return detached
+
+
+def list_leases() -> List[LoopLease]:
+    with _locked_leases() as leases:
+        return sorted(leases.values(), key=lambda lease: lease.device)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Loop device lease manager")
+    sub = parser.add_subparsers(dest='command', required=True)
+    att = sub.add_parser('attach', help="attach IMAGE and print the loop device")
+    att.add_argument('image')
+    att.add_argument('--no-partscan', action='store_true')
+    att.add_argument('--direct-io', choices=('auto', 'on', 'off'), default='auto')
+    att.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE)
+    att.add_argument('--owner-pid', type=int, default=None,
+                     help="process that owns the lease (default: the parent)")
+    att.add_argument('--build-id', default='')
+    det = sub.add_parser('detach')
+    det.add_argument('device')
+    sub.add_parser('reap', help="detach loops whose owner has exited")
+    sub.add_parser('list', help="show bound loop devices and leases")
+    args = parser.parse_args(argv)
+
+    if args.command == 'attach':
+        lease = attach(args.image, not args.no_partscan, args.direct_io, args.block_size,
+                       args.owner_pid or os.getppid(), args.build_id)
+        print(lease.device)
+    elif args.command == 'detach':
+        detach(args.device)
+    elif args.command == 'reap':
+        for device in reap():
+            print(f"Detached {device}")
+    else:
+        leases = {lease.device: lease for lease in list_leases()}
+        for device, path in attached_loops().items():
+            lease = leases.get(device)
+            owner = (f"leased by {lease.owner_pid}{'' if _alive(lease) else ' (gone)'}"
+                     if lease else 'not leased')
+            print(f"{device}: {path} [dio={_sysfs(device, 'dio')}] {owner}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
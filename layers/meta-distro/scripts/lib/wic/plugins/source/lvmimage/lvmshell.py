@@ -0,0 +1,267 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Batched LVM commands through one `lvm` shell session
+
+Every `lvm pvcreate` / `vgcreate` / `lvcreate` fork rescans the devices and
+reloads the metadata. LvmShell starts a single `lvm` process in shell mode
+for the whole VG lifecycle instead, the way lvmdbusd drives it: commands
+go in on stdin, the "lvm> " prompt on stdout marks the end of each command,
+and the JSON report of the command (including its log report with the
+per-command return code) arrives on the file descriptor named by
+LVM_REPORT_FD. --nolocking is configured once for the session and added to
+every command.
+
+The same session answers --reportformat json queries, which is how the
+actual extent allocation of each LV is read back and compared with the plan
+of lvmimage.lvm2.
+
+Usage (commands one per line on stdin, without the leading "lvm"):
+  python3 -m lvmimage.lvmshell [--nolocking] [--vg VG] [--plan rootlv:0:384,...]
+"""
+
+import fcntl
+import json
+import os
+import select
+import shlex
+import shutil
+import subprocess
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+PROMPT = b'lvm> '
+# ECMD_PROCESSED: the return code lvm logs for a successful command
+LVM_SUCCESS = 1
+REPORT_OPTIONS = ['--reportformat', 'json', '--config', 'log/report_command_log=1']
+ALLOCATION_FIELDS = 'lv_name,seg_start_pe,seg_size_pe'
+VG_FIELDS = 'vg_extent_size,vg_extent_count,vg_free_count'
+
+
+@dataclass
+class LvmResult:
+    """Outcome of one command in the session"""
+    argv: List[str]
+    status: int
+    report: Dict = field(default_factory=dict)
+    errors: List[str] = field(default_factory=list)
+    output: str = ''
+    wall: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.status == LVM_SUCCESS
+
+
+def _quote(arg: str) -> str:
+    # The lvm shell splits on whitespace and honours double quotes
+    return f'"{arg}"' if any(c.isspace() for c in arg) or not arg else arg
+
+
+def _set_nonblocking(fd: int):
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+class LvmShell:
+    """One `lvm` shell process for a sequence of commands"""
+
+    def __init__(self, lvm: Optional[str] = None, nolocking: bool = True,
+                 timeout: float = 300.0):
+        self.lvm = lvm or shutil.which('lvm') or 'lvm'
+        self.nolocking = nolocking
+        self.timeout = timeout
+        self.results: List[LvmResult] = []
+        report_read, report_write = os.pipe()
+        env = dict(os.environ, LVM_REPORT_FD=str(report_write), LVM_SUPPRESS_FD_WARNINGS='1')
+        try:
+            self.process = subprocess.Popen([self.lvm], stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                            env=env, pass_fds=[report_write], bufsize=0)
+        finally:
+            os.close(report_write)
+        self._report_fd = report_read
+        for fd in (self.process.stdout.fileno(), self.process.stderr.fileno(), report_read):
+            _set_nonblocking(fd)
+        self._read_until_prompt()
+
+    def _read_until_prompt(self):
+        """Read stdout, stderr and the report fd until the next prompt"""
+        streams = {self.process.stdout.fileno(): b'', self.process.stderr.fileno(): b'',
+                   self._report_fd: b''}
+        stdout = self.process.stdout.fileno()
+        deadline = time.monotonic() + self.timeout
+        while not streams[stdout].endswith(PROMPT):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Exception(f"lvm shell did not answer within {self.timeout:.0f}s")
+            readable, _, _ = select.select(list(streams), [], [], remaining)
+            for fd in readable:
+                chunk = os.read(fd, 65536)
+                if not chunk and fd == stdout:
+                    raise Exception(f"lvm shell exited with status {self.process.wait()}: "
+                                    f"{streams[self.process.stderr.fileno()].decode(errors='replace')}")
+                streams[fd] += chunk
+        # The command finished before the prompt was printed, so its report
+        # is complete; pick up whatever is still in the pipe
+        try:
+            while True:
+                chunk = os.read(self._report_fd, 65536)
+                if not chunk:
+                    break
+                streams[self._report_fd] += chunk
+        except BlockingIOError:
+            pass
+        return (streams[stdout][:-len(PROMPT)].decode(errors='replace'),
+                streams[self.process.stderr.fileno()].decode(errors='replace'),
+                streams[self._report_fd].decode(errors='replace'))
+
+    @staticmethod
+    def _parse_report(text: str) -> Dict:
+        """Merge the JSON documents the command wrote to the report fd"""
+        merged: Dict = {}
+        decoder = json.JSONDecoder()
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            document, end = decoder.raw_decode(text, pos)
+            for key, value in document.items():
+                merged.setdefault(key, []).extend(value)
+            pos = end
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+        return merged
+
+    def run(self, argv: Sequence[str], check: bool = True) -> LvmResult:
+        """Run one lvm command (without the leading "lvm") in the session"""
+        argv = list(argv)
+        if not argv:
+            raise Exception("empty lvm command")
+        if self.nolocking and '--nolocking' not in argv and argv[0] not in ('version', 'lastlog'):
+            argv.insert(1, '--nolocking')
+        line = ' '.join(_quote(a) for a in argv + REPORT_OPTIONS)
+        start = time.perf_counter()
+        self.process.stdin.write(line.encode() + b'\n')
+        self.process.stdin.flush()
+        output, stderr, report_text = self._read_until_prompt()
+        report = self._parse_report(report_text) if report_text.strip() else {}
+
+        # The command's own status is the last "cmd" status entry of its log
+        status = None
+        errors = [line for line in stderr.splitlines() if line.strip()]
+        for entry in report.get('log', []):
+            if entry.get('log_type') == 'status' and entry.get('log_object_type') == 'cmd':
+                status = int(entry.get('log_ret_code', 0))
+            elif entry.get('log_type') == 'error' and entry.get('log_message'):
+                errors.append(entry['log_message'])
+        if status is None:
+            status = LVM_SUCCESS if not errors else 0
+        result = LvmResult(argv, status, report, errors, output, time.perf_counter() - start)
+        self.results.append(result)
+        if check and not result.ok:
+            raise Exception(f"lvm {' '.join(argv)} failed: {'; '.join(result.errors) or 'no log'}")
+        return result
+
+    def query(self, argv: Sequence[str]) -> List[Dict]:
+        """Run a reporting command, returning the rows of its report"""
+        result = self.run(list(argv) + ['--units', 'b', '--nosuffix'])
+        rows: List[Dict] = []
+        for report in result.report.get('report', []):
+            for values in report.values():
+                rows.extend(values)
+        return rows
+
+    def allocations(self, vg_name: str) -> Dict:
+        """Actual extent size, extent counts and LV segments of a VG"""
+        vg = self.query(['vgs', '-o', VG_FIELDS, vg_name])
+        if not vg:
+            raise Exception(f"VG {vg_name} not found")
+        lvs = {}
+        for row in self.query(['lvs', '-o', ALLOCATION_FIELDS, vg_name]):
+            lvs[row['lv_name']] = (int(row['seg_start_pe']), int(row['seg_size_pe']))
+        return {
+            'extent_size': int(vg[0]['vg_extent_size']),
+            'extent_count': int(vg[0]['vg_extent_count']),
+            'free_count': int(vg[0]['vg_free_count']),
+            'lvs': lvs,
+        }
+
+    def close(self) -> int:
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write(b'exit\n')
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        status = self.process.wait()
+        os.close(self._report_fd)
+        return status
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def compare_plan(actual: Dict, plan: Dict[str, tuple]) -> List[str]:
+    """Differences between the actual LV segments and planned (start, count)"""
+    problems = []
+    for name, (start, count) in plan.items():
+        got = actual['lvs'].get(name)
+        if got != (start, count):
+            problems.append(f"{name}: planned extents {start}+{count}, lvm allocated "
+                            f"{'none' if got is None else f'{got[0]}+{got[1]}'}")
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Run lvm commands from stdin in one lvm shell")
+    parser.add_argument('--lvm', default=None)
+    parser.add_argument('--nolocking', action='store_true')
+    parser.add_argument('--vg', default=None, help="report the extent allocation of this VG")
+    parser.add_argument('--plan', default='',
+                        help="expected LV segments as name:start:count,... (warns on mismatch)")
+    parser.add_argument('--report', default=None, help="write the allocation as JSON here")
+    args = parser.parse_args(argv)
+
+    commands = [shlex.split(line) for line in sys.stdin
+                if line.strip() and not line.lstrip().startswith('#')]
+    with LvmShell(args.lvm, args.nolocking) as shell:
+        for command in commands:
+            result = shell.run(command, check=False)
+            mark = '✓' if result.ok else '✗'
+            print(f"{mark} lvm {' '.join(command)} ({result.wall * 1000:.0f}ms)")
+            if not result.ok:
+                for error in result.errors:
+                    print(f"  {error}", file=sys.stderr)
+                return 1
+        if args.vg:
+            actual = shell.allocations(args.vg)
+            for name, (start, count) in actual['lvs'].items():
+                print(f"  {name}: extents {start}+{count} "
+                      f"({count * actual['extent_size'] // (1024 * 1024)}MB)")
+            print(f"  {actual['free_count']} of {actual['extent_count']} extents free")
+            plan = {}
+            for item in filter(None, args.plan.split(',')):
+                name, start, count = item.split(':')
+                plan[name] = (int(start), int(count))
+            for problem in compare_plan(actual, plan):
+                print(f"Warning: {problem}", file=sys.stderr)
+            if args.report:
+                with open(args.report, 'w') as f:
+                    json.dump(dict(actual, lvs={k: list(v) for k, v in actual['lvs'].items()}),
+                              f, indent=2, sort_keys=True)
+        print(f"{len(commands)} lvm commands in one session")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,194 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Additional LVs populated from rootfs subtrees
+
+With lvm-mounts=varfs:/var the LV varfs is built from the /var subtree of
+the rootfs, and the rootfs LV keeps only the /var directory itself (mode,
+owner, xattrs) as the mountpoint. The volume then boots populated instead
+of being filled from /usr/share/factory/var by systemd-tmpfiles. Mountpoints
+may nest (/var and /var/log): every tree leaves out the mountpoints below it.
+
+Images that empty a subtree in ROOTFS_POSTPROCESS_COMMAND after saving it as
+the systemd factory copy (core-image-distro.inc does this for /var) populate
+the LV from /usr/share/factory<mountpoint> instead, so the C+! /var
+tmpfiles rule still finds the volume populated on first boot.
+
+mkfs.ext4 -d has no exclude option, so a tree that has to leave subtrees
+out is staged as a view in the work directory: directories are recreated
+with their attributes and everything else is hardlinked to the rootfs,
+which costs one link() per entry and no file data. Entries that cannot be
+linked (another filesystem, fs.protected_hardlinks) are copied instead.
+A tree without mountpoints below it is used in place.
+
+Usage: python3 -m lvmimage.mounts ROOTFS VIEW --exclude /var [--exclude ...]
+"""
+
+import errno
+import os
+import shutil
+import stat
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List
+
+RESERVED = ('/boot',)
+
+# systemd factory copies (${datadir}/factory), relative to the rootfs
+FACTORY_DIR = 'usr/share/factory'
+
+
+@dataclass
+class SourceTree:
+    """The part of the rootfs one LV is populated from"""
+    lv_name: str
+    mountpoint: str
+    path: str
+    # Mountpoints below this tree, relative to it ('/log' for /var/log
+    # in the /var tree); their contents belong to other LVs
+    excluded: List[str] = field(default_factory=list)
+
+
+def normalize_mountpoint(mountpoint: str) -> str:
+    """Clean up a mountpoint and reject the ones no LV can take"""
+    if not mountpoint.startswith('/'):
+        raise Exception(f"Mountpoint '{mountpoint}' is not an absolute path")
+    path = os.path.normpath(mountpoint)
+    if path.startswith('//'):
+        path = path[1:]
+    if path == '/':
+        raise Exception("The rootfs LV is always mounted on /")
+    for reserved in RESERVED:
+        if path == reserved or path.startswith(reserved + '/'):
+            raise Exception(f"Mountpoint {path} is on a partition outside the volume group")
+    return path
+
+
+def _relative_below(mountpoint: str, others: Iterable[str]) -> List[str]:
+    prefix = '' if mountpoint == '/' else mountpoint
+    return sorted(other[len(prefix):] for other in others
+                  if other != mountpoint and other.startswith(prefix + '/'))
+
+
+def factory_path(rootfs_dir: str, mountpoint: str) -> str:
+    return os.path.join(rootfs_dir, FACTORY_DIR, mountpoint.lstrip('/'))
+
+
+def _is_empty(path: str) -> bool:
+    if not os.path.isdir(path):
+        return True
+    with os.scandir(path) as it:
+        return next(it, None) is None
+
+
+def source_trees(rootfs_dir: str, rootfs_lv_name: str, mount_points) -> List[SourceTree]:
+    """Source tree of the rootfs LV followed by one per mounted LV
+
+    A mounted LV whose subtree is missing or empty is populated from the
+    factory copy of it when the rootfs has one.
+
+    Args:
+        mount_points: MountPointSpec list (lv_name, mountpoint)
+    """
+    mountpoints = [mp.mountpoint for mp in mount_points]
+    trees = [SourceTree(rootfs_lv_name, '/', rootfs_dir, _relative_below('/', mountpoints))]
+    for mp in mount_points:
+        path = os.path.join(rootfs_dir, mp.mountpoint.lstrip('/'))
+        factory = factory_path(rootfs_dir, mp.mountpoint)
+        if _is_empty(path) and os.path.isdir(factory):
+            path = factory
+        trees.append(SourceTree(mp.lv_name, mp.mountpoint, path,
+                                _relative_below(mp.mountpoint, mountpoints)))
+    return trees
+
+
+def _copy_entry(source: str, target: str, st: os.stat_result):
+    if stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
+        shutil.copy2(source, target, follow_symlinks=False)
+    else:
+        os.mknod(target, st.st_mode, st.st_rdev)
+        shutil.copystat(source, target, follow_symlinks=False)
+    os.chown(target, st.st_uid, st.st_gid, follow_symlinks=False)
+
+
+def stage_view(source: str, excluded: Iterable[str], view: str) -> Dict[str, int]:
+    """Recreate source at view without the contents of the excluded subtrees
+
+    The excluded directories themselves are kept, empty, as mountpoints.
+
+    Returns:
+        Dict with the number of linked and copied entries and directories
+    """
+    excluded = {'/' + path.strip('/') for path in excluded}
+    counts = {'linked': 0, 'copied': 0, 'directories': 0}
+    if os.path.lexists(view):
+        shutil.rmtree(view)
+    os.mkdir(view)
+    # Directory attributes are applied after their contents, deepest first,
+    # so creating entries does not change the recorded mtimes
+    directories = [('', source, view)]
+    stack = [('', source, view)]
+    while stack:
+        relative, src_dir, dst_dir = stack.pop()
+        if relative in excluded:
+            continue
+        with os.scandir(src_dir) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            child = f'{relative}/{entry.name}'
+            target = os.path.join(dst_dir, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                os.mkdir(target)
+                directories.append((child, entry.path, target))
+                stack.append((child, entry.path, target))
+                counts['directories'] += 1
+                continue
+            try:
+                os.link(entry.path, target, follow_symlinks=False)
+                counts['linked'] += 1
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                _copy_entry(entry.path, target, entry.stat(follow_symlinks=False))
+                counts['copied'] += 1
+    for _, src_dir, dst_dir in reversed(directories):
+        st = os.lstat(src_dir)
+        os.chown(dst_dir, st.st_uid, st.st_gid)
+        shutil.copystat(src_dir, dst_dir)
+    return counts
+
+
+def view_path(workdir: str, lv_name: str) -> str:
+    return os.path.join(workdir, f'view-{lv_name}')
+
+
+def remove_views(workdir: str, trees: List[SourceTree]):
+    for tree in trees:
+        view = view_path(workdir, tree.lv_name)
+        if os.path.lexists(view):
+            shutil.rmtree(view)
+
+
+def main(argv=None) -> int:
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Stage a rootfs view without the given subtrees")
+    parser.add_argument('rootfs')
+    parser.add_argument('view')
+    parser.add_argument('--exclude', action='append', default=[],
+                        help="mountpoint whose contents are left out; repeatable")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    counts = stage_view(args.rootfs, [normalize_mountpoint(p) for p in args.exclude], args.view)
+    print(f"{counts['directories']} directories, {counts['linked']} linked, "
+          f"{counts['copied']} copied ({time.perf_counter() - start:.2f}s)")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,133 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+LUKS2 key-derivation profiles
+
+`cryptsetup luksFormat` with its defaults benchmarks argon2id for about two
+seconds and sizes its memory cost to the build host, up to 1 GiB, and
+`cryptsetup open` pays the same cost again. An image build does not need
+that: its keyslot protects a passphrase that ships in the image recipe, and
+the parameters should fit the target rather than the build host.
+
+A profile turns the luks-pbkdf* sourceparams into cryptsetup arguments (for
+the generated script) and into the iteration count of the userspace LUKS2
+writer (offset assembly, which writes pbkdf2 keyslots only):
+
+  default  - cryptsetup's own benchmark (argon2id), or pbkdf2 calibrated for
+             2 s in offset mode; luks-iter-time and luks-pbkdf-memory cap it
+  build    - pbkdf2 with the minimum 1000 iterations: no benchmark, no memory
+             cost, and marked for re-keying on first boot
+  argon2id, argon2i, pbkdf2
+           - that PBKDF with the optional caps
+
+A volume marked for re-keying carries REKEY_SUBSYSTEM in the subsystem field
+of its LUKS2 header. The luks-rekey service on the target converts the
+keyslot to PBKDF parameters benchmarked on the device (or enrolls a TPM2
+key) and clears the mark.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+PBKDF_TYPES = ('argon2id', 'argon2i', 'pbkdf2')
+PROFILES = ('default', 'build') + PBKDF_TYPES
+PBKDF2_MIN_ITERATIONS = 1000
+ARGON2_MIN_ITERATIONS = 4
+ARGON2_MIN_MEMORY_KIB = 32
+ARGON2_MAX_MEMORY_KIB = 4 * 1024 * 1024
+REKEY_SUBSYSTEM = 'luks-rekey'
+
+
+@dataclass
+class PbkdfProfile:
+    """Keyslot PBKDF parameters for the image's LUKS2 volume"""
+    name: str = 'default'
+    pbkdf: Optional[str] = None
+    iter_time_ms: Optional[int] = None
+    iterations: Optional[int] = None
+    memory_kib: Optional[int] = None
+    parallel: Optional[int] = None
+    rekey: bool = False
+
+    def cryptsetup_args(self) -> List[str]:
+        """Extra `cryptsetup luksFormat` arguments"""
+        args = []
+        if self.pbkdf:
+            args += ['--pbkdf', self.pbkdf]
+        if self.iterations:
+            args += ['--pbkdf-force-iterations', str(self.iterations)]
+        elif self.iter_time_ms:
+            args += ['--iter-time', str(self.iter_time_ms)]
+        if self.memory_kib:
+            args += ['--pbkdf-memory', str(self.memory_kib)]
+        if self.parallel:
+            args += ['--pbkdf-parallel', str(self.parallel)]
+        if self.rekey:
+            args += ['--subsystem', REKEY_SUBSYSTEM]
+        return args
+
+    def check_userspace(self):
+        """Raise when lvmimage.luks2 cannot write a keyslot for this profile"""
+        if self.pbkdf not in (None, 'pbkdf2'):
+            raise Exception(f"luks-pbkdf={self.name}: offset assembly writes pbkdf2 keyslots only "
+                            f"(use luks-pbkdf=pbkdf2 or build, and let luks-rekey convert the "
+                            f"keyslot to {self.pbkdf} on the target)")
+
+
+def _positive(source_params: Dict, key: str) -> Optional[int]:
+    value = source_params.get(key)
+    if value in (None, ''):
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise Exception(f"{key}={value}: expected a positive integer")
+    if number <= 0:
+        raise Exception(f"{key}={value}: expected a positive integer")
+    return number
+
+
+def parse_profile(source_params: Dict) -> PbkdfProfile:
+    """PbkdfProfile from the luks-pbkdf* sourceparams
+
+    luks-pbkdf            profile name (see PROFILES)
+    luks-iter-time        benchmark target in ms
+    luks-pbkdf-iterations fixed iteration count, skips the benchmark
+    luks-pbkdf-memory     argon2 memory cost cap in KiB
+    luks-pbkdf-parallel   argon2 threads
+    luks-rekey            first-boot or none (default: first-boot for the
+                          build profile, none otherwise)
+    """
+    name = source_params.get('luks-pbkdf', 'default')
+    if name not in PROFILES:
+        raise Exception(f"Unknown luks-pbkdf '{name}' (expected one of {', '.join(PROFILES)})")
+    if name == 'build':
+        profile = PbkdfProfile(name, 'pbkdf2', iterations=PBKDF2_MIN_ITERATIONS, rekey=True)
+    else:
+        profile = PbkdfProfile(name, None if name == 'default' else name)
+    profile.iter_time_ms = _positive(source_params, 'luks-iter-time') or profile.iter_time_ms
+    profile.iterations = _positive(source_params, 'luks-pbkdf-iterations') or profile.iterations
+    profile.memory_kib = _positive(source_params, 'luks-pbkdf-memory')
+    profile.parallel = _positive(source_params, 'luks-pbkdf-parallel')
+
+    rekey = source_params.get('luks-rekey')
+    if rekey not in (None, 'first-boot', 'none'):
+        raise Exception(f"Unknown luks-rekey '{rekey}' (expected 'first-boot' or 'none')")
+    if rekey:
+        profile.rekey = rekey == 'first-boot'
+
+    if profile.pbkdf == 'pbkdf2':
+        if profile.memory_kib or profile.parallel:
+            raise Exception("luks-pbkdf-memory and luks-pbkdf-parallel apply to argon2 only")
+        if profile.iterations and profile.iterations < PBKDF2_MIN_ITERATIONS:
+            raise Exception(f"pbkdf2 needs at least {PBKDF2_MIN_ITERATIONS} iterations")
+    elif profile.iterations and profile.iterations < ARGON2_MIN_ITERATIONS:
+        raise Exception(f"argon2 needs at least {ARGON2_MIN_ITERATIONS} iterations")
+    if profile.memory_kib and not (ARGON2_MIN_MEMORY_KIB <= profile.memory_kib <= ARGON2_MAX_MEMORY_KIB):
+        raise Exception(f"luks-pbkdf-memory must be between {ARGON2_MIN_MEMORY_KIB} "
+                        f"and {ARGON2_MAX_MEMORY_KIB} KiB")
+    return profile
@@ -0,0 +1,233 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Dependency-graph step executor
+
+Steps declare the resources they consume (inputs) and produce (outputs).
+A step becomes ready once every producer of its inputs has finished, and
+ready steps run on a bounded thread pool - the work is mkfs/mcopy
+subprocesses and pwrite() into disjoint ranges of one image, so threads are
+enough. When a step fails no new steps are started, running ones are
+allowed to finish, and the rollback callbacks of completed steps run in
+reverse topological order.
+
+Steps named in resumed were completed by an earlier, interrupted run and
+are skipped as long as everything they depend on is skipped too; on_start
+and on_done let a caller journal progress (lvmimage.journal).
+
+After a run, report() lists per-step timings and marks the critical path:
+the dependency chain that determined the total wall-clock time.
+"""
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+from lvmimage import trace
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Step:
+    """One unit of work in an ExecutionPlan"""
+    name: str
+    func: Callable
+    args: List = field(default_factory=list)
+    kwargs: Dict = field(default_factory=dict)
+    inputs: Sequence[str] = ()
+    outputs: Sequence[str] = ()
+    rollback: Optional[Callable] = None
+    status: str = "pending"
+    start: float = 0.0
+    end: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+@dataclass
+class ExecutionPlan:
+    """Execution plan with dependency-ordered steps and state tracking
+
+    Step results are stored in state under the step name (None for resumed
+    steps).
+    """
+    steps: List[Step] = field(default_factory=list)
+    state: Dict = field(default_factory=dict)
+    max_workers: int = 4
+    started: float = 0.0
+    resumed: Set[str] = field(default_factory=set)
+    # Called with the step before it starts and after it finished
+    on_start: Optional[Callable[[Step], None]] = None
+    on_done: Optional[Callable[[Step], None]] = None
+
+    def add_step(self, name: str, func, args: List = None, kwargs: Dict = None,
+                 inputs: Sequence[str] = (), outputs: Sequence[str] = (),
+                 rollback: Optional[Callable] = None) -> Step:
+        """Queue an execution step
+
+        Args:
+            inputs: Resources that must exist before the step runs
+            outputs: Resources the step produces
+            rollback: Called with the step's result if a later step fails
+        """
+        if any(s.name == name for s in self.steps):
+            raise Exception(f"Duplicate step name '{name}'")
+        step = Step(name, func, list(args or []), dict(kwargs or {}),
+                    tuple(inputs), tuple(outputs), rollback)
+        self.steps.append(step)
+        return step
+
+    def dependencies(self) -> Dict[str, Set[str]]:
+        """Map each step name to the names of the steps producing its inputs
+
+        Inputs that no step produces are treated as already available.
+        """
+        producers: Dict[str, str] = {}
+        for step in self.steps:
+            for resource in step.outputs:
+                if resource in producers:
+                    raise Exception(f"Resource '{resource}' is produced by both "
+                                    f"'{producers[resource]}' and '{step.name}'")
+                producers[resource] = step.name
+        return {step.name: {producers[r] for r in step.inputs if r in producers} - {step.name}
+                for step in self.steps}
+
+    def topological_order(self) -> List[Step]:
+        """Steps in dependency order, ties broken by insertion order"""
+        deps = self.dependencies()
+        done: Set[str] = set()
+        order: List[Step] = []
+        while len(order) < len(self.steps):
+            ready = [s for s in self.steps if s.name not in done and deps[s.name] <= done]
+            if not ready:
+                cycle = sorted(s.name for s in self.steps if s.name not in done)
+                raise Exception(f"Dependency cycle between steps: {', '.join(cycle)}")
+            for step in ready:
+                done.add(step.name)
+                order.append(step)
+        return order
+
+    def skipped(self) -> Set[str]:
+        """Resumed steps that do not depend on a step that runs again"""
+        deps = self.dependencies()
+        skipped: Set[str] = set()
+        for step in self.topological_order():
+            if step.name in self.resumed and deps[step.name] <= skipped:
+                skipped.add(step.name)
+        return skipped
+
+    def execute(self, max_workers: Optional[int] = None) -> Dict:
+        """Run all steps, concurrently where the graph allows
+
+        Returns:
+            The state dict with every step's result
+
+        Raises:
+            Exception naming the first failed step, after rollback
+        """
+        order = self.topological_order()
+        deps = self.dependencies()
+        workers = max(1, max_workers or self.max_workers)
+        completed = self.skipped()
+        failure = None
+        self.started = time.perf_counter()
+        for step in order:
+            if step.name in completed:
+                step.status = "resumed"
+                self.state[step.name] = None
+
+        def run(step: Step):
+            step.start = time.perf_counter()
+            try:
+                with trace.span(step.name, 'step'):
+                    return step.func(*step.args, **step.kwargs)
+            finally:
+                step.end = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            running = {}
+            pending = [s for s in order if s.name not in completed]
+            while pending or running:
+                if failure is None:
+                    for step in [s for s in pending if deps[s.name] <= completed]:
+                        if len(running) >= workers:
+                            break
+                        pending.remove(step)
+                        step.status = "running"
+                        if self.on_start:
+                            self.on_start(step)
+                        running[pool.submit(run, step)] = step
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    try:
+                        self.state[step.name] = future.result()
+                        if self.on_done:
+                            self.on_done(step)
+                        step.status = "done"
+                        completed.add(step.name)
+                    except Exception as e:
+                        step.status = "failed"
+                        if failure is None:
+                            failure = (step, e)
+
+        if failure:
+            self._rollback(order)
+            step, error = failure
+            raise Exception(f"Step '{step.name}' failed: {error}")
+        return self.state
+
+    def _rollback(self, order: List[Step]):
+        """Undo completed steps in reverse topological order"""
+        for step in reversed(order):
+            if step.status != "done" or not step.rollback:
+                continue
+            try:
+                step.rollback(self.state.get(step.name))
+                step.status = "rolled back"
+            except Exception as e:
+                logger.warning(f"Rollback of step '{step.name}' failed: {e}")
+
+    def critical_path(self) -> List[Step]:
+        """Longest duration-weighted dependency chain of the last run"""
+        deps = self.dependencies()
+        by_name = {s.name: s for s in self.steps}
+        finish: Dict[str, float] = {}
+        via: Dict[str, Optional[str]] = {}
+        for step in self.topological_order():
+            best = max(deps[step.name], key=lambda n: finish[n], default=None)
+            finish[step.name] = step.duration + (finish[best] if best else 0.0)
+            via[step.name] = best
+        if not finish:
+            return []
+        name = max(finish, key=finish.get)
+        path = []
+        while name:
+            path.append(by_name[name])
+            name = via[name]
+        return list(reversed(path))
+
+    def report(self) -> str:
+        """Per-step timing table, critical path steps marked with '*'"""
+        t0 = self.started
+        critical = {s.name for s in self.critical_path()}
+        width = max([len(s.name) for s in self.steps] + [4])
+        lines = [f"  {'step':<{width}}  {'start':>8}  {'time':>8}  status"]
+        for step in sorted(self.steps, key=lambda s: (s.start or float('inf'), s.name)):
+            mark = '*' if step.name in critical else ' '
+            start = f"{step.start - t0:7.2f}s" if step.start else "       -"
+            lines.append(f"{mark} {step.name:<{width}}  {start}  {step.duration:7.2f}s  {step.status}")
+        total = sum(s.duration for s in self.steps if s.name in critical)
+        lines.append(f"  critical path: {' -> '.join(s.name for s in self.critical_path())} ({total:.2f}s)")
+        return '\n'.join(lines)
@@ -0,0 +1,438 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Parallel rootfs scanner with a reusable binary manifest
+
+Sizing, incremental updates and any later verification all need the same
+facts about the rootfs tree. scan() walks it once with os.scandir on a
+thread pool (directory listing, lstat and listxattr release the GIL, so
+directories are read concurrently) and returns a Manifest: one row per
+entry in column arrays (array.array, a few dozen bytes per entry instead
+of a dict per file) holding the parent, name, type, mode, owner, size,
+allocated blocks, mtime, device/inode, link count, device number, the
+size of its xattrs as ext4 stores them, and optionally a sha256 of every
+regular file.
+
+The children of each directory are stored as one block of rows, sorted by
+name, with the blocks in depth-first order, so two scans of the same tree
+are identical and every parent precedes its children.
+
+The manifest is cached on disk (LVMROOTFS_SCAN_CACHE, default
+lvmrootfs-scan-<uid> in the temporary directory, which honours TMPDIR; the
+plugin points it into the image recipe's WORKDIR), keyed by the real path
+of the root; only the CACHE_ENTRIES most recently used manifests of a
+cache directory are kept. A cached manifest is reused when the signature
+of the tree still matches: the device, inode, mtime and ctime of every
+directory. Creating, removing or renaming anything changes the mtime of
+its directory, so validating a cache costs one lstat per directory rather
+than one per file. A file rewritten in place does not change any
+directory; pass verify=True to also compare every file's lstat. When a
+tree did change, the hashes of files with unchanged size, inode and mtime
+are carried over from the cached manifest instead of being read again.
+
+Usage: python3 -m lvmimage.scan ROOT [--hash] [--jobs N] [--no-cache] [--verify]
+"""
+
+import array
+import hashlib
+import json
+import os
+import queue
+import stat
+import sys
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MAGIC = b'LVMSCAN\n'
+VERSION = 1
+HASH_SIZE = 32
+HASH_CHUNK = 1024 * 1024
+# Manifests kept per cache directory; the least recently used go first
+CACHE_ENTRIES = 8
+
+KIND_CODES = {stat.S_IFREG: 'f', stat.S_IFDIR: 'd', stat.S_IFLNK: 'l', stat.S_IFCHR: 'c',
+              stat.S_IFBLK: 'b', stat.S_IFIFO: 'p', stat.S_IFSOCK: 's'}
+
+# Column name -> array typecode
+COLUMNS = (
+    ('parent', 'l'),
+    ('name_offset', 'Q'),
+    ('name_length', 'H'),
+    ('kind', 'B'),
+    ('mode', 'L'),
+    ('uid', 'L'),
+    ('gid', 'L'),
+    ('size', 'Q'),
+    ('blocks', 'Q'),
+    ('mtime_ns', 'q'),
+    ('dev', 'Q'),
+    ('ino', 'Q'),
+    ('nlink', 'L'),
+    ('rdev', 'Q'),
+    ('xattr_size', 'L'),
+)
+
+Entry = namedtuple('Entry', ['index', 'path'] + [name for name, _ in COLUMNS[3:]] + ['sha256'])
+
+
+def xattr_size(path: str) -> int:
+    """Bytes the xattrs of path take as ext4 xattr entries (0 when none)"""
+    try:
+        names = os.listxattr(path, follow_symlinks=False)
+    except OSError:
+        return 0
+    size = 0
+    for name in names:
+        try:
+            value = os.getxattr(path, name, follow_symlinks=False)
+        except OSError:
+            continue
+        # 16-byte entry header; name (without its namespace prefix) and
+        # value are padded to 4 bytes
+        suffix = name.split('.', 1)[-1]
+        size += 16 + -(-len(suffix) // 4) * 4 + -(-len(value) // 4) * 4
+    return size
+
+
+def file_sha256(path: str) -> bytes:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _row(st: os.stat_result, path: str) -> Tuple:
+    return (ord(KIND_CODES.get(stat.S_IFMT(st.st_mode), '?')), st.st_mode, st.st_uid, st.st_gid,
+            st.st_size, st.st_blocks, st.st_mtime_ns, st.st_dev, st.st_ino, st.st_nlink,
+            st.st_rdev, xattr_size(path))
+
+
+class Manifest:
+    """Column-array manifest of one tree"""
+
+    def __init__(self, root: str, hashed: bool = False):
+        self.root = root
+        self.hashed = hashed
+        self.columns = {name: array.array(code) for name, code in COLUMNS}
+        self.names = bytearray()
+        self.hashes = bytearray()
+        self.signature = ''
+        self._paths: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self.columns['kind'])
+
+    def append(self, parent: int, name: bytes, row: Tuple):
+        columns = self.columns
+        columns['parent'].append(parent)
+        columns['name_offset'].append(len(self.names))
+        columns['name_length'].append(len(name))
+        self.names += name
+        for (column, _), value in zip(COLUMNS[3:], row):
+            columns[column].append(value)
+        if self.hashed:
+            self.hashes += bytes(HASH_SIZE)
+
+    def name(self, index: int) -> str:
+        offset = self.columns['name_offset'][index]
+        return os.fsdecode(bytes(self.names[offset:offset + self.columns['name_length'][index]]))
+
+    def paths(self) -> List[str]:
+        """'/'-rooted path of every row (parents always precede children)"""
+        if self._paths is None:
+            paths: List[str] = []
+            parents = self.columns['parent']
+            for index in range(len(self)):
+                parent = parents[index]
+                if parent < 0:
+                    paths.append('/')
+                else:
+                    prefix = paths[parent]
+                    paths.append(('' if prefix == '/' else prefix) + '/' + self.name(index))
+            self._paths = paths
+        return self._paths
+
+    def kind(self, index: int) -> str:
+        return chr(self.columns['kind'][index])
+
+    def sha256(self, index: int) -> Optional[bytes]:
+        if not self.hashed or self.kind(index) != 'f':
+            return None
+        return bytes(self.hashes[index * HASH_SIZE:(index + 1) * HASH_SIZE])
+
+    def set_sha256(self, index: int, digest: bytes):
+        self.hashes[index * HASH_SIZE:(index + 1) * HASH_SIZE] = digest
+
+    def __iter__(self) -> Iterator[Entry]:
+        paths = self.paths()
+        columns = [self.columns[name] for name, _ in COLUMNS[3:]]
+        for index in range(len(self)):
+            values = [column[index] for column in columns]
+            values[0] = chr(values[0])
+            digest = self.sha256(index)
+            yield Entry(index, paths[index], *values, digest.hex() if digest else None)
+
+    def directories(self) -> List[int]:
+        kind = ord('d')
+        return [i for i, k in enumerate(self.columns['kind']) if k == kind]
+
+    def compute_signature(self) -> str:
+        """Digest of the identity and times of every directory, from lstat"""
+        digest = hashlib.sha256(os.fsencode(self.root))
+        paths = self.paths()
+        for index in self.directories():
+            try:
+                st = os.lstat(self.root + paths[index] if index else self.root)
+            except OSError:
+                return ''
+            digest.update(f"{paths[index]}\0{st.st_dev}:{st.st_ino}:{st.st_mtime_ns}:"
+                          f"{st.st_ctime_ns}\n".encode('utf-8', 'surrogateescape'))
+        return digest.hexdigest()
+
+    def files_unchanged(self) -> bool:
+        """True when every non-directory still has the recorded lstat"""
+        paths = self.paths()
+        columns = self.columns
+        for index in range(len(self)):
+            if self.kind(index) == 'd':
+                continue
+            try:
+                st = os.lstat(self.root + paths[index])
+            except OSError:
+                return False
+            if (st.st_ino, st.st_size, st.st_mtime_ns) != (columns['ino'][index], columns['size'][index],
+                                                          columns['mtime_ns'][index]):
+                return False
+        return True
+
+    def save(self, path: str):
+        header = {
+            'version': VERSION,
+            'root': self.root,
+            'count': len(self),
+            'hashed': self.hashed,
+            'signature': self.signature,
+            'byteorder': sys.byteorder,
+            'columns': [[name, code, self.columns[name].itemsize] for name, code in COLUMNS],
+            'names': len(self.names),
+        }
+        encoded = json.dumps(header, sort_keys=True).encode()
+        partial = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(partial, 'wb') as f:
+            f.write(MAGIC + len(encoded).to_bytes(4, 'little') + encoded)
+            for name, _ in COLUMNS:
+                self.columns[name].tofile(f)
+            f.write(self.names)
+            f.write(self.hashes)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'Manifest':
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise Exception(f"{path} is not a scan manifest")
+            header = json.loads(f.read(int.from_bytes(f.read(4), 'little')))
+            if header.get('version') != VERSION:
+                raise Exception(f"{path}: unsupported scan manifest version")
+            manifest = cls(header['root'], header['hashed'])
+            manifest.signature = header['signature']
+            for name, code, itemsize in header['columns']:
+                column = array.array(code)
+                if column.itemsize != itemsize:
+                    raise Exception(f"{path}: column {name} has a different item size here")
+                column.fromfile(f, header['count'])
+                if header['byteorder'] != sys.byteorder:
+                    column.byteswap()
+                manifest.columns[name] = column
+            manifest.names = bytearray(f.read(header['names']))
+            if manifest.hashed:
+                manifest.hashes = bytearray(f.read(header['count'] * HASH_SIZE))
+        return manifest
+
+
+def _list_directory(path: str) -> Tuple[List[bytes], List[str], List[Tuple]]:
+    """Names, paths and rows of the entries of one directory, sorted by name"""
+    with os.scandir(path) as entries:
+        children = sorted((os.fsencode(entry.name), entry.path,
+                           _row(entry.stat(follow_symlinks=False), entry.path))
+                          for entry in entries)
+    if not children:
+        return [], [], []
+    names, paths, rows = zip(*children)
+    return list(names), list(paths), list(rows)
+
+
+def _walk(root: str, jobs: int) -> Manifest:
+    listings: Dict[str, Tuple] = {}
+    results: queue.Queue = queue.Queue()
+
+    def list_directory(path: str):
+        try:
+            results.put((path, _list_directory(path), None))
+        except Exception as e:
+            results.put((path, None, e))
+
+    directory = ord('d')
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pool.submit(list_directory, root)
+        outstanding = 1
+        while outstanding:
+            path, listing, error = results.get()
+            outstanding -= 1
+            if error:
+                raise error
+            listings[path] = listing
+            for child_path, row in zip(listing[1], listing[2]):
+                if row[0] == directory:
+                    pool.submit(list_directory, child_path)
+                    outstanding += 1
+
+    # The children of each directory form one block of rows, sorted by
+    # name, and blocks follow depth-first: the same tree gives the same rows
+    manifest = Manifest(root)
+    manifest.append(-1, b'', _row(os.lstat(root), root))
+    columns = [manifest.columns[name] for name, _ in COLUMNS[3:]]
+    stack = [(0, root)]
+    while stack:
+        index, path = stack.pop()
+        names, paths, rows = listings.pop(path)
+        if not names:
+            continue
+        first = len(manifest)
+        manifest.columns['parent'].extend([index] * len(names))
+        offset = len(manifest.names)
+        offsets = manifest.columns['name_offset']
+        for name in names:
+            offsets.append(offset)
+            offset += len(name)
+        manifest.columns['name_length'].extend(map(len, names))
+        manifest.names += b''.join(names)
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+        stack.extend(reversed([(first + i, paths[i]) for i, row in enumerate(rows)
+                               if row[0] == directory]))
+    return manifest
+
+
+def _hash_files(manifest: Manifest, previous: Optional[Manifest], jobs: int):
+    """Fill in the sha256 of every regular file, reusing unchanged ones"""
+    manifest.hashed = True
+    manifest.hashes = bytearray(len(manifest) * HASH_SIZE)
+    paths = manifest.paths()
+    known: Dict[str, Tuple] = {}
+    if previous is not None and previous.hashed:
+        columns = previous.columns
+        for index, path in enumerate(previous.paths()):
+            if previous.kind(index) == 'f':
+                known[path] = (columns['size'][index], columns['ino'][index],
+                               columns['mtime_ns'][index], previous.sha256(index))
+    columns = manifest.columns
+    todo = []
+    for index in range(len(manifest)):
+        if manifest.kind(index) != 'f':
+            continue
+        old = known.get(paths[index])
+        if old and old[:3] == (columns['size'][index], columns['ino'][index],
+                               columns['mtime_ns'][index]):
+            manifest.set_sha256(index, old[3])
+        else:
+            todo.append(index)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for index, digest in zip(todo, pool.map(lambda i: file_sha256(manifest.root + paths[i]), todo)):
+            manifest.set_sha256(index, digest)
+
+
+def cache_path(root: str, cache_dir: Optional[str] = None) -> str:
+    cache_dir = (cache_dir or os.environ.get('LVMROOTFS_SCAN_CACHE')
+                 or os.path.join(tempfile.gettempdir(), f'lvmrootfs-scan-{os.getuid()}'))
+    key = hashlib.sha256(os.fsencode(os.path.realpath(root))).hexdigest()[:24]
+    return os.path.join(cache_dir, f'{key}.scan')
+
+
+def prune_cache(cache_dir: str, keep: int = CACHE_ENTRIES):
+    """Remove all but the `keep` most recently used manifests of a cache"""
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith('.scan') and entry.is_file(follow_symlinks=False):
+                entries.append((entry.stat(follow_symlinks=False).st_mtime_ns, entry.path))
+    for _, path in sorted(entries, reverse=True)[keep:]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def scan(root: str, content_hash: bool = False, jobs: Optional[int] = None, cache: bool = True,
+         cache_dir: Optional[str] = None, verify: bool = False) -> Manifest:
+    """Manifest of the tree under root, from the cache when it is still valid"""
+    root = os.path.realpath(root)
+    jobs = jobs or min(32, (os.cpu_count() or 1) * 2)
+    path = cache_path(root, cache_dir)
+    previous = None
+    if cache and os.path.exists(path):
+        try:
+            previous = Manifest.load(path)
+        except Exception:
+            previous = None
+        if (previous is not None and previous.root == root and (previous.hashed or not content_hash)
+                and previous.signature and previous.compute_signature() == previous.signature
+                and (not verify or previous.files_unchanged())):
+            try:
+                os.utime(path)  # most recently used, for prune_cache
+            except OSError:
+                pass
+            return previous
+
+    manifest = _walk(root, jobs)
+    if content_hash:
+        _hash_files(manifest, previous, jobs)
+    manifest.signature = manifest.compute_signature()
+    if cache:
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            manifest.save(path)
+            prune_cache(os.path.dirname(path))
+        except OSError:
+            pass
+    return manifest
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Scan a rootfs tree into a binary manifest")
+    parser.add_argument('root')
+    parser.add_argument('--hash', action='store_true', help="sha256 of every regular file")
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--verify', action='store_true', help="also lstat every file to validate the cache")
+    parser.add_argument('--list', action='store_true', help="print every entry")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    manifest = scan(args.root, args.hash, args.jobs, not args.no_cache, verify=args.verify)
+    elapsed = time.perf_counter() - start
+    if args.list:
+        for entry in manifest:
+            print(f"{entry.kind} {entry.mode & 0o7777:04o} {entry.uid}:{entry.gid} {entry.size:>10} "
+                  f"{entry.sha256 or '-':<64} {entry.path}")
+    kinds: Dict[str, int] = {}
+    for code in manifest.columns['kind']:
+        kinds[chr(code)] = kinds.get(chr(code), 0) + 1
+    print(f"{len(manifest)} entries ({', '.join(f'{n} {k}' for k, n in sorted(kinds.items()))}) "
+          f"in {elapsed:.2f}s, signature {manifest.signature[:16]}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
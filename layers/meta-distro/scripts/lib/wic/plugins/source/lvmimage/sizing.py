@@ -0,0 +1,324 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Content-driven image sizing
+
+Instead of giving the rootfs LV whatever a fixed --size leaves over, the
+rootfs tree is measured from its lvmimage.scan manifest (blocks each file
+needs at the filesystem block size, directory blocks, long symlinks,
+extended attribute blocks, inodes with hardlinks counted once) and an ext4
+overhead model turns that into the smallest filesystem mke2fs would fit it
+in, plus headroom:
+
+  - block groups of 8 * block size blocks, each with a block and an inode
+    bitmap and its share of the inode table (256-byte inodes)
+  - group descriptors and reserved GDT blocks (online resize) in the
+    sparse_super backup groups 0, 1 and powers of 3, 5 and 7
+  - the journal, sized like ext2fs_default_journal_size()
+  - lost+found and the reserved inodes, 5% root-reserved blocks
+  - the inode count implied by the mke2fs inode_ratio, which must cover
+    the tree's inodes plus the same headroom
+
+mke2fs picks its "small" profile (1 KiB blocks, one inode per 4 KiB) below
+512 MiB and the default one (4 KiB blocks, one inode per 16 KiB) above, so
+both are evaluated unless the block size is fixed. The LV is rounded up to
+whole LVM extents, and the image to the partitions, LUKS2 header, PV
+metadata and GPT around it. With lvm-mounts, the subtrees of the mounted
+LVs are measured for those LVs and left out of the rootfs LV.
+
+Usage: python3 -m lvmimage.sizing ROOTFS [--headroom 20%] [--block-size 4096]
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from lvmimage import luks2, lvm2, scan
+from lvmimage.assemble import compute_partition_layout
+
+MiB = 1024 * 1024
+BLOCK_SIZES = (1024, 4096)
+INODE_SIZE = 256
+DESC_SIZE = 64
+FIRST_INODE = 11
+LOST_AND_FOUND_SIZE = 16 * 1024
+RESERVED_PERCENT = 5
+SMALL_FS_LIMIT = 512 * MiB
+# mke2fs.conf inode_ratio of the "small" and "default" profiles
+INODE_RATIO = {1024: 4096, 4096: 16384}
+# Room for xattrs inside a 256-byte inode (after the 128-byte base inode,
+# the 32-byte extra fields and the in-inode xattr header)
+INLINE_XATTR_SPACE = INODE_SIZE - 128 - 32 - 4
+# Symlink targets shorter than this are stored in the inode
+FAST_SYMLINK_MAX = 60
+DEFAULT_HEADROOM = '20%'
+
+
+@dataclass
+class TreeUsage:
+    """What a rootfs tree needs from an ext4 filesystem"""
+    files: int = 0
+    directories: int = 0
+    symlinks: int = 0
+    specials: int = 0
+    hardlinks: int = 0
+    inodes: int = 0
+    bytes: int = 0
+    xattr_files: int = 0
+    # Filesystem blocks needed for data, directories, long symlinks and
+    # shared xattr blocks, per block size
+    blocks: Dict[int, int] = field(default_factory=lambda: {bs: 0 for bs in BLOCK_SIZES})
+
+
+def _blocks(size: int, block_size: int) -> int:
+    return -(-size // block_size)
+
+
+def _excluded_rows(manifest: scan.Manifest, exclude: Iterable[str]) -> Set[int]:
+    """Rows below the excluded directories (parents precede their children)"""
+    exclude = set(exclude)
+    if not exclude:
+        return set()
+    roots = {index for index, path in enumerate(manifest.paths()) if path in exclude}
+    skipped: Set[int] = set()
+    for index, parent in enumerate(manifest.columns['parent']):
+        if parent in roots or parent in skipped:
+            skipped.add(index)
+    return skipped
+
+
+def measure_tree(root: str, manifest: Optional[scan.Manifest] = None,
+                 exclude: Iterable[str] = ()) -> TreeUsage:
+    """Total what ext4 needs for the tree, from its (cached) scan manifest
+
+    The cached manifest is checked against every file's lstat, so a file
+    grown in place is counted at its new size. The contents of the
+    directories in exclude ('/'-rooted paths, e.g. the mountpoints of other
+    LVs) are not counted; the directories are.
+    """
+    manifest = manifest or scan.scan(root, verify=True)
+    usage = TreeUsage()
+    columns = manifest.columns
+    skipped = _excluded_rows(manifest, exclude)
+    kinds, sizes, allocated_blocks = columns['kind'], columns['size'], columns['blocks']
+    nlinks, devs, inos = columns['nlink'], columns['dev'], columns['ino']
+    parents, name_lengths, xattrs = columns['parent'], columns['name_length'], columns['xattr_size']
+    # Directory blocks from the size of the ext4 dirents (8 bytes plus the
+    # name padded to 4), two of them for "." and ".."
+    dirent_bytes: Dict[int, int] = {}
+    seen = set()
+    shared_xattr_sizes = set()
+    counted = {bs: 0 for bs in BLOCK_SIZES}
+    for index in range(len(manifest)):
+        if skipped and index in skipped:
+            continue
+        kind = chr(kinds[index])
+        parent = parents[index]
+        if parent >= 0:
+            dirent_bytes[parent] = dirent_bytes.get(parent, 24) + 8 + _blocks(name_lengths[index], 4) * 4
+        if kind == 'd':
+            usage.directories += 1
+            usage.inodes += 1
+            dirent_bytes.setdefault(index, 24)
+            continue
+        if nlinks[index] > 1:
+            if (devs[index], inos[index]) in seen:
+                usage.hardlinks += 1
+                continue
+            seen.add((devs[index], inos[index]))
+        usage.inodes += 1
+        if kind == 'f':
+            usage.files += 1
+            usage.bytes += sizes[index]
+            # Sparse files keep their holes with mkfs.ext4 -d
+            allocated = min(sizes[index], allocated_blocks[index] * 512) \
+                if allocated_blocks[index] else sizes[index]
+            for bs in BLOCK_SIZES:
+                counted[bs] += _blocks(allocated, bs)
+        elif kind == 'l':
+            usage.symlinks += 1
+            if sizes[index] >= FAST_SYMLINK_MAX:
+                for bs in BLOCK_SIZES:
+                    counted[bs] += 1
+        else:
+            usage.specials += 1
+        if xattrs[index] > INLINE_XATTR_SPACE:
+            usage.xattr_files += 1
+            # Identical xattr blocks are shared by ext4; count one per size
+            shared_xattr_sizes.add(xattrs[index])
+    for bs in BLOCK_SIZES:
+        counted[bs] += sum(max(1, _blocks(size, bs)) for size in dirent_bytes.values())
+        counted[bs] += sum(_blocks(size, bs) for size in shared_xattr_sizes)
+    usage.blocks = counted
+    return usage
+
+
+def parse_headroom(value: str) -> Tuple[float, int]:
+    """'20%' -> (0.20, 0), '512M' -> (0.0, 512 MiB)"""
+    value = (value or DEFAULT_HEADROOM).strip()
+    if value.endswith('%'):
+        return float(value[:-1]) / 100, 0
+    units = {'K': 1024, 'M': MiB, 'G': 1024 * MiB}
+    if value[-1].upper() in units:
+        return 0.0, int(float(value[:-1]) * units[value[-1].upper()])
+    return 0.0, int(value) * MiB
+
+
+def _journal_blocks(blocks: int) -> int:
+    """Journal size mke2fs picks (ext2fs_default_journal_size), in blocks"""
+    if blocks < 2048:
+        return 0
+    if blocks < 32768:
+        journal = 1024
+    elif blocks < 256 * 1024:
+        journal = 4096
+    elif blocks < 512 * 1024:
+        journal = 8192
+    elif blocks < 4096 * 1024:
+        journal = 16384
+    elif blocks < 8192 * 1024:
+        journal = 32768
+    elif blocks < 16384 * 1024:
+        journal = 65536
+    elif blocks < 32768 * 1024:
+        journal = 131072
+    else:
+        journal = 262144
+    return journal
+
+
+def _backup_groups(groups: int) -> int:
+    """Groups holding a superblock and GDT copy with sparse_super"""
+    count = min(groups, 2)
+    for base in (3, 5, 7):
+        power = base
+        while power < groups:
+            count += 1
+            power *= base
+    return count
+
+
+def ext4_overhead(blocks: int, block_size: int, inodes: int) -> int:
+    """Metadata blocks of an ext4 filesystem of `blocks` blocks and `inodes` inodes"""
+    per_group = 8 * block_size
+    groups = _blocks(blocks, per_group)
+    inode_table = _blocks(_blocks(inodes, groups) * INODE_SIZE, block_size) * groups
+    gdt = _blocks(groups * DESC_SIZE, block_size)
+    # Reserved GDT blocks: room to grow the filesystem 1024 times
+    reserved_gdt = min(block_size // 4,
+                       max(0, _blocks(_blocks(min(blocks * 1024, 2 ** 32), per_group) * DESC_SIZE,
+                                      block_size) - gdt))
+    superblocks = _backup_groups(groups) * (1 + gdt + reserved_gdt)
+    return (superblocks + 2 * groups + inode_table + _journal_blocks(blocks)
+            + _blocks(LOST_AND_FOUND_SIZE, block_size) + (1 if block_size == 1024 else 0))
+
+
+def ext4_size(usage: TreeUsage, headroom: str = DEFAULT_HEADROOM,
+              block_size: Optional[int] = None) -> int:
+    """Smallest ext4 filesystem size in bytes that holds the tree with headroom
+
+    Without block_size the mke2fs profile is chosen by the resulting
+    size, as mke2fs itself does.
+    """
+    if block_size is None:
+        small = ext4_size(usage, headroom, 1024)
+        if small < SMALL_FS_LIMIT:
+            return small
+        return max(ext4_size(usage, headroom, 4096), SMALL_FS_LIMIT)
+    if block_size not in usage.blocks:
+        raise Exception(f"Unsupported ext4 block size: {block_size}")
+
+    ratio, extra = parse_headroom(headroom)
+    used = usage.blocks[block_size]
+    free = int(used * ratio) + _blocks(extra, block_size)
+    inodes = int((usage.inodes + FIRST_INODE) * (1 + ratio)) + 1
+    inode_ratio = INODE_RATIO[block_size]
+    # The overhead grows with the size; iterate to the fixed point
+    blocks = used + free
+    for _ in range(32):
+        inodes_fs = max(inodes, blocks * block_size // inode_ratio)
+        needed = used + free + ext4_overhead(blocks, block_size, inodes_fs)
+        needed = max(_blocks(needed * 100, 100 - RESERVED_PERCENT),
+                     _blocks(inodes * inode_ratio, block_size))
+        if needed <= blocks:
+            break
+        blocks = needed
+    return blocks * block_size
+
+
+@dataclass
+class ImageSize:
+    """Sizes derived from the rootfs content"""
+    rootfs_lv_mb: int
+    total_size_mb: int
+    filesystem_bytes: int
+    pv_bytes: int
+
+
+def plan_image_size(config, usage: TreeUsage, efi_size_mb: int, boot_size_mb: int,
+                    luks_header: bool, headroom: str = DEFAULT_HEADROOM,
+                    relative_lv_mb: int = 256, block_size: Optional[int] = None,
+                    lv_usage: Optional[Dict[str, TreeUsage]] = None) -> ImageSize:
+    """Smallest image whose rootfs LV fits the measured tree
+
+    Fixed-size LVs keep their size and every relatively sized LV
+    (e.g. varfs:100%FREE) is given relative_lv_mb, or what its own tree in
+    lv_usage needs (lvm-mounts) when that is more. luks_header adds the
+    LUKS2 header in front of the PV.
+    """
+    fs_bytes = ext4_size(usage, headroom, block_size)
+    rootfs_extents = _blocks(fs_bytes, lvm2.EXTENT_SIZE)
+    other_extents = 0
+    for lv in config.additional_lvs:
+        size = lv.size_mb * MiB if lv.size_mb else relative_lv_mb * MiB
+        if lv.name in (lv_usage or {}):
+            needed = ext4_size(lv_usage[lv.name], headroom, block_size)
+            if lv.size_mb and needed > size:
+                raise Exception(f"LV {lv.name} ({lv.size_mb}MB) is too small for its "
+                                f"{needed // MiB}MB of content")
+            size = max(size, needed)
+        other_extents += max(1, _blocks(size, lvm2.EXTENT_SIZE))
+    pv_bytes = lvm2.PE_START + (rootfs_extents + other_extents) * lvm2.EXTENT_SIZE
+
+    # Grow from a lower bound until partition 3 carries the PV
+    total_mb = efi_size_mb + boot_size_mb + _blocks(pv_bytes, MiB) + 2
+    if luks_header:
+        total_mb += luks2.DATA_OFFSET // MiB
+    while True:
+        crypt = compute_partition_layout(total_mb, efi_size_mb, boot_size_mb).crypt.size
+        if (luks2.payload_size(crypt) if luks_header else crypt) >= pv_bytes:
+            break
+        total_mb += 1
+    return ImageSize(rootfs_extents * lvm2.EXTENT_SIZE // MiB, total_mb, fs_bytes, pv_bytes)
+
+
+def main(argv=None) -> int:
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Measure a rootfs tree and size its ext4 filesystem")
+    parser.add_argument('rootfs')
+    parser.add_argument('--headroom', default=DEFAULT_HEADROOM)
+    parser.add_argument('--block-size', type=int, choices=BLOCK_SIZES, default=None)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    usage = measure_tree(args.rootfs)
+    elapsed = time.perf_counter() - start
+    print(f"{usage.files} files, {usage.directories} directories, {usage.symlinks} symlinks, "
+          f"{usage.specials} other, {usage.hardlinks} extra hardlinks, "
+          f"{usage.xattr_files} with xattr blocks ({elapsed:.2f}s)")
+    print(f"{usage.inodes} inodes, {usage.bytes // MiB}MB of file data")
+    for bs in BLOCK_SIZES:
+        print(f"  {bs}-byte blocks: {usage.blocks[bs] * bs // MiB}MB used")
+    size = ext4_size(usage, args.headroom, args.block_size)
+    print(f"ext4 with {args.headroom} headroom: {size // MiB}MB "
+          f"({_blocks(size, lvm2.EXTENT_SIZE)} LVM extents)")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,107 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Hole-preserving file copy helpers
+
+Filesystem images built with mkfs are mostly holes. These helpers walk the
+allocated ranges of a file with SEEK_DATA/SEEK_HOLE and copy only those,
+using copy_file_range() so the data never passes through Python buffers.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+from typing import Iterator, Tuple
+
+COPY_CHUNK = 64 * 1024 * 1024
+
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+
+def iter_data_ranges(fd: int, size: int) -> Iterator[Tuple[int, int]]:
+    """Yield (offset, length) for every allocated range of an open file
+
+    Falls back to a single range covering the whole file when the filesystem
+    does not support SEEK_DATA/SEEK_HOLE.
+    """
+    pos = 0
+    while pos < size:
+        try:
+            data = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                return
+            if e.errno == errno.EINVAL:
+                yield pos, size - pos
+                return
+            raise
+        hole = os.lseek(fd, data, os.SEEK_HOLE)
+        yield data, min(hole, size) - data
+        pos = hole
+
+
+def _copy_range(src_fd: int, dst_fd: int, src_off: int, dst_off: int, length: int):
+    """Copy one range, preferring copy_file_range() over read/write"""
+    while length > 0:
+        chunk = min(length, COPY_CHUNK)
+        try:
+            copied = os.copy_file_range(src_fd, dst_fd, chunk, src_off, dst_off)
+        except (AttributeError, OSError):
+            data = os.pread(src_fd, chunk, src_off)
+            copied = os.pwrite(dst_fd, data, dst_off)
+        if copied <= 0:
+            raise Exception(f"Short copy at source offset {src_off}")
+        src_off += copied
+        dst_off += copied
+        length -= copied
+
+
+def splice_file(src_path: str, dst_path: str, dst_offset: int) -> int:
+    """Copy the allocated ranges of src_path into dst_path at dst_offset
+
+    Holes in the source are skipped, so the corresponding range of the
+    destination keeps whatever it held (zeroes for a fresh sparse image).
+
+    Returns:
+        Number of bytes actually copied
+    """
+    copied = 0
+    src_fd = os.open(src_path, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst_path, os.O_WRONLY)
+        try:
+            size = os.fstat(src_fd).st_size
+            for offset, length in iter_data_ranges(src_fd, size):
+                _copy_range(src_fd, dst_fd, offset, dst_offset + offset, length)
+                copied += length
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    return copied
+
+
+def punch_hole(path: str, offset: int, length: int):
+    """Deallocate a byte range of a file so it reads back as zeroes
+
+    Uses fallocate(FALLOC_FL_PUNCH_HOLE) and falls back to writing zeroes
+    where the filesystem does not support it.
+    """
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        if libc.fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) == 0:
+            return
+        zeroes = bytes(min(length, COPY_CHUNK))
+        end = offset + length
+        while offset < end:
+            offset += os.pwrite(fd, zeroes[:end - offset], offset)
+    finally:
+        os.close(fd)
@@ -0,0 +1,243 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Per-phase tracing and metrics
+
+Spans record wall time, CPU time (the calling thread plus reaped child
+processes), bytes newly allocated in the disk image and, for subprocesses,
+the exit status. A finished trace is written next to the image as
+IMAGE.trace.json (Chrome trace-event format, open in chrome://tracing or
+https://ui.perfetto.dev) and IMAGE.trace.txt (summary table per span name).
+
+Child CPU time comes from getrusage(RUSAGE_CHILDREN), which is process wide,
+so it is only exact for spans that do not overlap other subprocesses.
+
+The generated create-lvm script records its stages as tab-separated lines
+and converts them with: python3 -m lvmimage.trace script EVENTS IMAGE
+"""
+
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+TRACE_SUFFIX = '.trace.json'
+SUMMARY_SUFFIX = '.trace.txt'
+
+
+def _allocated_bytes(path: Optional[str]) -> int:
+    """Bytes allocated on disk for path (0 if it does not exist)"""
+    if not path:
+        return 0
+    try:
+        return os.stat(path).st_blocks * 512
+    except OSError:
+        return 0
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@dataclass
+class Span:
+    """One finished span"""
+    name: str
+    cat: str
+    start: float
+    wall: float
+    cpu: float
+    image_bytes: int
+    tid: int
+    args: Dict = field(default_factory=dict)
+
+    @property
+    def failed(self) -> bool:
+        return bool(self.args.get('error')) or self.args.get('exit_status', 0) != 0
+
+
+class Tracer:
+    """Collects spans from any thread; image_path enables byte accounting"""
+
+    def __init__(self, image_path: Optional[str] = None):
+        self.image_path = image_path
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        self.counters: List[Tuple[float, int]] = []
+        self._lock = threading.Lock()
+        self._tids: Dict[int, int] = {}
+
+    def _tid(self) -> int:
+        ident = threading.get_ident()
+        with self._lock:
+            return self._tids.setdefault(ident, len(self._tids) + 1)
+
+    @contextmanager
+    def span(self, name: str, cat: str = 'phase', **args) -> Iterator[Dict]:
+        """Trace a block; the yielded dict is stored as the span's args"""
+        start = time.perf_counter()
+        cpu = time.thread_time() + _children_cpu()
+        allocated = _allocated_bytes(self.image_path)
+        try:
+            yield args
+        except BaseException as e:
+            args.setdefault('error', str(e).splitlines()[0] if str(e) else type(e).__name__)
+            raise
+        finally:
+            end = time.perf_counter()
+            now_allocated = _allocated_bytes(self.image_path)
+            span = Span(name, cat, start - self.origin, end - start,
+                        time.thread_time() + _children_cpu() - cpu,
+                        now_allocated - allocated, self._tid(), args)
+            with self._lock:
+                self.spans.append(span)
+                if self.image_path:
+                    self.counters.append((end - self.origin, now_allocated))
+
+    def command(self, cmd: List[str]):
+        """Span for one subprocess; set args['exit_status'] inside it"""
+        return self.span(os.path.basename(cmd[0]) if cmd else '?', 'cmd', argv=' '.join(cmd))
+
+    def chrome_trace(self) -> Dict:
+        """Trace-event JSON: complete events per span, a counter for image bytes"""
+        pid = os.getpid()
+        events = []
+        for s in self.spans:
+            events.append({
+                'name': s.name, 'cat': s.cat, 'ph': 'X', 'pid': pid, 'tid': s.tid,
+                'ts': round(s.start * 1e6, 1), 'dur': round(s.wall * 1e6, 1),
+                'args': dict(s.args, cpu_ms=round(s.cpu * 1000, 1), image_bytes=s.image_bytes),
+            })
+        for ts, allocated in sorted(self.counters):
+            events.append({'name': 'image allocated', 'ph': 'C', 'pid': pid,
+                           'ts': round(ts * 1e6, 1), 'args': {'bytes': allocated}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'image': self.image_path or ''}}
+
+    def summary(self) -> str:
+        """Table aggregated by category and name, slowest first"""
+        rows: Dict[Tuple[str, str], List] = {}
+        for s in self.spans:
+            row = rows.setdefault((s.cat, s.name), [0, 0.0, 0.0, 0, 0])
+            row[0] += 1
+            row[1] += s.wall
+            row[2] += s.cpu
+            row[3] += s.image_bytes
+            row[4] += s.failed
+        width = max([len(name) for _, name in rows] + [4])
+        lines = [f"{'cat':<6} {'name':<{width}} {'count':>5} {'wall':>9} {'cpu':>9} "
+                 f"{'image MB':>9} {'failed':>6}"]
+        for (cat, name), (count, wall, cpu, written, failed) in sorted(
+                rows.items(), key=lambda kv: -kv[1][1]):
+            lines.append(f"{cat:<6} {name:<{width}} {count:>5} {wall:>8.2f}s {cpu:>8.2f}s "
+                         f"{written / (1024 * 1024):>9.1f} {failed:>6}")
+        total = max((s.start + s.wall for s in self.spans), default=0.0)
+        commands = sum(1 for s in self.spans if s.cat == 'cmd')
+        lines.append(f"total {total:.2f}s wall, {commands} subprocesses, "
+                     f"{_allocated_bytes(self.image_path) // (1024 * 1024)}MB allocated in image")
+        return '\n'.join(lines)
+
+    def write(self, image_path: Optional[str] = None) -> Tuple[str, str]:
+        """Write IMAGE.trace.json and IMAGE.trace.txt, returning both paths"""
+        base = image_path or self.image_path
+        if not base:
+            raise Exception("No image path to write the trace next to")
+        trace_path = base + TRACE_SUFFIX
+        summary_path = base + SUMMARY_SUFFIX
+        with open(trace_path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        with open(summary_path, 'w') as f:
+            f.write(self.summary() + '\n')
+        return trace_path, summary_path
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def start(image_path: Optional[str] = None) -> Tracer:
+    """Begin a new trace, replacing the current one"""
+    global _tracer
+    _tracer = Tracer(image_path)
+    return _tracer
+
+
+def span(name: str, cat: str = 'phase', **args):
+    return _tracer.span(name, cat, **args)
+
+
+def traced(name: Optional[str] = None, cat: str = 'phase'):
+    """Decorator tracing every call of a function as one span"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _tracer.span(name or func.__name__.lstrip('_'), cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def load_script_events(events_path: str, image_path: str) -> Tracer:
+    """Build a Tracer from the stage records of the generated script
+
+    Each line is: kind name start_ns end_ns exit_status allocated_before
+    allocated_after child_cpu_before child_cpu_after (CPU in seconds).
+    """
+    tracer = Tracer(image_path)
+    records = []
+    with open(events_path) as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) == 9:
+                records.append(parts)
+    origin = min((int(r[2]) for r in records), default=0)
+    tids: Dict[str, int] = {}
+    for kind, name, start, end, status, alloc0, alloc1, cpu0, cpu1 in records:
+        tid = 1 if kind == 'phase' else tids.setdefault(name, len(tids) + 2)
+        args = {'exit_status': int(status)} if kind != 'phase' or int(status) else {}
+        tracer.spans.append(Span(name, kind, (int(start) - origin) / 1e9,
+                                 (int(end) - int(start)) / 1e9,
+                                 max(float(cpu1) - float(cpu0), 0.0),
+                                 int(alloc1) - int(alloc0), tid, args))
+        tracer.counters.append(((int(end) - origin) / 1e9, int(alloc1)))
+    return tracer
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert and summarize lvmrootfs traces")
+    sub = parser.add_subparsers(dest='command', required=True)
+    script = sub.add_parser('script', help="convert the stage records of create-lvm-*.sh")
+    script.add_argument('events')
+    script.add_argument('image')
+    show = sub.add_parser('summary', help="print the summary table of an IMAGE.trace.txt")
+    show.add_argument('image')
+    args = parser.parse_args(argv)
+
+    if args.command == 'script':
+        tracer = load_script_events(args.events, args.image)
+        trace_path, summary_path = tracer.write(args.image)
+        print(tracer.summary())
+        print(f"Trace: {trace_path}")
+    else:
+        with open(args.image + SUMMARY_SUFFIX) as f:
+            print(f.read(), end='')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,233 @@
+#
+# Copyright (c) 2026 DISTRO Project
+#
+# SPDX-License-Identifier: MIT
+#
+
+"""
+Seekable zstd image writer
+
+Compresses a sparse disk image into IMAGE.zst in the zstd seekable format
+(contrib/seekable_format of the zstd sources): a sequence of independent
+zstd frames of FRAME_SIZE uncompressed bytes each, followed by a skippable
+frame holding the seek table. `zstd -d` decompresses it like any other
+.zst; tools that read the seek table can decompress and write any region,
+or all frames in parallel.
+
+Frames are compressed on a thread pool (zstd releases the GIL). Frames that
+lie entirely in a hole of the image are never read: they are emitted as a
+pre-compressed all-zero frame, so a mostly empty multi-GB image costs a few
+bytes per hole frame. The allocated data was just written by the assembly
+and is still in the page cache, so this pass replaces the separate read
+and write of a later `zstd IMAGE` run.
+
+Needs the python3 'zstandard' module.
+
+Usage: python3 -m lvmimage.zstdseek compress IMAGE [-o IMAGE.zst] [--level N] [--jobs N]
+       python3 -m lvmimage.zstdseek extract IMAGE.zst OUTPUT [--jobs N]
+"""
+
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from lvmimage.sparse import iter_data_ranges
+
+ZST_SUFFIX = '.zst'
+FRAME_SIZE = 4 * 1024 * 1024
+DEFAULT_LEVEL = 3
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+_ENTRY = struct.Struct('<II')
+_FOOTER = struct.Struct('<IBI')
+# Frames in flight per worker: bounds memory to jobs * 2 * FRAME_SIZE
+_WINDOW = 2
+
+
+def _zstd():
+    """Import zstandard, which is an optional dependency"""
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("Seekable zstd output requires the python3 'zstandard' module "
+                        "(python3-zstandard-native in WKS_FILE_DEPENDS)")
+    return zstandard
+
+
+def _data_frames(fd: int, size: int, frame_size: int) -> set:
+    """Indexes of the frames that overlap allocated data"""
+    frames = set()
+    for offset, length in iter_data_ranges(fd, size):
+        frames.update(range(offset // frame_size, (offset + length - 1) // frame_size + 1))
+    return frames
+
+
+def compress_image(image_path: str, output_path: Optional[str] = None,
+                   level: int = DEFAULT_LEVEL, jobs: Optional[int] = None,
+                   frame_size: int = FRAME_SIZE) -> Dict:
+    """Write image_path as a seekable zstd file
+
+    Returns:
+        Dict with the output path, image size, compressed size and the
+        number of frames and of zero (hole) frames
+    """
+    zstandard = _zstd()
+    output_path = output_path or image_path + ZST_SUFFIX
+    jobs = jobs or os.cpu_count() or 1
+    local = threading.local()
+
+    def compressor():
+        if not hasattr(local, 'cctx'):
+            local.cctx = zstandard.ZstdCompressor(level=level, write_content_size=True)
+        return local.cctx
+
+    zero_frames: Dict[int, bytes] = {}
+
+    def zero_frame(length: int) -> bytes:
+        if length not in zero_frames:
+            zero_frames[length] = compressor().compress(bytes(length))
+        return zero_frames[length]
+
+    fd = os.open(image_path, os.O_RDONLY)
+    partial = f"{output_path}.partial-{os.getpid()}"
+    try:
+        size = os.fstat(fd).st_size
+        count = -(-size // frame_size)
+        with_data = _data_frames(fd, size, frame_size)
+
+        def frame(index: int) -> Tuple[bytes, int]:
+            offset = index * frame_size
+            length = min(frame_size, size - offset)
+            if index not in with_data:
+                return zero_frame(length), length
+            data = os.pread(fd, length, offset)
+            if len(data) != length:
+                raise Exception(f"Short read at offset {offset}")
+            return compressor().compress(data), length
+
+        entries: List[Tuple[int, int]] = []
+        with open(partial, 'wb') as out, ThreadPoolExecutor(max_workers=jobs) as pool:
+            # Submit ahead by a bounded window and write frames in order
+            pending = []
+            next_index = 0
+            while next_index < count or pending:
+                while next_index < count and len(pending) < jobs * _WINDOW:
+                    pending.append(pool.submit(frame, next_index))
+                    next_index += 1
+                compressed, length = pending.pop(0).result()
+                out.write(compressed)
+                entries.append((len(compressed), length))
+            table = b''.join(_ENTRY.pack(c, d) for c, d in entries)
+            table += _FOOTER.pack(len(entries), 0, SEEKABLE_MAGIC)
+            out.write(struct.pack('<II', SKIPPABLE_MAGIC, len(table)) + table)
+        os.rename(partial, output_path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.unlink(partial)
+        raise
+    finally:
+        os.close(fd)
+
+    return {
+        'path': output_path,
+        'image_size': size,
+        'compressed_size': os.path.getsize(output_path),
+        'frames': count,
+        'zero_frames': count - len(with_data),
+    }
+
+
+def read_seek_table(path: str) -> List[Tuple[int, int, int, int]]:
+    """Frames of a seekable zstd file
+
+    Returns:
+        (compressed offset, compressed size, decompressed offset,
+        decompressed size) per frame
+    """
+    with open(path, 'rb') as f:
+        f.seek(-_FOOTER.size, os.SEEK_END)
+        frames, descriptor, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != SEEKABLE_MAGIC:
+            raise Exception(f"{path} is not a seekable zstd file")
+        entry_size = _ENTRY.size + (4 if descriptor & 0x80 else 0)
+        f.seek(-(_FOOTER.size + frames * entry_size), os.SEEK_END)
+        raw = f.read(frames * entry_size)
+    table = []
+    compressed = decompressed = 0
+    for index in range(frames):
+        c_size, d_size = _ENTRY.unpack_from(raw, index * entry_size)
+        table.append((compressed, c_size, decompressed, d_size))
+        compressed += c_size
+        decompressed += d_size
+    return table
+
+
+def extract_image(path: str, output_path: str, jobs: Optional[int] = None) -> int:
+    """Decompress all frames in parallel into output_path
+
+    A regular output file is created sparse: all-zero frames are not
+    written. A block device gets every frame.
+
+    Returns:
+        Number of bytes written
+    """
+    zstandard = _zstd()
+    table = read_seek_table(path)
+    total = sum(entry[3] for entry in table)
+    sparse = not os.path.exists(output_path) or os.path.isfile(output_path)
+    if sparse:
+        with open(output_path, 'wb') as f:
+            f.truncate(total)
+    src = os.open(path, os.O_RDONLY)
+    dst = os.open(output_path, os.O_WRONLY)
+
+    def frame(entry) -> int:
+        c_offset, c_size, d_offset, d_size = entry
+        data = zstandard.ZstdDecompressor().decompress(os.pread(src, c_size, c_offset),
+                                                       max_output_size=d_size)
+        if len(data) != d_size:
+            raise Exception(f"Frame at {d_offset} decompressed to {len(data)} bytes, expected {d_size}")
+        if sparse and data.count(0) == d_size:
+            return 0
+        os.pwrite(dst, data, d_offset)
+        return d_size
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+            return sum(pool.map(frame, table))
+    finally:
+        os.close(src)
+        os.close(dst)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Seekable zstd disk image writer")
+    sub = parser.add_subparsers(dest='command', required=True)
+    comp = sub.add_parser('compress')
+    comp.add_argument('image')
+    comp.add_argument('-o', '--output', default=None)
+    comp.add_argument('--level', type=int, default=DEFAULT_LEVEL)
+    comp.add_argument('--jobs', type=int, default=None)
+    ext = sub.add_parser('extract')
+    ext.add_argument('archive')
+    ext.add_argument('output')
+    ext.add_argument('--jobs', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == 'compress':
+        result = compress_image(args.image, args.output, args.level, args.jobs)
+        print(f"{result['path']}: {result['compressed_size'] // (1024 * 1024)}MB from "
+              f"{result['image_size'] // (1024 * 1024)}MB, {result['frames']} frames "
+              f"({result['zero_frames']} holes)")
+    else:
+        written = extract_image(args.archive, args.output, args.jobs)
+        print(f"{args.output}: {written // (1024 * 1024)}MB written")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -19,85 +19,81 @@ GPT Partition Table:
        ├─ Additional Logical Volumes (optional)
        └─ varfs Logical Volume (optional, ext4, /var content)       
 
-Execution Sequence (exactly as per reference script):
-=====================================================
+Script Execution Sequence (lvm-assembly=script):
+================================================
 Phase 1: Create sparse disk image file with dd
-Phase 2: Attach loop device WITHOUT --partscan (first attachment)
-Phase 3: Zap and create GPT partition table with sgdisk
-Phase 4: Detach loop device (force kernel to sync partition table)
-Phase 5: Re-attach loop device WITH --partscan (creates /dev/loop0p1, p2, p3)
+Phase 2: (none - the partition table no longer needs a loop device)
+Phase 3: Copy the GPT the plugin built (lvmimage.gpt) into the image file with dd
+Phase 4: (none - no detach/re-attach round trip to sync the partition table)
+Phase 5: Attach loop device WITH partscan via /dev/loop-control (creates /dev/loop0p1, p2, p3)
 Phase 6: Format EFI partition (mkfs.vfat)
 Phase 7: Format XBOOTLDR partition (mkfs.ext4)
 Phase 8: Format and open LUKS on partition 3
-Phase 9: Create LVM volume group and logical volumes
-Phase 10: Create logical volumes (rootfs + additional volumes)
+Phase 9: Create the PV, VG and LVs inside LUKS in one lvm shell session (lvmimage.lvmshell)
+Phase 10: Format the logical volumes (mkfs.ext4)
 Phase 11: Mount all filesystems and populate with rootfs content
 Phase 12: Unmount all filesystems, close LUKS, deactivate LVM, detach loop
 Phase 13: Summary and artifact verification (bonus)
 
+Phases 6 and 7 run in the background alongside 8-9, and the per-LV mkfs
+steps of phase 10 run concurrently; the script waits for all of them before
+phase 11 and prints per-step timings.
+
+Offset Assembly Mode (lvm-assembly=offset):
+===========================================
+Builds the same layout in-process as a regular file, without loop devices,
+device-mapper, mounts or sudo. Each filesystem is created at its computed byte
+offset in the image (mkfs.ext4 -E offset=, mkfs.ext4 -d for the rootfs LV) or
+built standalone and spliced in (mkfs.vfat + mcopy for the ESP), and the LVM2
+metadata is written directly. With LUKS enabled the PV is built in plaintext at
+the LUKS2 data offset, then the LUKS2 header is written and the payload is
+encrypted in place by a pool of worker processes (lvmimage/luks2.py, needs the
+python3 cryptography module). The independent steps are scheduled by
+lvmimage.plan.ExecutionPlan, which logs a per-step timing report with the
+critical path. See lvmimage/assemble.py.
+
+With lvm-incremental=1 a content manifest is kept next to the image, and when
+the layout is unchanged only the rootfs differences are written into the
+existing image with debugfs (lvmimage/incremental.py). The generated script
+does the same with INCREMENTAL=1: a previous image with a matching layout
+stamp is reused and the rootfs is synced into it with rsync --delete.
+
+With lvm-mounts=varfs:/var the varfs LV is populated from the /var subtree
+of the rootfs, which the rootfs LV then leaves out except for the directory
+itself (lvmimage/mounts.py); the script syncs each such LV with rsync. A
+subtree the image emptied is taken from its /usr/share/factory copy.
+
+Both modes journal their progress next to the image (lvmimage/journal.py). A
+build that fails keeps its partial image, and the next one releases what a
+killed run still holds (mounts, VG, LUKS mapping, loop device) and resumes
+after the last finished step. lvm-resume=0 (RESUME=0 for the script) always
+starts over.
+
 Host Prerequisites:
 ===================
-This plugin requires NO user account escalation during normal WIC execution, BUT requires
-PRIOR SUDO CONFIGURATION for the build user to run storage commands without password prompts.
+The plugin itself never escalates privileges: in lvm-assembly=offset mode
+the whole image is built by the build user with mkfs.ext4, mkfs.vfat, mcopy
+and debugfs (plus the python3 cryptography module when LUKS is enabled).
+
+In lvm-assembly=script mode the plugin only writes create-lvm-<vg>.sh, and
+that script is run as a whole as root after the build:
+
+   sudo ./create-lvm-<vg>.sh <rootfs_dir> <output_wic_path>
 
-Setup (one-time, requires sudo access):
-1. Add user to disk group:
-   sudo usermod -a -G disk $USER
+As root it runs dd (into the image file), flock, cryptsetup, lvm,
+mkfs.vfat, mkfs.ext4, mount, umount and rsync on the image's loop device,
+LUKS mapping and LVs, and the lvmimage helpers (python3 -m lvmimage.trace,
+devwait, looplease, journal, lvmshell, bmap, zstdseek) from the plugin
+directory. Granting it through sudoers therefore means granting the script
+itself, from a root-owned copy so the build user cannot rewrite it:
 
-2. Configure sudoers for passwordless storage commands:
-   sudo visudo -f /etc/sudoers.d/storage
-   
-   Add these lines (replace USERNAME with actual username):
    -------
-   # lvmrootfs.py storage commands with minimal arguments
-   Cmnd_Alias LVM_CMDS = \
-       /usr/sbin/lvm pvcreate --nolocking -ff -y /dev/loop*, \
-       /usr/sbin/lvm vgcreate --nolocking * /dev/loop*, \
-       /usr/sbin/lvm lvcreate --nolocking -L * -n * *, \
-       /usr/sbin/lvm lvcreate --nolocking -l * -n * *, \
-       /usr/sbin/lvm lvchange --nolocking -an /dev/*/*, \
-       /usr/sbin/lvm vgchange --nolocking -an *, \
-       /usr/sbin/lvm vgchange --nolocking -an -P *, \
-       /usr/sbin/lvm vgremove --nolocking -ff -y *
-   
-   Cmnd_Alias CRYPT_CMDS = \
-       /usr/sbin/cryptsetup -q luksFormat --type * /dev/loop*, \
-       /usr/sbin/cryptsetup open /dev/loop* *, \
-       /usr/sbin/cryptsetup close /dev/mapper/*
-   
-   Cmnd_Alias LOOP_CMDS = \
-       /usr/sbin/losetup --find --show /tmp/*, \
-       /usr/sbin/losetup --find --show --partscan /tmp/*, \
-       /usr/sbin/losetup --detach /dev/loop*
-   
-   Cmnd_Alias PART_CMDS = \
-       /usr/sbin/sgdisk --zap-all /dev/loop*, \
-       /usr/sbin/sgdisk --new=* --typecode=* --change-name=* /dev/loop*
-   
-   Cmnd_Alias FS_CMDS = \
-       /usr/sbin/mkfs.vfat -F 32 /dev/loop*p*, \
-       /usr/sbin/mkfs.ext4 -F /dev/loop*p*, \
-       /usr/sbin/mkfs.ext4 -F /dev/mapper/*
-   
-   Cmnd_Alias MOUNT_CMDS = \
-       /usr/bin/mount -t vfat -o * /dev/loop*p* /tmp/*, \
-       /usr/bin/mount -t ext4 /dev/loop*p* /tmp/*, \
-       /usr/bin/mount /dev/mapper/* /tmp/*, \
-       /usr/bin/umount /tmp/*/system/boot/efi, \
-       /usr/bin/umount /tmp/*/system/boot, \
-       /usr/bin/umount /tmp/*/system, \
-       /usr/bin/umount /tmp/*
-   
-   Cmnd_Alias DD_CMDS = \
-       /usr/bin/dd if=/dev/zero of=/tmp/* bs=1M count=0 seek=*
-   
-   USERNAME ALL=(root) NOPASSWD: LVM_CMDS, CRYPT_CMDS, LOOP_CMDS, PART_CMDS, FS_CMDS, MOUNT_CMDS, DD_CMDS
+   USERNAME ALL=(root) NOPASSWD: /usr/local/sbin/create-lvm-*.sh
    -------
 
-3. Verify sudo works without password:
-   sudo losetup --version
-   sudo lvm version
-   sudo cryptsetup --version
+Per-command sudoers rules do not help here: the script's arguments include
+build-specific loop, mapper and VG names, and a rule broad enough to match
+them (dd of=*, mkfs.ext4 -F *, mount *) is equivalent to full root.
 """
 
 import os
@@ -108,9 +104,21 @@ import subprocess
 import json
 import shutil
 from dataclasses import dataclass, field
-from typing import Optional, Dict, List, Tuple
+from typing import Callable, Optional, Dict, List, Tuple
 from enum import Enum
 
+# WIC imports plugins by file path, so make the lvmimage helper package that
+# lives next to this file importable
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lvmimage import gpt, journal, luks2, lvm2, mounts, pbkdf, sizing, trace
+from lvmimage.assemble import ByteRange, assemble_disk_image, compute_partition_layout, rebuild_efi_partition
+from lvmimage.bmap import write_bmap
+from lvmimage.incremental import (adopt_previous_uuids, discard_manifest, layout_fingerprint,
+                                  update_image, write_manifest)
+from lvmimage.plan import ExecutionPlan
+from lvmimage.zstdseek import compress_image
+
 # Logging setup
 logging.basicConfig(
     level=logging.DEBUG,
@@ -122,6 +130,11 @@ logger = logging.getLogger(os.path.basename(__file__))
 # Suppress excessive LVM warnings
 os.environ['LVM_SUPPRESS_FD_WARNINGS'] = '1'
 
+# Command backend: when set, _run_cmd hands every command to it as
+# backend(cmd, check=, capture=, sudo=) instead of executing it.
+# Used by the recording fake of the lvmimage.bench benchmark suite.
+COMMAND_BACKEND: Optional[Callable] = None
+
 
 # ============================================================================
 # Data Models
@@ -162,27 +175,31 @@ class DiskConfig:
     additional_lvs: List[LogicalVolumeSpec] = field(default_factory=list)
     mount_points: List[MountPointSpec] = field(default_factory=list)
     luks_enabled: bool = True
+    luks_pbkdf: pbkdf.PbkdfProfile = field(default_factory=pbkdf.PbkdfProfile)
 
-    def calculate_rootfs_lv_size(self, crypt_partition_size_mb: int) -> int:
-        """Calculate rootfs LV size given LUKS partition size"""
-        # Sum fixed-size LVs
-        fixed_size = sum(lv.size_mb for lv in self.additional_lvs if lv.size_mb)
-        # Reserve 4MB for LVM metadata
-        rootfs_size = crypt_partition_size_mb - fixed_size - 4
-        if rootfs_size <= 0:
-            raise Exception(f"Insufficient space: crypt_partition={crypt_partition_size_mb}MB, fixed_lvs={fixed_size}MB")
-        return rootfs_size
-
-
-@dataclass
-class ExecutionPlan:
-    """Execution plan with ordered steps and state tracking"""
-    steps: List[Tuple] = field(default_factory=list)
-    state: Dict = field(default_factory=dict)
+    def calculate_rootfs_lv_size(self, crypt_partition_size_mb: int,
+                                 reserved: Optional[Dict[str, int]] = None) -> int:
+        """Calculate rootfs LV size given the size of the LVM physical volume
 
-    def add_step(self, name: str, func, args: List = None, kwargs: Dict = None):
-        """Queue an execution step"""
-        self.steps.append((name, func, args or [], kwargs or {}))
+        Uses the extent geometry lvm allocates with (metadata area up to
+        pe_start, whole extents, fixed LVs rounded up) and leaves one extent
+        for every relatively sized LV such as varfs:100%FREE, or the bytes
+        given for it in reserved (the content of an lvm-mounts subtree).
+        """
+        mib = 1024 * 1024
+        reserved = reserved or {}
+        pe_count = (crypt_partition_size_mb * mib - lvm2.PE_START) // lvm2.EXTENT_SIZE
+        fixed_extents = sum(-(-lv.size_mb * mib // lvm2.EXTENT_SIZE)
+                            for lv in self.additional_lvs if lv.size_mb)
+        relative_extents = sum(max(1, -(-reserved.get(lv.name, 0) // lvm2.EXTENT_SIZE))
+                               for lv in self.additional_lvs if not lv.size_mb)
+        rootfs_extents = pe_count - fixed_extents - relative_extents
+        if rootfs_extents <= 0:
+            fixed_size = fixed_extents * lvm2.EXTENT_SIZE // mib
+            relative_size = relative_extents * lvm2.EXTENT_SIZE // mib
+            raise Exception(f"Insufficient space: crypt_partition={crypt_partition_size_mb}MB, "
+                            f"fixed_lvs={fixed_size}MB, relative_lvs={relative_size}MB")
+        return rootfs_extents * lvm2.EXTENT_SIZE // mib
 
 
 # ============================================================================
@@ -203,6 +220,8 @@ def _run_cmd(cmd, check=True, capture=False):
     """
     if isinstance(cmd, str):
         cmd = cmd.split()
+    if COMMAND_BACKEND:
+        return COMMAND_BACKEND(cmd, check=check, capture=capture, sudo=False)
 
     try:
         logger.debug(f"Executing: {' '.join(cmd)}")
@@ -249,14 +268,16 @@ def _run_cmd(cmd, check=True, capture=False):
                     resolved_cmd[0] = found_path
                     logger.debug(f"Resolved {cmd[0]} to {found_path}")
 
-        result = subprocess.run(
-            resolved_cmd,
-            check=False,
-            stdout=subprocess.PIPE if capture else None,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            env=env
-        )
+        with trace.get_tracer().command(resolved_cmd) as span:
+            result = subprocess.run(
+                resolved_cmd,
+                check=False,
+                stdout=subprocess.PIPE if capture else None,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                env=env
+            )
+            span['exit_status'] = result.returncode
 
         if result.returncode != 0 and check:
             raise Exception(
@@ -274,498 +295,133 @@ def _run_cmd(cmd, check=True, capture=False):
         return None
 
 
-def _run_cmd_sudo(cmd, check=True, capture=False):
-    """
-    Execute a system command with sudo for elevated privileges.
-    
-    This is required for storage commands that need root access:
-    - lvm operations
-    - cryptsetup operations
-    - losetup operations
-    - mount/umount operations
-    
-    Assumes the user has been configured with NOPASSWD sudoers rules.
+def _parse_size_mb(size_str: str) -> Optional[int]:
+    """Parse a WKS volume size ("2G", "512M", "1024K", "2048") into MB
 
-    Args:
-        cmd: Command string or list
-        check: Whether to check return code and raise on failure
-        capture: Whether to capture and return stdout
-
-    Returns:
-        stdout string if capture=True, else None
+    Returns None for relative sizes such as "100%FREE".
     """
-    if isinstance(cmd, str):
-        cmd = cmd.split()
-
-    # Prepend sudo
-    sudo_cmd = ['sudo'] + cmd
-
-    try:
-        logger.debug(f"Executing with sudo: {' '.join(sudo_cmd)}")
-        env = os.environ.copy()
-        env['LVM_SUPPRESS_FD_WARNINGS'] = '1'
-
-        # Ensure we have a complete PATH including sbin directories
-        if 'PATH' not in env:
-            env['PATH'] = '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin'
-        else:
-            # Prepend sbin directories if missing
-            path_parts = env['PATH'].split(':')
-            sbin_paths = [p for p in path_parts if 'sbin' in p]
-            if not sbin_paths:
-                env['PATH'] = '/usr/sbin:/usr/bin:/sbin:/bin:' + env['PATH']
-
-        # Don't resolve 'sudo' itself, let system find it
-        resolved_cmd = list(sudo_cmd)
-
-        result = subprocess.run(
-            resolved_cmd,
-            check=False,
-            stdout=subprocess.PIPE if capture else None,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            env=env
-        )
-
-        if result.returncode != 0 and check:
-            raise Exception(
-                f"Command failed with code {result.returncode}: {' '.join(sudo_cmd)}\n"
-                f"stderr: {result.stderr}"
-            )
-
-        if capture:
-            return result.stdout.strip()
-        return None
-    except Exception as e:
-        if check:
-            raise Exception(f"Failed to execute sudo command: {e}")
-        logger.warning(f"Sudo command warning: {e}")
+    value = size_str.strip().upper()
+    if '%' in value:
         return None
-
-
-
-# ============================================================================
-# Initialization and Cleanup
-# ============================================================================
-
-def _init_cleanup_orphaned_loop_devices():
-    """Cleanup Phase: Enumerate and remove orphaned loop devices
-
-    This initialization phase runs at the start to clean up any loop devices
-    that are attached to image files that no longer exist. This can happen if:
-    - A previous WIC build was interrupted
-    - An image file was deleted but losetup wasn't called
-    - The system crashed while a loop device was attached
-    """
-    try:
-        # Get list of all loop devices and their backing files
-        cmd = ['losetup', '-a']
-        output = _run_cmd(cmd, capture=True, check=False)
-
-        if not output or output.strip() == '':
-            logger.debug("No loop devices currently attached")
-            return
-
-        logger.info("=== Cleanup Phase: Checking for orphaned loop devices ===")
-
-        # Parse losetup output: /dev/loop0: [0805]:0 (/path/to/file)
-        lines = output.strip().split('\n')
-        orphaned_count = 0
-
-        for line in lines:
-            if not line.strip():
-                continue
-
-            # Extract loop device and file path
-            # Format: /dev/loopX: [...]  (/path/to/file)
-            if '(' not in line or ')' not in line:
-                continue
-
-            loop_device = line.split(':')[0].strip()
-            file_path = line[line.rfind('(') + 1:line.rfind(')')].strip()
-
-            # Check if the backing file still exists
-            if not os.path.exists(file_path):
-                logger.info(f"Found orphaned loop device: {loop_device} → {file_path} (DELETED)")
-
-                try:
-                    # Detach the orphaned loop device
-                    cmd = ['losetup', '-d', loop_device]
-                    _run_cmd(cmd, check=False)
-                    logger.info(f"  ✓ Detached orphaned loop device: {loop_device}")
-                    orphaned_count += 1
-                except Exception as e:
-                    logger.warning(f"  ✗ Failed to detach {loop_device}: {e}")
-            else:
-                logger.debug(f"Loop device {loop_device} → {file_path} (exists, keeping)")
-
-        if orphaned_count > 0:
-            logger.info(f"✓ Cleanup complete: removed {orphaned_count} orphaned loop device(s)")
-        else:
-            logger.debug("No orphaned loop devices found")
-
-    except Exception as e:
-        logger.warning(f"Cleanup phase warning (non-fatal): {e}")
-
-
-def _check_sudo_access():
-    """Verify sudo is properly configured by checking version info for required commands
-    
-    This function tests that all required storage commands can be executed with sudo
-    and without password prompts. It checks version information from each command.
-    
-    Raises:
-        Exception if any required command is not accessible via sudo
-    """
-    required_commands = {
-        'lvm': ['lvm', 'version'],
-        'cryptsetup': ['cryptsetup', '--version'],
-        'losetup': ['losetup', '--version'],
-        'sgdisk': ['sgdisk', '--version'],
-        'mkfs.vfat': ['mkfs.vfat', '--help'],  # Some systems don't have --version
-        'mkfs.ext4': ['mkfs.ext4', '-V'],
-        'mount': ['mount', '--version'],
-        'umount': ['umount', '--version'],
-    }
-    
-    logger.info("=== Verifying Sudo Access ===")
-    logger.debug("Checking sudo access for storage commands...")
-    
-    failed_commands = []
-    
-    for cmd_name, cmd_list in required_commands.items():
-        try:
-            # Try to get version/help from command via sudo
-            result = subprocess.run(
-                ['sudo'] + cmd_list,
-                capture_output=True,
-                universal_newlines=True,
-                timeout=5,
-                check=False
-            )
-            
-            if result.returncode == 0 or result.returncode == 1:  # Some commands return 1 for --version
-                # Extract first line of output for logging
-                output_line = (result.stdout or result.stderr).split('\n')[0][:60]
-                logger.debug(f"  ✓ {cmd_name}: {output_line}")
-            else:
-                failed_commands.append((cmd_name, result.returncode, result.stderr))
-                logger.error(f"  ✗ {cmd_name}: Failed with code {result.returncode}")
-        
-        except subprocess.TimeoutExpired:
-            failed_commands.append((cmd_name, 'timeout', 'Command timeout'))
-            logger.error(f"  ✗ {cmd_name}: Timeout (possibly waiting for password)")
-        
-        except FileNotFoundError:
-            failed_commands.append((cmd_name, 'not_found', 'Command not found'))
-            logger.error(f"  ✗ {cmd_name}: Command not found in PATH")
-        
-        except Exception as e:
-            failed_commands.append((cmd_name, 'error', str(e)))
-            logger.error(f"  ✗ {cmd_name}: {e}")
-    
-    if failed_commands:
-        error_msg = "Sudo access verification failed for:\n"
-        for cmd_name, error_code, error_detail in failed_commands:
-            error_msg += f"  - {cmd_name}: {error_code} ({error_detail})\n"
-        error_msg += "\nEnsure sudoers is configured with NOPASSWD for storage commands:\n"
-        error_msg += "  sudo visudo -f /etc/sudoers.d/storage\n"
-        error_msg += "  # Add: USERNAME ALL=(root) NOPASSWD: /usr/sbin/lvm, /usr/sbin/cryptsetup, etc."
-        raise Exception(error_msg)
-    
-    logger.info("✓ All required sudo commands are accessible")
-
-
-
-# ============================================================================
-# Phase Implementations
-# ============================================================================
-
-def _phase1_create_sparse_file(pv_file: str, total_size_mb: int):
-    """Phase 1: Create sparse disk image file"""
-    try:
-        cmd = ['dd', 'if=/dev/zero', f'of={pv_file}', 'bs=1M', 'count=0', f'seek={total_size_mb}']
-        _run_cmd(cmd)
-        logger.info(f"✓ Sparse disk image created: {pv_file} ({total_size_mb}MB)")
-    except Exception as e:
-        raise Exception(f"Failed to create sparse disk image: {e}")
-
-
-def _phase2_loop_attach(pv_file: str) -> str:
-    """Phase 2: Attach loop device WITHOUT --partscan"""
-    try:
-        cmd = ['losetup', '--find', '--show', pv_file]
-        loop_device = _run_cmd(cmd, capture=True).strip()
-        logger.info(f"✓ Phase 2: Loop device attached (no partscan): {loop_device}")
-        return loop_device
-    except Exception as e:
-        raise Exception(f"Failed to attach loop device: {e}")
-
-
-def _phase3_create_gpt_partition_table(loop_device: str) -> Dict:
-    """Phase 3: Zap and create GPT partition table with sgdisk"""
-    try:
-        # Zap all (erase old partition table if any)
-        cmd = ['sgdisk', '--zap-all', loop_device]
-        _run_cmd(cmd, check=False)
-
-        # Create all partitions in one sgdisk call
-        # Using exact layout from reference script
-        cmd = ['sgdisk',
-               '--new=1:1MiB:+512MiB', '--typecode=1:EF00', '--change-name=1:efi',
-               '--new=2:0:+1024MiB', '--typecode=2:EA00', '--change-name=2:xbootldr',
-               '--new=3:0:0', '--typecode=3:8304', '--change-name=3:crypt_lvm',
-               loop_device]
-        _run_cmd(cmd)
-
-        logger.info(f"✓ Phase 3: GPT partition table created with sgdisk")
-
-        return {
-            'efi_partition': f"{loop_device}p1",
-            'boot_partition': f"{loop_device}p2",
-            'luks_partition': f"{loop_device}p3",
-        }
-    except Exception as e:
-        raise Exception(f"Failed to create GPT partition table: {e}")
-
-
-def _phase4_detach_loop(loop_device: str):
-    """Phase 4: Detach loop device to force kernel to sync partition table"""
-    try:
-        cmd = ['losetup', '--detach', loop_device]
-        _run_cmd(cmd)
-        logger.info(f"✓ Phase 4: Loop device detached")
-    except Exception as e:
-        raise Exception(f"Failed to detach loop device: {e}")
-
-
-def _phase5_reattach_with_partscan(pv_file: str) -> str:
-    """Phase 5: Re-attach loop device WITH --partscan to create partition devices"""
-    import time
+    units = {'K': 1.0 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}
+    factor = 1
+    if value and value[-1] in units:
+        factor = units[value[-1]]
+        value = value[:-1]
     try:
-        cmd = ['losetup', '--find', '--show', '--partscan', pv_file]
-        loop_device = _run_cmd(cmd, capture=True).strip()
-        logger.info(f"✓ Phase 5: Loop device re-attached with --partscan: {loop_device}")
-        
-        # Wait for partition devices to be created
-        time.sleep(1)
-        
-        # Verify partition devices exist
-        base = os.path.basename(loop_device)
-        parent_dir = os.path.dirname(loop_device) or '/dev'
-        
-        for i in range(1, 4):
-            partition_dev = os.path.join(parent_dir, f"{base}p{i}")
-            if not os.path.exists(partition_dev):
-                raise Exception(f"Partition device {partition_dev} not created after --partscan")
-            logger.debug(f"    ✓ {partition_dev} exists")
-        
-        return loop_device
-    except Exception as e:
-        raise Exception(f"Failed to re-attach loop device with --partscan: {e}")
+        return max(1, int(float(value) * factor))
+    except ValueError:
+        raise Exception(f"Invalid volume size: {size_str}")
 
 
-def _phase6_format_efi_partition(efi_device: str):
-    """Phase 6: Format EFI System Partition"""
-    try:
-        # Format as VFAT (requires sudo)
-        cmd = ['mkfs.vfat', '-F', '32', '-n', 'efi', efi_device]
-        _run_cmd_sudo(cmd)
-        logger.info(f"✓ Phase 6: EFI partition formatted")
-    except Exception as e:
-        raise Exception(f"Failed to format EFI partition: {e}")
+def _parse_source_params(source_params: Dict) -> Tuple[DiskConfig, str, set]:
+    """Parse the lvmrootfs sourceparams into a DiskConfig
 
-
-def _phase7_format_boot_partition(boot_device: str):
-    """Phase 7: Format XBOOTLDR Partition"""
-    try:
-        # Format as ext4 (requires sudo)
-        boot_uuid = "5d7e1b2c-3f4a-4c8d-9e22-1a6b7c8d9e33"
-        cmd = ['mkfs.ext4', '-U', boot_uuid, '-L', 'xbootldr', boot_device]
-        _run_cmd_sudo(cmd)
-        logger.info(f"✓ Phase 7: XBOOTLDR partition formatted")
-    except Exception as e:
-        raise Exception(f"Failed to format XBOOTLDR partition: {e}")
-
-
-def _phase8_create_luks_volume(luks_partition: str, luks_name: str, luks_passphrase: Optional[str]):
-    """Phase 8: Format and open LUKS on partition 3
-    
-    When luks_passphrase is None (from "NULL" in sourceparams), uses empty passphrase ("\n")
-    instead of /dev/null keyfile (cryptsetup has issues with /dev/null)
-    
-    All cryptsetup operations require sudo for device access.
+    Returns:
+        (config, assembly mode, names of LVs whose filesystem UUID is
+        generated rather than configured)
     """
-    try:
-        if luks_passphrase:
-            # With explicit passphrase (requires sudo)
-            cmd = ['sudo', 'cryptsetup', '-q', 'luksFormat', '--type', 'luks2', luks_partition]
-            result = subprocess.run(cmd, input=luks_passphrase + '\n' + luks_passphrase + '\n',
-                                  universal_newlines=True, capture_output=True, check=False)
-            if result.returncode != 0:
-                raise Exception(result.stderr)
-        else:
-            # With empty passphrase for automated unlock (no /dev/null due to cryptsetup issues, requires sudo)
-            cmd = ['sudo', 'cryptsetup', '-q', 'luksFormat', '--type', 'luks2', luks_partition]
-            result = subprocess.run(cmd, input='\n\n',
-                                  universal_newlines=True, capture_output=True, check=False)
-            if result.returncode != 0:
-                raise Exception(result.stderr)
-
-        # Open LUKS volume (requires sudo)
-        if luks_passphrase:
-            cmd = ['sudo', 'cryptsetup', 'open', luks_partition, luks_name]
-            result = subprocess.run(cmd, input=luks_passphrase + '\n',
-                                  universal_newlines=True, capture_output=True, check=False)
-            if result.returncode != 0:
-                raise Exception(result.stderr)
-        else:
-            # Open with empty passphrase (requires sudo)
-            cmd = ['sudo', 'cryptsetup', 'open', luks_partition, luks_name]
-            result = subprocess.run(cmd, input='\n',
-                                  universal_newlines=True, capture_output=True, check=False)
-            if result.returncode != 0:
-                raise Exception(result.stderr)
-
-        logger.info(f"✓ LUKS volume created and opened: /dev/mapper/{luks_name}")
-        return f"/dev/mapper/{luks_name}"
-    except Exception as e:
-        raise Exception(f"Failed to create LUKS volume: {e}")
-
-
-def _phase9_create_lvm_in_luks(luks_device: str, vg_name: str) -> str:
-    """Phase 9: Create LVM physical volume inside LUKS volume"""
-    try:
-        # Create physical volume (requires sudo)
-        cmd = ['lvm', 'pvcreate', '--nolocking', '-ff', '-y', luks_device]
-        _run_cmd_sudo(cmd)
-
-        # Create volume group (requires sudo)
-        cmd = ['lvm', 'vgcreate', '--nolocking', vg_name, luks_device]
-        _run_cmd_sudo(cmd)
-
-        logger.info(f"✓ LVM volume group '{vg_name}' created inside LUKS")
-        return vg_name
-    except Exception as e:
-        raise Exception(f"Failed to create LVM in LUKS: {e}")
-
-
-def _phase10_create_logical_volumes(vg_name: str, rootfs_lv: LogicalVolumeSpec, additional_lvs: List[LogicalVolumeSpec]):
-    """Phase 10: Create logical volumes and format with ext4"""
-    try:
-        # Create rootfs LV (requires sudo)
-        if isinstance(rootfs_lv.size_mb, int):
-            size_arg = f"-L {rootfs_lv.size_mb}M"
-        else:
-            size_arg = "-l 100%FREE"
-
-        cmd = ['lvm', 'lvcreate', '--nolocking', '-n', rootfs_lv.name] + size_arg.split() + [vg_name]
-        _run_cmd_sudo(cmd)
-
-        rootfs_device = f"/dev/{vg_name}/{rootfs_lv.name}"
-        cmd = ['mkfs.ext4', '-U', rootfs_lv.uuid, '-L', rootfs_lv.name, rootfs_device]
-        _run_cmd_sudo(cmd)
-        logger.info(f"✓ Rootfs LV created and formatted: {rootfs_device}")
-
-        # Create additional LVs (requires sudo)
-        for lv in additional_lvs:
-            size_arg = f"-l {lv.size_str}" if '%' in lv.size_str else f"-L {lv.size_mb}M"
-            cmd = ['lvm', 'lvcreate', '--nolocking', '-n', lv.name] + size_arg.split() + [vg_name]
-            _run_cmd_sudo(cmd)
-
-            lv_device = f"/dev/{vg_name}/{lv.name}"
-            cmd = ['mkfs.ext4', '-U', lv.uuid, '-L', lv.name, lv_device]
-            _run_cmd_sudo(cmd)
-            logger.info(f"✓ Additional LV created and formatted: {lv_device}")
-
-        return rootfs_device
-    except Exception as e:
-        raise Exception(f"Failed to create logical volumes: {e}")
-
-
-def _phase11_mount_and_populate_volumes(vg_name: str, rootfs_lv: LogicalVolumeSpec, rootfs_dir: str, mount_base: str) -> Dict:
-    """Phase 10: Format and prepare logical volumes (WIC will populate content)"""
-    try:
-        mounts = {}
-        # Just format the rootfs LV, don't mount it
-        # WIC will handle populating the rootfs via direct writes to the LV device
-        rootfs_device = f"/dev/{vg_name}/{rootfs_lv.name}"
-        logger.info(f"✓ Rootfs LV formatted and ready for WIC population: {rootfs_device}")
-        return mounts
-    except Exception as e:
-        raise Exception(f"Failed to prepare volumes: {e}")
-
-
-def _phase12_cleanup(mounts: Dict, loop_device: str, luks_name: str, vg_name: str):
-    """Phase 11: Cleanup - unmount, luks close, detach loop"""
-    try:
-        # Unmount all filesystems in reverse order
-        logger.info("=== Phase 12: Cleanup ===")
-
-        # Unmount rootfs and boot (requires sudo)
-        for name, mount_path in reversed(mounts.items()):
-            if os.path.ismount(mount_path):
-                cmd = ['umount', mount_path]
-                _run_cmd_sudo(cmd, check=False)
-                logger.info(f"✓ Unmounted {mount_path}")
-
-        # Deactivate LVM (requires sudo)
-        cmd = ['lvm', 'vgchange', '--nolocking', '-an', vg_name]
-        _run_cmd_sudo(cmd, check=False)
-        logger.info(f"✓ LVM VG deactivated")
-
-        # Close LUKS (requires sudo)
-        if luks_name:
-            cmd = ['cryptsetup', 'close', luks_name]
-            _run_cmd_sudo(cmd, check=False)
-            logger.info(f"✓ LUKS volume closed")
-
-        # Detach loop device (requires sudo)
-        if loop_device:
-            cmd = ['losetup', '-d', loop_device]
-            _run_cmd_sudo(cmd, check=False)
-            logger.info(f"✓ Loop device detached")
-
-        logger.info("✓ Cleanup complete")
-    except Exception as e:
-        logger.warning(f"Cleanup warning: {e}")
-
-
-def _phase13_summary(config: DiskConfig, partitions: Dict):
-    """Phase 12 (bonus): Output execution summary"""
-    logger.info("=== Disk Image Creation Summary ===")
-    logger.info(f"Volume Group: {config.vg_name}")
-    logger.info(f"LUKS Encryption: {'enabled' if config.luks_enabled else 'disabled'}")
-    logger.info(f"Partitions:")
-    logger.info(f"  1. EFI System: {partitions.get('efi_size_mb', 512)}MB")
-    logger.info(f"  2. XBOOTLDR: {partitions.get('boot_size_mb', 1024)}MB")
-    logger.info(f"  3. LUKS + LVM: {partitions.get('crypt_size_mb', 'remaining')}MB")
-    logger.info(f"Logical Volumes:")
-    logger.info(f"  - {config.rootfs_lv.name}: {config.rootfs_lv.size_str}")
-    for lv in config.additional_lvs:
-        logger.info(f"  - {lv.name}: {lv.size_str}")
+    vg_name = source_params.get('lvm-vg-name', 'vg0')
+    rootfs_name = source_params.get('lvm-rootfs-name', 'rootlv')
+    rootfs_uuid = source_params.get('lvm-rootfs-uuid', '')
+    luks_name = source_params.get('luks-name', 'cryptroot')
+    luks_passphrase = source_params.get('luks-passphrase')
+    assembly = source_params.get('lvm-assembly', 'script')
+    if assembly not in ('script', 'offset'):
+        raise Exception(f"Unknown lvm-assembly mode '{assembly}' (expected 'script' or 'offset')")
+
+    # Support both 'NULL' and 'NONE' for disabling LUKS
+    if luks_passphrase in ('NULL', 'NONE'):
+        luks_passphrase = None
+        luks_enabled = False
+    else:
+        luks_enabled = True
+
+    volumes_str = source_params.get('lvm-volumes', '')
+    volumes_uuids_str = source_params.get('lvm-volumes-uuids', '')
+
+    # Parse LV UUIDs
+    volume_uuids = {}
+    if volumes_uuids_str:
+        for uuid_pair in volumes_uuids_str.split(','):
+            vol_name, vol_uuid = uuid_pair.split(':')
+            volume_uuids[vol_name.strip()] = vol_uuid.strip()
+
+    additional_lvs = []
+    if volumes_str:
+        for vol in volumes_str.split(','):
+            name, size = vol.split(':')
+            name = name.strip()
+            size = size.strip()
+            vol_uuid = volume_uuids.get(name, '')
+            lv = LogicalVolumeSpec(name, size, size_mb=_parse_size_mb(size))
+            if vol_uuid:
+                lv.uuid = vol_uuid
+            additional_lvs.append(lv)
+
+    # Parse LV mountpoints: these LVs are populated from that rootfs subtree
+    mount_points = []
+    mounts_str = source_params.get('lvm-mounts', '')
+    if mounts_str:
+        lv_names = [lv.name for lv in additional_lvs]
+        for mount_pair in mounts_str.split(','):
+            vol_name, mountpoint = mount_pair.split(':')
+            vol_name = vol_name.strip()
+            if vol_name not in lv_names:
+                raise Exception(f"lvm-mounts: '{vol_name}' is not a volume in lvm-volumes")
+            mountpoint = mounts.normalize_mountpoint(mountpoint.strip())
+            if any(mp.lv_name == vol_name or mp.mountpoint == mountpoint for mp in mount_points):
+                raise Exception(f"lvm-mounts: '{vol_name}:{mountpoint}' is given twice")
+            mount_points.append(MountPointSpec(vol_name, mountpoint))
+
+    # Configuration
+    config = DiskConfig(
+        vg_name=vg_name,
+        luks_name=luks_name,
+        luks_passphrase=luks_passphrase,
+        rootfs_lv=LogicalVolumeSpec(rootfs_name, 'CALCULATED', uuid=rootfs_uuid),
+        additional_lvs=additional_lvs,
+        mount_points=mount_points,
+        luks_enabled=luks_enabled,
+        luks_pbkdf=pbkdf.parse_profile(source_params)
+    )
+    if assembly == 'offset' and luks_enabled:
+        config.luks_pbkdf.check_userspace()
+    # LVs whose filesystem UUID is generated rather than configured
+    generated_uuids = {name for name in [rootfs_name] + [lv.name for lv in additional_lvs]
+                       if not (rootfs_uuid if name == rootfs_name else volume_uuids.get(name))}
+    return config, assembly, generated_uuids
 
 
 def _generate_shell_script(config, total_size_mb, efi_size_mb, boot_size_mb, crypt_size_mb,
                            vg_name, luks_name, luks_passphrase, luks_enabled, rootfs_name,
-                           rootfs_uuid, additional_lvs):
+                           rootfs_uuid, additional_lvs, gpt_head_name, gpt_tail_name,
+                           gpt_tail_sector, generated_uuids=()):
     """Generate a standalone shell script for post-build LVM disk creation
     
-    This script can be executed after BitBake completes with proper sudoers configuration:
+    The script is run as root after BitBake completes (see Host Prerequisites):
     sudo ./create-lvm-*.sh <rootfs_dir> <output_wic>
+
+    The GPT is written by the plugin into gpt_head_name/gpt_tail_name next to
+    the script; the script only copies those sectors into the image. The
+    .bmap is written with lvmimage.bmap from this plugin's directory.
     """
+    lvmimage_dir = os.path.dirname(os.path.abspath(__file__))
     
-    # Build LV creation commands
+    # Build LV creation commands; they run in order in one lvm shell session
+    # together with pvcreate/vgcreate, the mkfs steps are independent and run
+    # concurrently
     lv_create_cmds = []
+    lv_format_cmds = []
     lv_mount_cmds = []
     lv_unmount_cmds = []
     
     # Rootfs LV
     lv_create_cmds.append(
-        f'lvm lvcreate --nolocking -L {config.rootfs_lv.size_mb}M -n {rootfs_name} {vg_name}'
+        f'lvcreate -L {config.rootfs_lv.size_mb}M -n {rootfs_name} $NS_VG'
     )
-    lv_create_cmds.append(
-        f'mkfs.ext4 -U {config.rootfs_lv.uuid} -L {rootfs_name} /dev/{vg_name}/{rootfs_name}'
+    lv_format_cmds.append(
+        f'step_done lv-{rootfs_name} || run_step lv-{rootfs_name} mkfs.ext4 -U {config.rootfs_lv.uuid} -L {rootfs_name} /dev/$NS_VG/{rootfs_name}'
     )
     
     # Additional LVs
@@ -774,25 +430,101 @@ def _generate_shell_script(config, total_size_mb, efi_size_mb, boot_size_mb, cry
             size_arg = f'-l {lv.size_str}'
         else:
             size_arg = f'-L {lv.size_mb}M'
-        lv_create_cmds.append(f'lvm lvcreate --nolocking {size_arg} -n {lv.name} {vg_name}')
-        lv_create_cmds.append(f'mkfs.ext4 -U {lv.uuid} -L {lv.name} /dev/{vg_name}/{lv.name}')
+        lv_create_cmds.append(f'lvcreate {size_arg} -n {lv.name} $NS_VG')
+        lv_format_cmds.append(f'step_done lv-{lv.name} || run_step lv-{lv.name} mkfs.ext4 -U {lv.uuid} -L {lv.name} /dev/$NS_VG/{lv.name}')
     
-    # LUKS passphrase handling
+    lv_devices = ' '.join(f'/dev/$NS_VG/{name}' for name in [rootfs_name] + [lv.name for lv in additional_lvs])
+
+    # LVs with a mountpoint (lvm-mounts) are populated from that rootfs
+    # subtree, which every tree above them leaves out except for the
+    # directory itself
+    trees = mounts.source_trees('$ROOTFS_DIR', rootfs_name, config.mount_points)
+    rootfs_tree, *mounted = trees
+    rsync_excludes = lambda tree: ''.join(f' --exclude="{path}/*"' for path in tree.excluded)
+    populate_cmds = []
+    for index, tree in enumerate(mounted, 1):
+        populate_cmds += [
+            f'if ! step_done populate-{tree.lv_name}; then',
+            f'    mkdir -p "$MNT_DIR/{tree.lv_name}"',
+            f'    mount "/dev/$NS_VG/{tree.lv_name}" "$MNT_DIR/{tree.lv_name}"',
+            f'    if [ -d "$SRC_{index}" ]; then',
+            f'        rsync -avx --delete{rsync_excludes(tree)} "$SRC_{index}/" "$MNT_DIR/{tree.lv_name}/"',
+            '    fi',
+            f'    umount "$MNT_DIR/{tree.lv_name}"',
+            f'    checkpoint populate-{tree.lv_name} --input "$TREE_{index}"',
+            f'    echo "✓ {tree.lv_name} populated from {tree.mountpoint}"',
+            'fi',
+        ]
+    populate_block = '\n'.join(['', '# Populate the volumes mounted on rootfs subtrees (lvm-mounts)']
+                               + populate_cmds + ['']) if populate_cmds else ''
+    # A subtree the image emptied after saving its factory copy (/var in
+    # core-image-distro.inc) is populated from /usr/share/factory
+    tree_sources = ['SRC_0="$ROOTFS_DIR"']
+    for index, tree in enumerate(mounted, 1):
+        factory = mounts.factory_path('$ROOTFS_DIR', tree.mountpoint)
+        tree_sources += [
+            f'SRC_{index}="{tree.path}"',
+            f'if [ -z "$(ls -A "$SRC_{index}" 2>/dev/null)" ] && [ -d "{factory}" ]; then',
+            f'    SRC_{index}="{factory}"',
+            'fi',
+        ]
+    # A population step is resumed only while its source tree is unchanged
+    tree_signatures = '\n'.join(tree_sources + [f'TREE_{index}="$(journal signature "$SRC_{index}")"'
+                                                 for index in range(len(trees))])
+    resume_inputs = ' '.join(f'--input populate-{tree.lv_name}="$TREE_{index}"'
+                             for index, tree in enumerate(trees))
+    # Steps an existing image reused by INCREMENTAL=1 has already done
+    lv_names = [rootfs_name] + [lv.name for lv in additional_lvs]
+    reuse_steps = ' '.join(['image', 'efi', 'xbootldr', 'luks', 'lvm'] + [f'lv-{name}' for name in lv_names])
+    mounted_names = {tree.lv_name for tree in mounted}
+    empty_lvs = ' '.join(lv.name for lv in additional_lvs if lv.name not in mounted_names)
+    lvm_batch = '\n'.join(['pvcreate -ff -y /dev/mapper/$NS_LUKS',
+                           'vgcreate $NS_VG /dev/mapper/$NS_LUKS'] + lv_create_cmds)
+    lv_cmds = '\n'.join([f'wait_devices {lv_devices}'] + lv_format_cmds + ['wait_steps'])
+
+    # Extent allocation the plugin expects from lvcreate, checked against
+    # what lvm reports after the batch
+    crypt_bytes = compute_partition_layout(total_size_mb, efi_size_mb, boot_size_mb).crypt.size
+    vg_plan = lvm2.plan_volume_group(config, luks2.payload_size(crypt_bytes))
+    lvm_plan = ','.join(f'{lv.name}:{lv.start_extent}:{lv.extent_count}' for lv in vg_plan.volumes)
+
+    # Previous images are reused by INCREMENTAL=1 only with the same layout;
+    # LVs without a configured UUID keep the one of the reused filesystem
+    layout_id = layout_fingerprint(config, total_size_mb, efi_size_mb, boot_size_mb,
+                                   ignore_uuids=generated_uuids)
+
+    # LUKS passphrase handling; the keyslot PBKDF comes from the luks-pbkdf
+    # profile (cryptsetup's benchmark unless one is configured)
+    pbkdf_args = ''.join(' ' + arg for arg in config.luks_pbkdf.cryptsetup_args())
     if luks_passphrase:
-        luks_fmt_cmd = f'echo -e "{luks_passphrase}\\n{luks_passphrase}" | cryptsetup -q luksFormat --type luks2'
+        luks_fmt_cmd = f'echo -e "{luks_passphrase}\\n{luks_passphrase}" | cryptsetup -q luksFormat --type luks2{pbkdf_args}'
         luks_open_cmd = f'echo "{luks_passphrase}" | cryptsetup open'
     else:
-        luks_fmt_cmd = 'echo -e "\\n" | cryptsetup -q luksFormat --type luks2'
+        luks_fmt_cmd = f'echo -e "\\n" | cryptsetup -q luksFormat --type luks2{pbkdf_args}'
         luks_open_cmd = 'echo "" | cryptsetup open'
     
     script = f'''#!/bin/bash
 # LVM + LUKS Disk Image Creation Script
 # Generated by lvmrootfs WIC plugin
 # 
-# Usage: sudo ./create-lvm-{vg_name}.sh <rootfs_dir> <output_wic_path>
+# Usage: sudo [INCREMENTAL=1] [RESUME=0] [LVM_BUILD_ID=id] ./create-lvm-{vg_name}.sh <rootfs_dir> <output_wic_path>
 
 set -e
 
+# Every kernel-visible resource of this run is namespaced by LVM_BUILD_ID
+# (default: the script's PID), so several scripts can run on one host: the
+# VG is created as {vg_name}_b<id> and renamed to {vg_name} after it has
+# been deactivated, the LUKS mapping is {luks_name}_b<id>, and mounts live in
+# a private directory. Cleanup only touches these resources.
+BUILD_ID="$(echo "${{LVM_BUILD_ID:-$$}}" | tr -cd 'A-Za-z0-9')"
+NS_VG="{vg_name}_b$BUILD_ID"
+NS_LUKS="{luks_name}_b$BUILD_ID"
+MNT_DIR=""
+# Serializes the moments where the image's PV is visible under the
+# configured VG name, which other builds may use too
+NAME_LOCK="/run/lock/lvmrootfs-vgname.lock"
+[ -d /run/lock ] || NAME_LOCK="/tmp/lvmrootfs-vgname.lock"
+
 ROOTFS_DIR="${{1:-.}}"
 WIC_PATH="${{2:-./disk.wic}}"
 
@@ -801,132 +533,397 @@ if [ ! -d "$ROOTFS_DIR" ]; then
     exit 1
 fi
 
+# One run per output image. A run that fails keeps its partial image and
+# the phase journal next to it, and the next run resumes from the last
+# finished step (RESUME=0 starts over)
+RESUME="${{RESUME:-1}}"
+PV_FILE="$WIC_PATH.partial"
+JOURNAL="$WIC_PATH.journal"
+exec 8>"$WIC_PATH.lock"
+if ! flock -n 8; then
+    echo "Error: $WIC_PATH is being built by another run"
+    exit 1
+fi
+
 echo "=== LVM Disk Image Creation ==="
-echo "VG Name: {vg_name}"
+echo "VG Name: {vg_name} (as $NS_VG while building)"
 echo "LUKS Enabled: {luks_enabled}"
 echo "Total Size: {total_size_mb}MB"
 echo "Output: $WIC_PATH"
 echo ""
 
+# Independent format steps run in the background; wait_steps collects them,
+# prints per-step timings and fails if any of them failed
+STEP_DIR="$(mktemp -d)"
+STEP_PIDS=""
+
+# Stage tracing: one tab-separated record per phase and background step
+# (wall time, image bytes allocated, child CPU time, exit status), turned
+# into $WIC_PATH.trace.json and $WIC_PATH.trace.txt by lvmimage.trace
+TRACE_EVENTS="$STEP_DIR/trace.tsv"
+TRACE_IMAGE=""
+PHASE_NAME=""
+CLK_TCK=$(getconf CLK_TCK)
+
+image_bytes() {{
+    local s
+    if s=$(stat -c '%b %B' "$TRACE_IMAGE" 2>/dev/null); then
+        echo $(( ${{s% *}} * ${{s#* }} ))
+    else
+        echo 0
+    fi
+}}
+
+# CPU seconds of the reaped children of a shell process
+child_cpu() {{
+    awk -v hz="$CLK_TCK" '{{ printf "%.2f", ($16 + $17) / hz }}' "/proc/$1/stat"
+}}
+
+trace_record() {{
+    printf '%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n' "$@" >> "$TRACE_EVENTS"
+}}
+
+# End the running phase with status ${{2:-0}} and start phase $1 ("" for none)
+trace_phase() {{
+    local now=$(date +%s%N)
+    if [ -n "$PHASE_NAME" ]; then
+        trace_record phase "$PHASE_NAME" "$PHASE_START" "$now" "${{2:-0}}" \
+            "$PHASE_BYTES" "$(image_bytes)" "$PHASE_CPU" "$(child_cpu $$)"
+    fi
+    PHASE_NAME="$1"
+    PHASE_START=$now
+    PHASE_BYTES=$(image_bytes)
+    PHASE_CPU=$(child_cpu $$)
+}}
+
+write_trace() {{
+    if PYTHONPATH="{lvmimage_dir}" python3 -m lvmimage.trace script "$TRACE_EVENTS" "$WIC_PATH" > /dev/null; then
+        echo "✓ Trace written: $WIC_PATH.trace.json ($WIC_PATH.trace.txt)"
+    fi
+}}
+
+run_step() {{
+    local name="$1"
+    shift
+    (
+        pid=$BASHPID
+        start=$(date +%s%N)
+        bytes=$(image_bytes)
+        if "$@" > "$STEP_DIR/$name.log" 2>&1; then rc=0; else rc=$?; fi
+        end=$(date +%s%N)
+        echo "$name $(( (end - start) / 1000000 ))" > "$STEP_DIR/$name.time"
+        trace_record cmd "$name" "$start" "$end" "$rc" "$bytes" "$(image_bytes)" 0 "$(child_cpu $pid)"
+        exit $rc
+    ) &
+    STEP_PIDS="$STEP_PIDS $!:$name"
+}}
+
+# Block until device nodes exist, woken by inotify rather than a fixed sleep;
+# prints how long each device took to appear
+wait_devices() {{
+    PYTHONPATH="{lvmimage_dir}" python3 -m lvmimage.devwait --timeout 30 "$@"
+}}
+
+# Loop devices come from /dev/loop-control and are recorded as leases of
+# this script's PID, so only stale leases of finished runs are ever reaped
+looplease() {{
+    PYTHONPATH="{lvmimage_dir}" python3 -m lvmimage.looplease "$@"
+}}
+
+# Phase journal (lvmimage.journal): finished steps, and the devices this
+# run holds so that a later run can release them if this one is killed
+journal() {{
+    PYTHONPATH="{lvmimage_dir}" python3 -m lvmimage.journal "$@"
+}}
+
+DONE_STEPS=""
+step_done() {{
+    printf '%s\\n' "$DONE_STEPS" | grep -qxF "$1"
+}}
+
+# Record a finished step once the image file has been flushed
+checkpoint() {{
+    journal done "$JOURNAL" "$1" --image "$PV_FILE" "${{@:2}}"
+    DONE_STEPS="$DONE_STEPS
+$1"
+}}
+
+# Give the VG on this run's LUKS mapping the build name, whatever name the
+# run that created it left behind
+claim_vg() {{
+    local name uuid
+    read -r name uuid < <(lvm pvs --nolocking --noheadings -o vg_name,vg_uuid "/dev/mapper/$NS_LUKS")
+    if [ "$name" != "$NS_VG" ]; then
+        lvm vgrename --nolocking "$uuid" "$NS_VG"
+    fi
+}}
+
+wait_steps() {{
+    local entry failed=0
+    for entry in $STEP_PIDS; do
+        if ! wait "${{entry%%:*}}"; then
+            echo "✗ Step ${{entry#*:}} failed:"
+            cat "$STEP_DIR/${{entry#*:}}.log"
+            failed=1
+        else
+            checkpoint "${{entry#*:}}"
+        fi
+    done
+    STEP_PIDS=""
+    cat "$STEP_DIR"/*.time 2>/dev/null | while read -r name ms; do
+        echo "  $name: ${{ms}}ms"
+    done
+    rm -f "$STEP_DIR"/*.time
+    [ "$failed" -eq 0 ]
+}}
+
 # Cleanup function
 cleanup() {{
+    local status=$?
     echo "Cleaning up..."
     
-    # Unmount volumes
-    for mp in $(mount | grep "/mnt/lvm-" | awk '{{print $3}}' | tac); do
-        echo "Unmounting $mp..."
-        umount "$mp" || true
-    done
+    # Let background format steps finish before tearing devices down
+    wait || true
+    if [ "$KEEP_IMAGE" != "1" ] && [ -n "$PHASE_NAME" ]; then
+        # Failed run: close the phase that failed and keep its trace
+        trace_phase "" "$status"
+        write_trace
+    fi
+    
+    # Unmount this run's volumes only
+    if [ -n "$MNT_DIR" ]; then
+        for mp in $(awk -v dir="$MNT_DIR/" 'index($2, dir) == 1 {{print $2}}' /proc/self/mounts | sort -r); do
+            echo "Unmounting $mp..."
+            umount "$mp" || true
+        done
+        rm -rf "$MNT_DIR"
+        MNT_DIR=""
+    fi
     
     # Deactivate LVM
     echo "Deactivating LVM..."
-    lvm vgchange --nolocking -an {vg_name} || true
+    lvm vgchange --nolocking -an "$NS_VG" 2>/dev/null || true
     
-    # Close LUKS
+    # Close LUKS; a finished image gets its configured VG name back first
     echo "Closing LUKS..."
-    cryptsetup close {luks_name} || true
+    if [ -e "/dev/mapper/$NS_LUKS" ]; then
+        (
+            flock 9
+            if [ "$KEEP_IMAGE" = "1" ]; then
+                lvm vgrename --nolocking "$NS_VG" {vg_name}
+            fi
+            cryptsetup close "$NS_LUKS"
+        ) 9>"$NAME_LOCK" || [ "$KEEP_IMAGE" != "1" ]
+    fi
     
     # Detach loop device
     if [ -n "$LOOP_DEVICE" ]; then
         echo "Detaching loop device..."
-        losetup -d "$LOOP_DEVICE" || true
+        looplease detach "$LOOP_DEVICE" || true
+        LOOP_DEVICE=""
+    fi
+
+    # Unless Phase 12 is finalizing it, keep the unfinished image with its
+    # journal for the next run, or drop it with RESUME=0
+    if [ "$KEEP_IMAGE" != "1" ]; then
+        if [ "$RESUME" = "1" ] && [ -f "$PV_FILE" ] && [ -f "$JOURNAL" ]; then
+            echo "Partial image kept for the next run: $PV_FILE"
+        else
+            rm -f "$PV_FILE" "$JOURNAL"
+        fi
+        rm -rf "$STEP_DIR"
     fi
 }}
 
 trap cleanup EXIT
 
-# Create sparse disk image
-echo "Phase 1: Creating sparse disk image..."
-PV_FILE="/tmp/lvm-pv-$$.img"
-dd if=/dev/zero of="$PV_FILE" bs=1M count=0 seek={total_size_mb}
-echo "✓ Sparse image created: $PV_FILE"
-
-# Attach loop device (no partscan)
-echo "Phase 2: Attaching loop device..."
-LOOP_DEVICE=$(losetup --find --show "$PV_FILE")
-echo "✓ Loop device: $LOOP_DEVICE"
-
-# Create GPT partition table
-echo "Phase 3: Creating GPT partitions..."
-sgdisk --zap-all "$LOOP_DEVICE"
-sgdisk --new=1:1MiB:+{efi_size_mb}MiB --typecode=1:EF00 --change-name=1:efi \\
-       --new=2:0:+{boot_size_mb}MiB --typecode=2:EA00 --change-name=2:xbootldr \\
-       --new=3:0:0 --typecode=3:8304 --change-name=3:crypt_lvm \\
-       "$LOOP_DEVICE"
-echo "✓ Partitions created"
-
-# Detach and re-attach with --partscan
-echo "Phase 4: Detaching loop device..."
-losetup --detach "$LOOP_DEVICE"
-
-echo "Phase 5: Re-attaching with --partscan..."
-LOOP_DEVICE=$(losetup --find --show --partscan "$PV_FILE")
-echo "✓ Loop device with partitions: $LOOP_DEVICE"
-
-# Verify partition devices exist
-for i in 1 2 3; do
-    if [ ! -e "${{LOOP_DEVICE}}p$i" ]; then
-        echo "Error: Partition device ${{LOOP_DEVICE}}p$i not created"
+# Incremental mode (INCREMENTAL=1): when the previous image at $WIC_PATH was
+# built with the same layout, reuse it and only sync the rootfs changes into
+# the existing filesystems; otherwise do a full build
+LAYOUT_ID="{layout_id}"
+REUSE=0
+if [ "${{INCREMENTAL:-0}}" = "1" ] && [ -f "$WIC_PATH" ] && \\
+   [ "$(cat "$WIC_PATH.layout" 2>/dev/null)" = "$LAYOUT_ID" ]; then
+    REUSE=1
+    echo "Incremental: reusing $WIC_PATH (layout unchanged)"
+elif [ "${{INCREMENTAL:-0}}" = "1" ]; then
+    echo "Incremental: no previous image with this layout, doing a full build"
+fi
+rm -f "$WIC_PATH.layout"
+
+# Release what a killed earlier run of this image still holds (mounts, VG,
+# LUKS mapping, loop device), then continue its journal if the layout, the
+# partial image and the source trees allow
+journal reclaim "$JOURNAL" || true
+FRESH=""
+if [ "$RESUME" != "1" ] || [ "$REUSE" = "1" ]; then
+    FRESH="--fresh"
+fi
+{tree_signatures}
+DONE_STEPS="$(journal resume "$JOURNAL" --key "$LAYOUT_ID" --image "$PV_FILE" \\
+    --owner-pid $$ --build-id "$BUILD_ID" {resume_inputs} $FRESH)"
+if [ -n "$DONE_STEPS" ]; then
+    echo "Resuming an interrupted run, finished steps:" $DONE_STEPS
+fi
+
+# Built in place next to the output (not in /tmp, which is often tmpfs) and
+# renamed when complete, so the image is never copied
+TRACE_IMAGE="$PV_FILE"
+if [ "$REUSE" = "1" ]; then
+    mv -f "$WIC_PATH" "$PV_FILE"
+    for step in {reuse_steps}; do
+        checkpoint "$step"
+    done
+elif step_done image; then
+    echo "Phases 1-3: Reusing the partial image $PV_FILE"
+else
+    # Create sparse disk image
+    echo "Phase 1: Creating sparse disk image..."
+    trace_phase create-image
+    rm -f "$PV_FILE"
+    dd if=/dev/zero of="$PV_FILE" bs=1M count=0 seek={total_size_mb}
+    echo "✓ Sparse image created: $PV_FILE"
+
+    # Write the pre-built GPT (protective MBR, primary and backup tables)
+    echo "Phase 3: Writing GPT partition table..."
+    trace_phase gpt
+    GPT_DIR="$(dirname "$(readlink -f "$0")")"
+    dd if="$GPT_DIR/{gpt_head_name}" of="$PV_FILE" conv=notrunc status=none
+    dd if="$GPT_DIR/{gpt_tail_name}" of="$PV_FILE" bs=512 seek={gpt_tail_sector} conv=notrunc status=none
+    echo "✓ Partitions created"
+    checkpoint image
+fi
+
+# Attach loop device once, with partition scanning and direct I/O
+echo "Phase 5: Attaching loop device with --partscan..."
+trace_phase attach
+looplease reap || true
+LOOP_DEVICE=$(looplease attach --owner-pid $$ --build-id "$BUILD_ID" "$PV_FILE")
+echo "✓ Loop device with partitions: $LOOP_DEVICE (direct I/O: $(cat /sys/block/${{LOOP_DEVICE#/dev/}}/loop/dio 2>/dev/null || echo 0))"
+MNT_DIR="$(mktemp -d /tmp/lvm-mnt-$BUILD_ID.XXXXXX)"
+journal owner "$JOURNAL" --owner-pid $$ loop="$LOOP_DEVICE" luks="$NS_LUKS" vg="$NS_VG" mnt_dir="$MNT_DIR"
+
+# Wait for the partition device nodes (fails after a deadline)
+wait_devices "${{LOOP_DEVICE}}p1" "${{LOOP_DEVICE}}p2" "${{LOOP_DEVICE}}p3"
+
+# Partitions and volumes that an interrupted run (or the image reused by
+# INCREMENTAL=1) already formatted are kept. EFI and XBOOTLDR are formatted
+# in the background while LUKS and LVM are set up on partition 3
+if ! step_done efi; then
+    echo "Phase 6: Formatting EFI partition (background)..."
+    run_step efi mkfs.vfat -F 32 -n efi "${{LOOP_DEVICE}}p1"
+fi
+if ! step_done xbootldr; then
+    echo "Phase 7: Formatting XBOOTLDR partition (background)..."
+    run_step xbootldr mkfs.ext4 -U 5d7e1b2c-3f4a-4c8d-9e22-1a6b7c8d9e33 -L xbootldr "${{LOOP_DEVICE}}p2"
+fi
+
+if step_done luks; then
+    # Open the existing LUKS volume and take over its VG
+    echo "Phase 8: Opening existing LUKS volume..."
+    trace_phase luks
+    (
+        flock 9
+        {luks_open_cmd} "${{LOOP_DEVICE}}p3" "$NS_LUKS"
+        wait_devices "/dev/mapper/$NS_LUKS"
+        if step_done lvm; then
+            claim_vg
+        fi
+    ) 9>"$NAME_LOCK"
+    LUKS_UUID="$(journal get "$JOURNAL" luks uuid || true)"
+    if [ -n "$LUKS_UUID" ] && [ "$(cryptsetup luksUUID "${{LOOP_DEVICE}}p3")" != "$LUKS_UUID" ]; then
+        echo "Error: $PV_FILE does not hold the LUKS volume $LUKS_UUID of $JOURNAL (RESUME=0 starts over)"
         exit 1
     fi
-done
+    echo "✓ Existing LUKS volume opened: /dev/mapper/$NS_LUKS"
+else
+    # Create LUKS volume
+    echo "Phase 8: Setting up LUKS encryption..."
+    trace_phase luks
+    {luks_fmt_cmd} "${{LOOP_DEVICE}}p3"
+    {luks_open_cmd} "${{LOOP_DEVICE}}p3" "$NS_LUKS"
+    wait_devices "/dev/mapper/$NS_LUKS"
+    checkpoint luks --info uuid="$(cryptsetup luksUUID "${{LOOP_DEVICE}}p3")"
+    echo "✓ LUKS volume opened: /dev/mapper/$NS_LUKS"
+fi
 
-# Format EFI partition
-echo "Phase 6: Formatting EFI partition..."
-mkfs.vfat -F 32 -n efi "${{LOOP_DEVICE}}p1"
-echo "✓ EFI partition formatted"
-
-# Format XBOOTLDR partition
-echo "Phase 7: Formatting XBOOTLDR partition..."
-mkfs.ext4 -U 5d7e1b2c-3f4a-4c8d-9e22-1a6b7c8d9e33 -L xbootldr "${{LOOP_DEVICE}}p2"
-echo "✓ XBOOTLDR partition formatted"
-
-# Create LUKS volume
-echo "Phase 8: Setting up LUKS encryption..."
-{luks_fmt_cmd} "${{LOOP_DEVICE}}p3"
-{luks_open_cmd} "${{LOOP_DEVICE}}p3" {luks_name}
-echo "✓ LUKS volume opened: /dev/mapper/{luks_name}"
-
-# Create LVM
-echo "Phase 9: Creating LVM..."
-lvm pvcreate --nolocking -ff -y /dev/mapper/{luks_name}
-lvm vgcreate --nolocking {vg_name} /dev/mapper/{luks_name}
-echo "✓ LVM VG created: {vg_name}"
-
-# Create logical volumes
-echo "Phase 10: Creating logical volumes..."
-{chr(10).join(lv_create_cmds)}
-echo "✓ Logical volumes created"
+if step_done lvm; then
+    lvm vgchange --nolocking -ay "$NS_VG"
+    echo "✓ Existing VG {vg_name} activated as $NS_VG"
+else
+    # Create the PV, VG and all LVs in one lvm shell session, then read
+    # back the extent allocation
+    echo "Phases 9-10: Creating LVM volume group and logical volumes..."
+    trace_phase lvm
+    PYTHONPATH="{lvmimage_dir}" python3 -m lvmimage.lvmshell --nolocking --vg "$NS_VG" \\
+        --plan {lvm_plan} --report "$STEP_DIR/lvm-allocation.json" <<LVM_COMMANDS
+{lvm_batch}
+LVM_COMMANDS
+    checkpoint lvm
+    echo "✓ LVM VG created: $NS_VG"
+fi
+
+# Format the logical volumes concurrently
+echo "Phase 10: Formatting logical volumes..."
+trace_phase logical-volumes
+{lv_cmds}
+echo "✓ Partitions and logical volumes formatted"
 
 # Mount and populate
 echo "Phase 11: Mounting and populating volumes..."
-mkdir -p /mnt/lvm-$$
-mount /dev/{vg_name}/{rootfs_name} /mnt/lvm-$$
-rsync -avx "$ROOTFS_DIR/" /mnt/lvm-$$/
-umount /mnt/lvm-$$
-rmdir /mnt/lvm-$$
-echo "✓ Volumes populated with rootfs"
-
+trace_phase populate
+# rsync continues the population of an interrupted run: files it already
+# copied are skipped, and --delete makes an incremental run drop files
+# removed from the rootfs
+if ! step_done populate-{rootfs_name}; then
+    mkdir -p "$MNT_DIR/{rootfs_name}"
+    mount "/dev/$NS_VG/{rootfs_name}" "$MNT_DIR/{rootfs_name}"
+    rsync -avx --delete{rsync_excludes(rootfs_tree)} "$ROOTFS_DIR/" "$MNT_DIR/{rootfs_name}/"
+    umount "$MNT_DIR/{rootfs_name}"
+    checkpoint populate-{rootfs_name} --input "$TREE_0"
+    echo "✓ Volumes populated with rootfs"
+fi
+{populate_block}
 # Mount other volumes if needed
-for lv_name in {' '.join([lv.name for lv in additional_lvs])}; do
+for lv_name in {empty_lvs}; do
     if [ ! -z "$lv_name" ]; then
-        mkdir -p "/mnt/lvm-$lv_name-$$"
-        mount "/dev/{vg_name}/$lv_name" "/mnt/lvm-$lv_name-$$"
+        mkdir -p "$MNT_DIR/$lv_name"
+        mount "/dev/$NS_VG/$lv_name" "$MNT_DIR/$lv_name"
         # Populate empty volume
         sync
-        umount "/mnt/lvm-$lv_name-$$"
-        rmdir "/mnt/lvm-$lv_name-$$"
+        umount "$MNT_DIR/$lv_name"
     fi
 done
 
-# Copy sparse image to output location
+# Tear down all devices so every write has reached the image file, then
+# move it into place and write the block map for bmaptool
 echo "Phase 12: Finalizing disk image..."
-cp "$PV_FILE" "$WIC_PATH"
+trace_phase finalize
+KEEP_IMAGE=1
+trap - EXIT
+cleanup
+mv -f "$PV_FILE" "$WIC_PATH"
+journal finish "$JOURNAL"
+TRACE_IMAGE="$WIC_PATH"
+echo "$LAYOUT_ID" > "$WIC_PATH.layout"
 echo "✓ Disk image finalized: $WIC_PATH"
+if PYTHONPATH="{lvmimage_dir}" python3 -m lvmimage.bmap "$WIC_PATH"; then
+    echo "✓ Block map written: $WIC_PATH.bmap"
+else
+    echo "Warning: could not write $WIC_PATH.bmap"
+fi
+# COMPRESS=zst: seekable multi-frame $WIC_PATH.zst (holes are not read)
+if [ "${{COMPRESS:-}}" = "zst" ]; then
+    PYTHONPATH="{lvmimage_dir}" python3 -m lvmimage.zstdseek compress "$WIC_PATH"
+fi
+trace_phase ""
+write_trace
+rm -rf "$STEP_DIR"
 
 echo ""
 echo "=== Disk Image Creation Complete ==="
 echo "Image: $WIC_PATH"
+echo "Flash: bmaptool copy $WIC_PATH <device>"
 echo "Size: {total_size_mb}MB"
 echo "VG: {vg_name}"
 echo "Partitions: EFI ({efi_size_mb}MB) + XBOOTLDR ({boot_size_mb}MB) + LUKS+LVM ({crypt_size_mb}MB)"
@@ -954,6 +951,25 @@ class LvmRootfsPlugin(SourcePlugin):
 
     name = 'lvmrootfs'
 
+    @staticmethod
+    def _partition_types() -> Dict:
+        """Partition type GUIDs from the PARTTYPE_* BitBake variables"""
+        return {
+            'esp': get_bitbake_var('PARTTYPE_ESP'),
+            'xbootldr': get_bitbake_var('PARTTYPE_XBOOTLDR'),
+            'root': get_bitbake_var('PARTTYPE_ROOT'),
+        }
+
+    @staticmethod
+    def _image_dir(cr_workdir: str) -> str:
+        """Directory of the default lvm-image
+
+        The image recipe's WORKDIR outlives the build, so an incremental
+        build finds the previous image there; cr_workdir is a new temporary
+        directory for every wic run and is only used outside BitBake.
+        """
+        return get_bitbake_var('WORKDIR') or cr_workdir
+
     @classmethod
     def do_prepare_partition(cls, part, source_params, cr, cr_workdir, oe_builddir, bootimg_dir, kernel_dir, rootfs_dir, native_sysroot):
         """Main entry point for WIC plugin
@@ -965,62 +981,83 @@ class LvmRootfsPlugin(SourcePlugin):
             logger.info("=== LVM RootFS WIC Plugin (Generate Shell Script Mode) ===")
             logger.info("=== PHASE 1: Parsing WKS Configuration ===")
 
-            # Parse WKS parameters
-            vg_name = source_params.get('lvm-vg-name', 'vg0')
-            rootfs_name = source_params.get('lvm-rootfs-name', 'rootlv')
-            rootfs_uuid = source_params.get('lvm-rootfs-uuid', '')
-            luks_name = source_params.get('luks-name', 'cryptroot')
-            luks_passphrase = source_params.get('luks-passphrase')
-            
-            # Support both 'NULL' and 'NONE' for disabling LUKS
-            if luks_passphrase in ('NULL', 'NONE'):
-                luks_passphrase = None
-                luks_enabled = False
-            else:
-                luks_enabled = True
-
-            volumes_str = source_params.get('lvm-volumes', '')
-            volumes_uuids_str = source_params.get('lvm-volumes-uuids', '')
-            
-            # Parse LV UUIDs
-            volume_uuids = {}
-            if volumes_uuids_str:
-                for uuid_pair in volumes_uuids_str.split(','):
-                    vol_name, vol_uuid = uuid_pair.split(':')
-                    volume_uuids[vol_name.strip()] = vol_uuid.strip()
-            
-            additional_lvs = []
-            if volumes_str:
-                for vol in volumes_str.split(','):
-                    name, size = vol.split(':')
-                    name = name.strip()
-                    size = size.strip()
-                    vol_uuid = volume_uuids.get(name, '')
-                    lv = LogicalVolumeSpec(name, size)
-                    if vol_uuid:
-                        lv.uuid = vol_uuid
-                    additional_lvs.append(lv)
-
-            # Configuration
-            config = DiskConfig(
-                vg_name=vg_name,
-                luks_name=luks_name,
-                luks_passphrase=luks_passphrase,
-                rootfs_lv=LogicalVolumeSpec(rootfs_name, 'CALCULATED', uuid=rootfs_uuid),
-                additional_lvs=additional_lvs,
-                luks_enabled=luks_enabled
-            )
+            config, assembly, generated_uuids = _parse_source_params(source_params)
+            vg_name = config.vg_name
+            rootfs_name = config.rootfs_lv.name
+            rootfs_uuid = config.rootfs_lv.uuid
+            luks_name = config.luks_name
+            luks_passphrase = config.luks_passphrase
+            luks_enabled = config.luks_enabled
+            additional_lvs = config.additional_lvs
 
             logger.info(f"Configuration validated: VG={vg_name}, LVs={1+len(additional_lvs)}")
 
+            # Keep the rootfs scan cache with the build (lvmimage.scan)
+            os.environ.setdefault('LVMROOTFS_SCAN_CACHE',
+                                  os.path.join(cls._image_dir(cr_workdir), 'lvmrootfs-scan'))
+
             # Calculate sizes
             total_size_mb = int(part.size) + (int(part.extra_space) if part.extra_space else 0)
             efi_size_mb = 512
             boot_size_mb = 1024
-            crypt_size_mb = total_size_mb - efi_size_mb - boot_size_mb - 10
-
-            # Calculate rootfs LV size
-            rootfs_lv_size_mb = config.calculate_rootfs_lv_size(crypt_size_mb)
+            # With LUKS the PV starts after the 16 MiB LUKS2 header and
+            # keyslot area (the generated script always formats LUKS, with an
+            # empty passphrase when it is disabled)
+            luks_header = luks_enabled or assembly == 'script'
+            rekey_tool = os.path.join(rootfs_dir, 'usr', 'sbin', 'luks-rekey')
+            if luks_header and config.luks_pbkdf.rekey and not os.path.exists(rekey_tool):
+                logger.warning("The LUKS volume is marked for re-keying on first boot, but the "
+                               "rootfs has no luks-rekey; add luks-rekey to IMAGE_INSTALL or "
+                               "set luks-rekey=none")
+
+            sizing_mode = source_params.get('lvm-sizing', 'fixed')
+            if sizing_mode not in ('fixed', 'auto'):
+                raise Exception(f"Unknown lvm-sizing '{sizing_mode}' (expected 'fixed' or 'auto')")
+            if sizing_mode == 'auto':
+                # Size the rootfs LV and the image from the rootfs content
+                # instead of the worst case given by --size
+                # (LVs with a mountpoint are sized for their subtree, which
+                # the rootfs LV leaves out)
+                rootfs_tree, *mounted = mounts.source_trees(rootfs_dir, rootfs_name,
+                                                            config.mount_points)
+                usage = sizing.measure_tree(rootfs_dir, exclude=rootfs_tree.excluded)
+                lv_usage = {tree.lv_name: sizing.measure_tree(tree.path, exclude=tree.excluded)
+                            for tree in mounted if os.path.isdir(tree.path)}
+                planned = sizing.plan_image_size(
+                    config, usage, efi_size_mb, boot_size_mb, luks_header,
+                    headroom=source_params.get('lvm-rootfs-headroom', sizing.DEFAULT_HEADROOM),
+                    relative_lv_mb=_parse_size_mb(source_params.get('lvm-auto-free', '256M')),
+                    block_size=luks2.DATA_SECTOR_SIZE if luks_enabled and assembly == 'offset' else None,
+                    lv_usage=lv_usage)
+                logger.info(f"Measured rootfs: {usage.files} files, {usage.inodes} inodes, "
+                            f"{usage.bytes // (1024 * 1024)}MB data, {usage.hardlinks} extra hardlinks")
+                logger.info(f"Automatic sizing: {planned.total_size_mb}MB image instead of "
+                            f"{total_size_mb}MB (--size)")
+                total_size_mb = planned.total_size_mb
+                rootfs_lv_size_mb = planned.rootfs_lv_mb
+            # Partition 3 as the GPT layout places it
+            crypt_bytes = compute_partition_layout(total_size_mb, efi_size_mb, boot_size_mb).crypt.size
+            crypt_size_mb = crypt_bytes // (1024 * 1024)
+
+            if sizing_mode == 'fixed':
+                # Rootfs LV size from the actual partition 3 size
+                pv_bytes = luks2.payload_size(crypt_bytes) if luks_header else crypt_bytes
+                pv_size_mb = pv_bytes // (1024 * 1024)
+                # LVs with a mountpoint need room for their subtree; a
+                # relatively sized one would otherwise get a single extent
+                headroom = source_params.get('lvm-rootfs-headroom', sizing.DEFAULT_HEADROOM)
+                reserved = {}
+                for tree in mounts.source_trees(rootfs_dir, rootfs_name, config.mount_points)[1:]:
+                    if not os.path.isdir(tree.path):
+                        continue
+                    needed = sizing.ext4_size(sizing.measure_tree(tree.path, exclude=tree.excluded),
+                                              headroom)
+                    lv = next(lv for lv in additional_lvs if lv.name == tree.lv_name)
+                    if lv.size_mb and needed > lv.size_mb * 1024 * 1024:
+                        raise Exception(f"LV {lv.name} ({lv.size_mb}MB) is too small for its "
+                                        f"{needed // (1024 * 1024)}MB of content")
+                    reserved[lv.name] = needed
+                rootfs_lv_size_mb = config.calculate_rootfs_lv_size(pv_size_mb, reserved)
             config.rootfs_lv.size_mb = rootfs_lv_size_mb
             config.rootfs_lv.size_str = f"{rootfs_lv_size_mb}M"
 
@@ -1029,6 +1066,99 @@ class LvmRootfsPlugin(SourcePlugin):
             logger.info(f"  BOOT: {boot_size_mb}MB")
             logger.info(f"  LUKS + LVM: {crypt_size_mb}MB (Rootfs LV: {rootfs_lv_size_mb}MB)")
 
+            if assembly == 'offset':
+                image_path = source_params.get('lvm-image') or os.path.join(cls._image_dir(cr_workdir),
+                                                                             f'lvm-{vg_name}.wic')
+                workdir = os.path.join(cr_workdir, f'lvm-{vg_name}-work')
+                part_types = cls._partition_types()
+                incremental = source_params.get('lvm-incremental', '0') in ('1', 'yes', 'true')
+                compress = source_params.get('lvm-compress', '')
+                if compress not in ('', 'none', 'zstd'):
+                    raise Exception(f"Unknown lvm-compress '{compress}' (expected 'zstd' or 'none')")
+                resume = source_params.get('lvm-resume', '1') in ('1', 'yes', 'true')
+                in_run_workdir = (not source_params.get('lvm-image')
+                                  and os.path.dirname(image_path) == cr_workdir)
+                if (resume or incremental) and in_run_workdir:
+                    logger.warning(f"No WORKDIR outside BitBake: {image_path} is in this run's "
+                                   "work directory, so the next run cannot resume or update it; "
+                                   "set lvm-image to keep it")
+                if incremental:
+                    adopt_previous_uuids(image_path, [config.rootfs_lv] + additional_lvs,
+                                         generated_uuids)
+                if resume:
+                    # An interrupted assembly is continued with the UUIDs
+                    # its finished steps were formatted with
+                    journal.adopt_uuids(image_path, [config.rootfs_lv] + additional_lvs,
+                                        generated_uuids)
+                else:
+                    journal.Journal(journal.journal_path(image_path)).finish()
+                fingerprint = layout_fingerprint(config, total_size_mb, efi_size_mb, boot_size_mb,
+                                                 part_types)
+
+                # Per-phase trace next to the image, also for failed builds
+                tracer = trace.start(image_path)
+                try:
+                    updated = None
+                    if incremental:
+                        logger.info("=== PHASE 2: Incremental Image Update ===")
+                        with trace.span('incremental-update'):
+                            updated = update_image(
+                                config, image_path, rootfs_dir, fingerprint, workdir, _run_cmd,
+                                rebuild_efi=lambda offset, size: rebuild_efi_partition(
+                                    _run_cmd, image_path, ByteRange(offset, size), rootfs_dir, workdir))
+                    if updated is not None:
+                        logger.info(f"✓ Disk image updated in place: {image_path} "
+                                    f"({updated['created']} written, {updated['removed']} removed, "
+                                    f"{updated['metadata']} attribute changes"
+                                    f"{', ESP rebuilt' if updated['efi_rebuilt'] else ''})")
+                    else:
+                        logger.info("=== PHASE 2: Offset-Based Image Assembly (rootless) ===")
+                        discard_manifest(image_path)
+                        with trace.span('assemble'):
+                            result = assemble_disk_image(
+                                config=config,
+                                image_path=image_path,
+                                rootfs_dir=rootfs_dir,
+                                total_size_mb=total_size_mb,
+                                efi_size_mb=efi_size_mb,
+                                boot_size_mb=boot_size_mb,
+                                workdir=workdir,
+                                run_cmd=_run_cmd,
+                                part_types=part_types,
+                                journal_key=fingerprint if resume else None
+                            )
+                        if result['resumed']:
+                            logger.info(f"✓ Resumed an interrupted assembly: "
+                                        f"{', '.join(result['resumed'])} kept")
+                        logger.info(f"✓ Disk image assembled: {image_path}")
+                        if incremental:
+                            with trace.span('manifest'):
+                                write_manifest(image_path, fingerprint, result, config, rootfs_dir)
+                            logger.info("✓ Content manifest written for incremental rebuilds")
+                    # The block map and the compressed image both read the
+                    # freshly written (page cached) data, so run them together
+                    outputs = ExecutionPlan(max_workers=2)
+                    outputs.add_step('bmap', write_bmap, [image_path], outputs=['bmap'])
+                    if compress == 'zstd':
+                        outputs.add_step('zstd', compress_image, [image_path],
+                                         {'level': int(source_params.get('lvm-compress-level', '3'))},
+                                         outputs=['zstd'])
+                    outputs.execute()
+                    bmap_path, mapped = outputs.state['bmap']
+                    logger.info(f"✓ Block map written: {bmap_path} ({mapped // (1024 * 1024)}MB mapped)")
+                    if compress == 'zstd':
+                        zst = outputs.state['zstd']
+                        logger.info(f"✓ Seekable zstd image written: {zst['path']} "
+                                    f"({zst['compressed_size'] // (1024 * 1024)}MB, {zst['frames']} frames, "
+                                    f"{zst['zero_frames']} holes)")
+                finally:
+                    try:
+                        trace_path, _ = tracer.write()
+                        logger.info(f"Trace summary ({trace_path}):\n" + tracer.summary())
+                    except Exception as e:
+                        logger.warning(f"Could not write trace: {e}")
+                return
+
             # Get directories
             # Write script to /tmp for easy access (avoids BitBake file conflicts)
             script_dir = os.path.join('/tmp', f'wic-lvm-{os.getpid()}')
@@ -1039,6 +1169,18 @@ class LvmRootfsPlugin(SourcePlugin):
             logger.info(f"=== PHASE 2: Generating Shell Script ===")
             logger.info(f"Script path: {script_path}")
 
+            # Pre-build the GPT so the script needs neither sgdisk nor a
+            # detach/re-attach cycle to make the kernel see the partitions
+            layout = compute_partition_layout(total_size_mb, efi_size_mb, boot_size_mb,
+                                              cls._partition_types())
+            gpt_head, gpt_tail = gpt.build_gpt(layout.total_size, layout.partitions)
+            gpt_head_name = f'gpt-{config.vg_name}-head.bin'
+            gpt_tail_name = f'gpt-{config.vg_name}-tail.bin'
+            with open(os.path.join(script_dir, gpt_head_name), 'wb') as f:
+                f.write(gpt_head)
+            with open(os.path.join(script_dir, gpt_tail_name), 'wb') as f:
+                f.write(gpt_tail)
+
             # Generate the shell script
             shell_script = _generate_shell_script(
                 config=config,
@@ -1052,7 +1194,11 @@ class LvmRootfsPlugin(SourcePlugin):
                 luks_enabled=luks_enabled,
                 rootfs_name=rootfs_name,
                 rootfs_uuid=rootfs_uuid,
-                additional_lvs=additional_lvs
+                additional_lvs=additional_lvs,
+                gpt_head_name=gpt_head_name,
+                gpt_tail_name=gpt_tail_name,
+                gpt_tail_sector=(layout.total_size - len(gpt_tail)) // gpt.SECTOR_SIZE,
+                generated_uuids=generated_uuids
             )
 
             # Write script to file